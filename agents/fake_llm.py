@@ -0,0 +1,374 @@
+"""
+Offline chat model for load tests (KP_LLM_BACKEND=fake): scripted or templated
+Keeper replies and tool calls, with a configurable latency distribution, error
+rate and reply length, and usage metadata counted with the local tokenizer
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from agents.intent import classify_scene_intent
+from agents.scenes import SCENES
+from utils.tokens import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+# Settings of a fake model (FakeChatModel fields; the backend reads them from the environment)
+FAKE_DEFAULTS: Dict[str, Any] = {
+	"latency": os.getenv("KP_FAKE_LATENCY", "lognormal:600:0.5"),  # Time to first token, see latency_sampler
+	"tokens_per_second": float(os.getenv("KP_FAKE_TOKENS_PER_SECOND", "80")),  # Completion speed (0: instant)
+	"error_rate": float(os.getenv("KP_FAKE_ERROR_RATE", "0")),  # Share of calls failing with APIConnectionError
+	"narration_tokens": int(os.getenv("KP_FAKE_NARRATION_TOKENS", "60")),  # Length of templated narration
+	"seed": int(os.getenv("KP_FAKE_SEED", "0")),
+	"script": os.getenv("KP_FAKE_SCRIPT") or None,  # JSON file of scripted replies, see load_script
+}
+
+# Prompt prefixes the provider would have cached (for the cached_tokens usage field)
+_CACHE_MIN_TOKENS = 1024
+_CACHE_BLOCK_TOKENS = 128
+_seen_prefixes: "OrderedDict[str, None]" = OrderedDict()
+_seen_prefixes_lock = threading.Lock()
+_SEEN_PREFIXES_SIZE = 4096
+
+_SCENE_IDS = {scene["name"]: scene_id for scene_id, scene in SCENES.items()}
+_CURRENT_SCENE = re.compile(r"\*\*Current Scene: (.+?)\*\*")
+_SHEET_VALUE = r"\b{}\s+(\d+)"
+_SAN = re.compile(r"^- SAN: (\d+)", re.MULTILINE)
+_OUTCOME = re.compile(r"Critical Success|Extreme Success|Fumble|Success|Failure", re.IGNORECASE)
+
+# (pattern, skill name, sheet field) of the checks the fake Keeper asks for
+_CHECK_CUES: List[Tuple["re.Pattern[str]", str, str]] = [
+	(re.compile(r"\b(?:search|examine|inspect|look for|look under|investigate)\b|搜|检查|调查", re.IGNORECASE), "Spot Hidden", "SPOT"),
+	(re.compile(r"\b(?:listen|eavesdrop|overhear)\b|偷听|听", re.IGNORECASE), "Listen", "LISTEN"),
+	(re.compile(r"\b(?:sneak|hide|creep)\b|潜行|躲", re.IGNORECASE), "Stealth", "STEALTH"),
+	(re.compile(r"\b(?:persuade|convince|charm|lie to)\b|说服|劝", re.IGNORECASE), "Charm", "CHARM"),
+]
+_HORROR = re.compile(r"\b(?:corpse|body|blood|bones|altar|mask|sacrifice|open the coffin)\b|尸体|血|祭坛|面具", re.IGNORECASE)
+
+_NARRATION = [
+	"{npc} watches you for a moment before answering, choosing each word with care.",
+	"The wind carries the smell of smoke and salt through {scene}.",
+	"Somewhere nearby a door creaks, and the murmur of voices stops.",
+	"{npc} glances toward the window, as if expecting someone.",
+	"The lamplight gutters; shadows crowd the corners of the room.",
+	"Nobody in {scene} seems willing to say more than they must.",
+]
+_ARRIVAL = "You arrive at {scene}. {detail}"
+_OUTCOMES = {
+	"critical success": "Everything falls into place at once: you find exactly what you were looking for, and more.",
+	"extreme success": "You notice it immediately, every detail sharp and clear.",
+	"success": "Your effort pays off; you find something worth remembering.",
+	"failure": "Despite your effort, nothing useful turns up.",
+	"fumble": "It goes badly wrong, and you draw unwanted attention.",
+}
+_SUMMARY = """- {name} has been asking questions around Emberhead
+- Last seen in {scene}; the villagers remain guarded about the coming festival
+- SAN {san}"""
+_SUMMARY_SUBJECT = re.compile(r"Player character: (.+?), current SAN (\d+), current scene id: (\w+)")
+
+
+def latency_sampler(spec: str) -> Callable[[random.Random], float]:
+	"""
+	Seconds to the first token, drawn from a distribution given as
+	"fixed:MS", "uniform:LOW_MS:HIGH_MS", "normal:MEAN_MS:SD_MS" or
+	"lognormal:MEDIAN_MS:SIGMA"
+	"""
+	kind, _, args = spec.partition(":")
+	try:
+		values = [float(value) for value in args.split(":")] if args else []
+		if kind == "fixed" and len(values) == 1:
+			return lambda rng: values[0] / 1000
+		if kind == "uniform" and len(values) == 2:
+			return lambda rng: rng.uniform(values[0], values[1]) / 1000
+		if kind == "normal" and len(values) == 2:
+			return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+		if kind == "lognormal" and len(values) == 2:
+			return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+	except ValueError:
+		pass
+	raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+def load_script(path: Optional[str]) -> List[Dict[str, Any]]:
+	"""
+	Scripted replies, tried before the templates on every player input: a JSON
+	list of {"match": regex, "scene": scene ID (optional), and "reply": text or
+	"tool": name with "args"}
+	"""
+	if not path:
+		return []
+	with open(path, encoding="utf-8") as handle:
+		rules = json.load(handle)
+	return [{**rule, "pattern": re.compile(rule["match"], re.IGNORECASE)} for rule in rules]
+
+
+class FakeChatModel(BaseChatModel):
+	"""
+	Deterministic stand-in for ChatOpenAI. The reply, latency and failures of a
+	call depend only on the seed and the messages, so a replayed session behaves
+	the same. Tools (bind_tools) and a JSON schema response_format (bind) are
+	honoured like the real API.
+	"""
+
+	model: str = "fake"
+	temperature: float = 0.7
+	latency: str = FAKE_DEFAULTS["latency"]
+	tokens_per_second: float = FAKE_DEFAULTS["tokens_per_second"]
+	error_rate: float = FAKE_DEFAULTS["error_rate"]
+	narration_tokens: int = FAKE_DEFAULTS["narration_tokens"]
+	seed: int = FAKE_DEFAULTS["seed"]
+	script: Optional[str] = FAKE_DEFAULTS["script"]
+
+	_sample_latency: Callable[[random.Random], float] = PrivateAttr()
+	_rules: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+
+	def model_post_init(self, __context: Any) -> None:
+		self._sample_latency = latency_sampler(self.latency)
+		self._rules = load_script(self.script)
+
+	@property
+	def _llm_type(self) -> str:
+		return "fake-chat"
+
+	def bind_tools(self, tools: Any, **kwargs: Any):
+		return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+	def _rng(self, messages: List[BaseMessage]) -> random.Random:
+		digest = hashlib.sha256(str(self.seed).encode("utf-8"))
+		for message in messages:
+			digest.update(message.type.encode("utf-8"))
+			digest.update(str(message.content).encode("utf-8"))
+		return random.Random(digest.hexdigest())
+
+	def _plan(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> Tuple[AIMessage, float, bool]:
+		"""(reply with usage, seconds to the first token, whether the call fails)"""
+		rng = self._rng(messages)
+		fails = rng.random() < self.error_rate
+		delay = self._sample_latency(rng)
+		reply = _Keeper(self, messages, rng).reply(tools=kwargs.get("tools"), structured=kwargs.get("response_format") is not None)
+		reply.usage_metadata = _usage(messages, reply, kwargs.get("tools"))
+		return reply, delay, fails
+
+	def _generation_seconds(self, reply: AIMessage) -> float:
+		if self.tokens_per_second <= 0:
+			return 0.0
+		return reply.usage_metadata["output_tokens"] / self.tokens_per_second
+
+	def _generate(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+		reply, delay, fails = self._plan(messages, kwargs)
+		time.sleep(delay)
+		if fails:
+			raise _connection_error()
+		time.sleep(self._generation_seconds(reply))
+		return ChatResult(generations=[ChatGeneration(message=reply)])
+
+	async def _agenerate(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+		reply, delay, fails = self._plan(messages, kwargs)
+		await asyncio.sleep(delay)
+		if fails:
+			raise _connection_error()
+		await asyncio.sleep(self._generation_seconds(reply))
+		return ChatResult(generations=[ChatGeneration(message=reply)])
+
+	def _stream(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+		reply, delay, fails = self._plan(messages, kwargs)
+		time.sleep(delay)
+		if fails:
+			raise _connection_error()
+		for chunk, pause in self._chunks(reply):
+			time.sleep(pause)
+			if run_manager and chunk.message.content:
+				run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+			yield chunk
+
+	async def _astream(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+		reply, delay, fails = self._plan(messages, kwargs)
+		await asyncio.sleep(delay)
+		if fails:
+			raise _connection_error()
+		for chunk, pause in self._chunks(reply):
+			await asyncio.sleep(pause)
+			if run_manager and chunk.message.content:
+				await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+			yield chunk
+
+	def _chunks(self, reply: AIMessage) -> Iterator[Tuple[ChatGenerationChunk, float]]:
+		"""Word-sized content chunks (or one tool-call chunk) paced at tokens_per_second, then the usage"""
+		if reply.tool_calls:
+			yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+				{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+				for index, call in enumerate(reply.tool_calls)
+			])), self._generation_seconds(reply)
+		else:
+			words = re.findall(r"\S+\s*", reply.content) or [""]
+			pause = self._generation_seconds(reply) / len(words)
+			for word in words:
+				yield ChatGenerationChunk(message=AIMessageChunk(content=word)), pause
+		yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=reply.usage_metadata)), 0.0
+
+
+class _Keeper:
+	"""Templated replies of one call, read from the prompt the way the real Keeper would"""
+
+	def __init__(self, model: FakeChatModel, messages: List[BaseMessage], rng: random.Random):
+		self.model = model
+		self.messages = messages
+		self.rng = rng
+		system = "\n".join(msg.content for msg in messages if isinstance(msg, SystemMessage) and isinstance(msg.content, str))
+		self.system = system
+		match = _CURRENT_SCENE.search(system)
+		self.scene = _SCENE_IDS.get(match.group(1).strip(), "arrival_village") if match else "arrival_village"
+		last = messages[-1] if messages else HumanMessage(content="")
+		self.last = last
+		self.text = last.content if isinstance(last.content, str) else ""
+
+	def reply(self, tools: Optional[List[Dict[str, Any]]], structured: bool) -> AIMessage:
+		if not tools and not structured and not self.system:
+			return AIMessage(content=self._summary())
+
+		narration, calls = self._decide(tool_names={tool["function"]["name"] for tool in tools or []} or None, structured=structured)
+		if not structured:
+			return AIMessage(content="" if calls else narration, tool_calls=calls)
+		checks = []
+		scene_change = None
+		for call in calls:
+			if call["name"] == "change_scene":
+				scene_change = call["args"]["target_scene_id"]
+			elif call["name"] == "roll_dice":
+				checks.append({"kind": "dice", "san_loss": None, **call["args"]})
+			elif call["name"] == "san_check":
+				checks.append({"kind": "san", "skill_name": None, "difficulty": None, "skill_value": None, "san_loss": call["args"]["san_loss"]})
+		if scene_change is not None:
+			narration = self._arrival(scene_change)
+		return AIMessage(content=json.dumps({"narration": "" if checks else narration, "checks": checks, "scene_change": scene_change}))
+
+	def _decide(self, tool_names: Optional[set], structured: bool) -> Tuple[str, List[Dict[str, Any]]]:
+		"""Narration and the tool calls of the reply (tool_names None: any Keeper tool, structured)"""
+		def allowed(name: str) -> bool:
+			return structured or (tool_names is not None and name in tool_names)
+
+		if isinstance(self.last, ToolMessage):
+			if self.last.content.startswith("✓"):
+				return self._arrival(self.scene), []
+			return self._outcome(self.last.content), []
+		if not isinstance(self.last, HumanMessage):
+			return self._narration(), []
+		if re.match(r"(?:.*\n\n)?(?:Check results:|Dice roll result:|SAN check result:)", self.text, re.DOTALL):
+			return self._outcome(self.text), []
+
+		for rule in self.model._rules:
+			if rule.get("scene") not in (None, self.scene) or not rule["pattern"].search(self.text):
+				continue
+			if "tool" in rule and allowed(rule["tool"]):
+				return "", [self._call(rule["tool"], rule.get("args", {}))]
+			if "reply" in rule:
+				return rule["reply"], []
+
+		intent = classify_scene_intent(self.scene, self.text)
+		# Like the Keeper, also follow a movement cue to a scene named only by a keyword or an NPC
+		# ("her house"), which the local classifier leaves to the LLM
+		if (intent.confidence == "high" or intent.reason == "no place name") and allowed("change_scene"):
+			return "", [self._call("change_scene", {"target_scene_id": intent.target, "current_scene_id": self.scene})]
+		if _HORROR.search(self.text) and allowed("san_check"):
+			return "", [self._call("san_check", {"current_san": self._san(), "san_loss": self.rng.randint(1, 3)})]
+		for pattern, skill, field in _CHECK_CUES:
+			if pattern.search(self.text) and allowed("roll_dice"):
+				return "", [self._call("roll_dice", {"skill_name": skill, "difficulty": "normal", "skill_value": self._sheet(field)})]
+		return self._narration(), []
+
+	def _call(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+		return {"name": name, "args": args, "id": f"call_{self.rng.getrandbits(96):024x}"}
+
+	def _sheet(self, field: str) -> int:
+		match = re.search(_SHEET_VALUE.format(field), self.system)
+		return int(match.group(1)) if match else 50
+
+	def _san(self) -> int:
+		match = _SAN.search(self.system)
+		return int(match.group(1)) if match else 60
+
+	def _pad(self, text: str) -> str:
+		"""Templated sentences until the text is about narration_tokens long"""
+		scene = SCENES.get(self.scene, {})
+		npcs = [npc["name"].split("/")[0] for npc in scene.get("npcs", [])] or ["A villager"]
+		sentences = [text] if text else []
+		while count_tokens(" ".join(sentences)) < self.model.narration_tokens:
+			template = self.rng.choice(_NARRATION)
+			sentences.append(template.format(npc=self.rng.choice(npcs), scene=scene.get("name", "the village")))
+		return " ".join(sentences)
+
+	def _narration(self) -> str:
+		return self._pad("")
+
+	def _arrival(self, scene_id: str) -> str:
+		scene = SCENES.get(scene_id, {})
+		detail = (scene.get("description") or "").strip().split("\n")[0][:200]
+		self.scene = scene_id
+		return self._pad(_ARRIVAL.format(scene=scene.get("name", scene_id), detail=detail))
+
+	def _outcome(self, text: str) -> str:
+		match = _OUTCOME.search(text)
+		return self._pad(_OUTCOMES[match.group(0).lower()] if match else "")
+
+	def _summary(self) -> str:
+		match = _SUMMARY_SUBJECT.search(self.text)
+		name, san, scene_id = match.groups() if match else ("The investigator", "?", self.scene)
+		return _SUMMARY.format(name=name, san=san, scene=SCENES.get(scene_id, {}).get("name", scene_id))
+
+
+def _usage(messages: List[BaseMessage], reply: AIMessage, tools: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+	"""Usage metadata like OpenAI's: prompt tokens (with the cached prefix) and completion tokens"""
+	prompt_tokens = 0
+	for message in messages:
+		prompt_tokens += MESSAGE_OVERHEAD_TOKENS + count_tokens(message.content if isinstance(message.content, str) else "")
+		for call in getattr(message, "tool_calls", None) or []:
+			prompt_tokens += count_tokens(call["name"]) + count_tokens(json.dumps(call["args"]))
+	if tools:
+		prompt_tokens += count_tokens(json.dumps(tools))
+	completion_tokens = count_tokens(reply.content) + sum(
+		count_tokens(call["name"]) + count_tokens(json.dumps(call["args"])) for call in reply.tool_calls
+	)
+	return {
+		"input_tokens": prompt_tokens,
+		"output_tokens": completion_tokens,
+		"total_tokens": prompt_tokens + completion_tokens,
+		"input_token_details": {"cache_read": _cached_tokens(messages)},
+	}
+
+
+def _cached_tokens(messages: List[BaseMessage]) -> int:
+	"""The system prompt counts as cached (in 128-token blocks, from 1024 tokens) once it was seen before"""
+	if not messages or not isinstance(messages[0], SystemMessage) or not isinstance(messages[0].content, str):
+		return 0
+	tokens = count_tokens(messages[0].content)
+	if tokens < _CACHE_MIN_TOKENS:
+		return 0
+	key = hashlib.sha256(messages[0].content.encode("utf-8")).hexdigest()
+	with _seen_prefixes_lock:
+		seen = key in _seen_prefixes
+		_seen_prefixes[key] = None
+		_seen_prefixes.move_to_end(key)
+		while len(_seen_prefixes) > _SEEN_PREFIXES_SIZE:
+			_seen_prefixes.popitem(last=False)
+	return tokens // _CACHE_BLOCK_TOKENS * _CACHE_BLOCK_TOKENS if seen else 0
+
+
+def _connection_error() -> openai.APIConnectionError:
+	return openai.APIConnectionError(
+		message="Fake backend: injected connection error",
+		request=httpx.Request("POST", "http://fake-llm/v1/chat/completions"),
+	)
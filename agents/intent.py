@@ -0,0 +1,119 @@
+"""
+Local scene-change intent: keyword and regex tables instead of an LLM call.
+
+The tables mirror the change_scene rules the Keeper is prompted with (see
+agents.rules): a movement or acceptance cue ("I go to", "I accept her offer",
+"我去") and exactly one reachable scene named in the same sentence by a
+distinctive place name ("the ruined church", see places_mentioned) is a
+high-confidence scene change. A generic keyword ("hall", "home") or an NPC
+("May", "the priest") only points to a scene (low confidence, see
+transitions_mentioned), and looking from afar, asking about a place, dreaming
+and questions never change it.
+"""
+import os
+import re
+from typing import NamedTuple, Optional
+
+from agents.scenes import places_mentioned, transitions_mentioned
+from utils.metrics import counter
+
+# "off": no classification; "shadow": classify and compare with the Keeper's own
+# change_scene (kp_scene_intent_total); "on": perform high-confidence changes up front
+INTENT_MODES = ("off", "shadow", "on")
+INTENT_MODE = (os.getenv("KP_SCENE_INTENT") or "off").strip().lower()
+if INTENT_MODE not in INTENT_MODES:
+	raise ValueError(f"Unknown KP_SCENE_INTENT: {INTENT_MODE!r} (expected one of {', '.join(INTENT_MODES)})")
+
+# Scenes never entered on a keyword; the Keeper decides when the story has ended
+NO_PREEMPT = {"ending"}
+
+SCENE_INTENT = counter(
+	"kp_scene_intent_total", "High-confidence scene intents against the turn's actual scene change", ["outcome"]
+)  # tp / fp / fn / tn (shadow mode); precision = tp / (tp + fp), recall = tp / (tp + fn); preempted (on)
+
+_SENTENCES = re.compile(r"[^.!?;。！？；\n]+")
+
+_MOVE = re.compile(
+	r"\b(?:go(?:es|ing)?|went|walk(?:s|ed|ing)?|head(?:s|ed|ing)?|enter(?:s|ed|ing)?|return(?:s|ed|ing)?|"
+	r"visit(?:s|ed|ing)?|travel(?:s|ed|ing)?|follow(?:s|ed|ing)?|run(?:s|ning)?|ran|hurr(?:y|ies|ied)|"
+	r"make my way|step(?:s|ped)? (?:in|inside|into)|come back|accompan(?:y|ies|ied))\b"
+	r"|去|前往|走向|走进|走到|进入|进去|回到|回去|跟着|跟随|赶往|来到",
+	re.IGNORECASE,
+)
+_ACCEPT = re.compile(
+	r"\b(?:accept(?:s|ed|ing)?|take (?:her|him|them) up on|stay(?:ing)? (?:the night|at|with|over))\b"
+	r"|接受|答应|住下|留宿|过夜|住一晚",
+	re.IGNORECASE,
+)
+_NEGATIVE = re.compile(
+	r"\b(?:look(?:s|ed|ing)? (?:at|toward|towards|over)|see|watch(?:es|ed|ing)?|stare|gaze|from afar|"
+	r"in the distance|distant|window|ask(?:s|ed|ing)? (?:\w+ )?about|talk(?:s|ed|ing)? about|"
+	r"dream(?:s|ed|t|ing)?|remember(?:s|ed|ing)?|think(?:s|ing)? about|wonder(?:s|ed|ing)?|"
+	r"should I|shall I|can I|could I|may I|might I|would I|whether|later|tomorrow)\b"
+	# A question without its question mark ("May I go with you")
+	r"|(?:^|(?<=[.!?;。！？；\n]))\s*(?:may|might|can|could|shall|should|would|will)\s+(?:I|we)\b"
+	r"|远远|远处|望向|眺望|窗外|问问|打听|梦|回忆|想起|要不|是否|明天|之后再",
+	re.IGNORECASE,
+)
+
+
+class SceneIntent(NamedTuple):
+	target: Optional[str]  # Scene ID the player means to move to
+	confidence: str  # "high" / "low" / "none"
+	reason: str
+
+
+NO_INTENT = SceneIntent(None, "none", "")
+
+
+def classify_scene_intent(current_scene: str, text: str) -> SceneIntent:
+	"""
+	Scene-change intent of a player input in a scene: "high" when a sentence
+	pairs a movement cue with exactly one reachable scene, named by a distinctive
+	place name, and nothing in the input argues against it; "low" when a
+	reachable scene is only mentioned.
+	"""
+	if not text or not text.strip():
+		return NO_INTENT
+	candidates = set()
+	low: Optional[SceneIntent] = None
+	negative = _NEGATIVE.search(text) is not None or text.rstrip().endswith(("?", "？", "吗"))
+	for sentence in _SENTENCES.findall(text):
+		targets = transitions_mentioned(current_scene, sentence)
+		if not targets:
+			continue
+		cue = _MOVE.search(sentence) or _ACCEPT.search(sentence)
+		named = places_mentioned(current_scene, sentence) == targets
+		if len(targets) == 1 and named and cue is not None and not negative:
+			candidates.add(targets[0])
+		elif low is None:
+			if len(targets) > 1:
+				reason = "several scenes"
+			elif negative:
+				reason = "negative cue"
+			else:
+				reason = "no movement cue" if cue is None else "no place name"
+			low = SceneIntent(targets[0], "low", reason)
+	if len(candidates) == 1:
+		target = candidates.pop()
+		if target in NO_PREEMPT:
+			return SceneIntent(target, "low", "not preempted")
+		return SceneIntent(target, "high", "movement cue")
+	if candidates:
+		return SceneIntent(sorted(candidates)[0], "low", "several scenes")
+	return low or NO_INTENT
+
+
+def intent_outcome(intent: SceneIntent, actual: Optional[str]) -> str:
+	"""tp / fp / fn / tn of a high-confidence prediction (or its absence) against the scene actually moved to"""
+	predicted = intent.target if intent.confidence == "high" else None
+	if predicted is not None:
+		return "tp" if predicted == actual else "fp"
+	return "fn" if actual is not None else "tn"
+
+
+def record_intent_outcome(intent: SceneIntent, actual: Optional[str]) -> str:
+	"""Count a turn's outcome in kp_scene_intent_total"""
+	outcome = intent_outcome(intent, actual)
+	SCENE_INTENT.inc(outcome=outcome)
+	return outcome
@@ -1,19 +1,69 @@
-from typing import Dict, List, Any, TypedDict, Annotated, Literal
+from typing import Dict, List, Any, TypedDict, Annotated, Literal, AsyncIterator, Iterable, Optional, Tuple
 from langgraph.graph import StateGraph, START, END
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage, ToolMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, SystemMessage, BaseMessage, ToolMessage
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableLambda
+from langgraph.config import get_stream_writer
+from langgraph.constants import TAG_NOSTREAM
 import os
 import random
 import json
 import re
+import threading
+import uuid
+from collections import OrderedDict
 from dotenv import load_dotenv
-from agents.scenes import SCENES, get_scene_prompt, get_available_transitions, get_story_overview
-from agents.memory import compress_chat_history
+from utils.metrics import counter, histogram
+from utils.timing import phase
+from utils.logging import log_prompt_profile
+from utils.tokens import count_tokens, tokenizer_name
+from utils.tracing import get_tracer
+from agents.scenes import (
+	SCENES, clear_scene_cache, get_available_transitions, get_npc_section, get_player_context,
+	get_scene_section, get_story_overview, npcs_mentioned, transitions_mentioned,
+)
+from agents.rules import RULES, clear_rule_index, core_rules, render_rules, select_rules
+from agents.llm import LLM_CALL_SECONDS, get_chat_model, record_usage
+from agents.profiler import profile_prompt, profiling_enabled
+from agents.speculation import (
+	SCENE_PREFETCH, SPECULATE_TIERS, SPECULATION, CheckSpeculation, PrefetchedScene, ScenePrefetcher,
+	check_tier, speculation_capacity, start_continuation, tier_roll,
+)
+from agents.intent import INTENT_MODE, SCENE_INTENT, SceneIntent, classify_scene_intent, record_intent_outcome
+from agents.structured import KEEPER_OUTPUT_SCHEMA, OUTPUT_INSTRUCTIONS, output_format_tokens, parse_keeper_output
+from agents.memory import BackgroundCompressor, compress_chat_history, acompress_chat_history, compressible, history_tokens
 
 # Load environment variables from .env file
 load_dotenv()
 
+_trace = get_tracer("kp_agent")
+
+TURN_SECONDS = histogram("kp_turn_seconds", "Total KP turn latency", ["mode"])
+NODE_SECONDS = histogram("kp_graph_node_seconds", "LangGraph node duration", ["node"])
+COMPRESSION_SECONDS = histogram("kp_compression_seconds", "compress_chat_history duration")
+TOOL_CALLS = counter("kp_tool_calls_total", "Tool calls made by the Keeper LLM", ["tool"])
+TOOL_CALLS_DROPPED = counter(
+	"kp_tool_calls_dropped_total", "Tool calls (or structured actions) in a re-invoke response, which are not executed", ["tool"]
+)
+PROMPT_TAIL_CACHE = counter("kp_prompt_tail_cache_total", "Character prompt tail memo lookups", ["result"])
+
+
+class PendingCheck(TypedDict, total=False):
+	"""A check the Keeper asked the player to roll, kept until the result arrives"""
+	request_id: str  # ID of the roll_dice / san_check tool call that asked for it
+	kind: Literal["dice", "san"]
+	skill: str  # Skill name ("SAN" for sanity checks)
+	difficulty: str  # "easy" / "normal" / "hard" / "extreme" (dice checks)
+	target: int  # Skill value for dice checks, current SAN for sanity checks
+	san_loss: int  # SAN lost on a failed sanity check
+	marker: str  # Legacy [DICE_REQUEST:...] / [SAN_CHECK_REQUEST:...] string
+
+
+class CheckResult(TypedDict):
+	"""The player's roll for one pending check"""
+	request_id: str  # PendingCheck.request_id
+	roll: int  # d100 result
+
 
 class AgentState(TypedDict, total=False):
 	messages: Annotated[List[BaseMessage], "Chat history"]
@@ -27,10 +77,37 @@ class AgentState(TypedDict, total=False):
 	san_loss: int  # SAN loss from san_check
 	pending_dice_result: str  # Pending dice result to include in response
 	pending_san_result: str  # Pending SAN check result to include in response
+	previous_scene: str  # Scene left by this turn's change_scene, if any
+	scene_transitions: int  # Scene changes made this turn (see MAX_SCENE_TRANSITIONS_PER_TURN)
+	auto_roll: Any  # AutoRoll settings when the server rolls checks itself (opt-in)
+	pending_checks: List[PendingCheck]  # Checks awaiting the player's rolls (persist across turns)
+	check_requested: bool  # pending_checks were requested by this turn
+	check_results: List[CheckResult]  # Rolls the player sent for pending checks (batched)
+	usage: Dict[str, int]  # Keeper tokens this turn: prompt_tokens, cached_tokens, completion_tokens
+	prompt_mode: str  # "full" or "slim" (see PROMPT_MODES)
+	prompt_components: Dict[str, int]  # Tokens per system prompt component (last prompt built this turn)
+	speculation: Any  # CheckSpeculation started while the player rolled (opt-in, see speculate_check_outcomes)
+	scene_prefetch: Any  # The session's ScenePrefetcher (see prefetch_scene_entries)
+
+
+# A turn may move the party at most this many times; further change_scene calls
+# are refused so the model narrates the arrival instead of chaining moves
+MAX_SCENE_TRANSITIONS_PER_TURN = 1
 
 
 # ==================== DICE TOOL ====================
 
+def _difficulty_threshold(difficulty: str, skill_value: int) -> Tuple[int, str]:
+	"""Roll-under threshold and display name of a difficulty level"""
+	if difficulty == "easy":
+		return skill_value // 2, "Easy"
+	elif difficulty == "hard":
+		return skill_value // 2, "Hard"
+	elif difficulty == "extreme":
+		return skill_value // 5, "Extreme"
+	return skill_value, "Normal"
+
+
 def process_dice_result(d100: int, skill_name: str, difficulty: str, skill_value: int) -> str:
 	"""
 	Process a dice roll result and return formatted result string.
@@ -44,19 +121,7 @@ def process_dice_result(d100: int, skill_name: str, difficulty: str, skill_value
 	Returns:
 		Formatted result string
 	"""
-	# Calculate difficulty thresholds
-	if difficulty == "easy":
-		threshold = skill_value // 2
-		diff_name = "Easy"
-	elif difficulty == "hard":
-		threshold = skill_value // 2
-		diff_name = "Hard"
-	elif difficulty == "extreme":
-		threshold = skill_value // 5
-		diff_name = "Extreme"
-	else:  # normal
-		threshold = skill_value
-		diff_name = "Normal"
+	threshold, diff_name = _difficulty_threshold(difficulty, skill_value)
 	
 	# Determine result
 	if d100 == 1:
@@ -134,6 +199,36 @@ def process_san_check_result(d100: int, current_san: int, san_loss: int) -> tupl
 	return result_str, actual_loss
 
 
+class AutoRoll:
+	"""
+	Opt-in server-side rolling for a session.
+	
+	Checks covered by these settings are rolled with the session's own seeded
+	RNG stream and resolved in the same graph run, instead of sending a
+	[DICE_REQUEST]/[SAN_CHECK_REQUEST] marker to the player. The same seed
+	always produces the same sequence of rolls.
+	"""
+	
+	SAN = "SAN"  # Name to list in `skills` to auto-roll sanity checks
+	
+	def __init__(self, all_checks: bool = False, skills: Optional[Iterable[str]] = None, seed: Optional[int] = None):
+		self.all_checks = all_checks
+		self.skills = {skill.strip().lower() for skill in skills or ()}
+		self.seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 32)
+		self.rng = random.Random(self.seed)
+		self.rolls = 0  # Rolls drawn so far (position in the seeded stream)
+	
+	def applies_to(self, skill_name: str) -> bool:
+		return self.all_checks or skill_name.strip().lower() in self.skills
+	
+	def roll_d100(self) -> int:
+		self.rolls += 1
+		return self.rng.randint(1, 100)
+	
+	def to_dict(self) -> Dict[str, Any]:
+		return {"all_checks": self.all_checks, "skills": sorted(self.skills), "seed": self.seed, "rolls": self.rolls}
+
+
 @tool
 def roll_dice(skill_name: str, difficulty: str = "normal", skill_value: int = 50) -> str:
 	"""
@@ -173,6 +268,49 @@ def san_check(current_san: int, san_loss: int) -> str:
 	return f"[SAN_CHECK_REQUEST:{current_san}:{san_loss}]"
 
 
+DICE_REQUEST_PATTERN = re.compile(r'\[DICE_REQUEST:(.+?):(.+?):(\d+)\]')
+SAN_REQUEST_PATTERN = re.compile(r'\[SAN_CHECK_REQUEST:(\d+):(\d+)\]')
+# A legacy roll message from the client (see _resolve_legacy_result)
+ROLL_RESULT_PATTERN = re.compile(r'(?:DiceResult|SANResult):\s*\d', re.IGNORECASE)
+
+
+def _dice_check(request_id: str, skill_name: str, difficulty: str, skill_value: int, marker: str) -> PendingCheck:
+	return {
+		"request_id": request_id,
+		"kind": "dice",
+		"skill": skill_name,
+		"difficulty": difficulty,
+		"target": skill_value,
+		"san_loss": 0,
+		"marker": marker,
+	}
+
+
+def _san_check(request_id: str, current_san: int, san_loss: int, marker: str) -> PendingCheck:
+	return {
+		"request_id": request_id,
+		"kind": "san",
+		"skill": "SAN",
+		"difficulty": "normal",
+		"target": current_san,
+		"san_loss": san_loss,
+		"marker": marker,
+	}
+
+
+def _checks_from_markers(text: str) -> List[PendingCheck]:
+	"""Rebuild PendingChecks from legacy markers (clients that only echo the marker text)"""
+	checks = [
+		(match.start(), _dice_check(f"marker-{match.start()}", match.group(1), match.group(2), int(match.group(3)), match.group(0)))
+		for match in DICE_REQUEST_PATTERN.finditer(text)
+	]
+	checks += [
+		(match.start(), _san_check(f"marker-{match.start()}", int(match.group(1)), int(match.group(2)), match.group(0)))
+		for match in SAN_REQUEST_PATTERN.finditer(text)
+	]
+	return [check for _, check in sorted(checks, key=lambda item: item[0])]
+
+
 @tool
 def change_scene(target_scene_id: str, current_scene_id: str) -> str:
 	"""
@@ -204,8 +342,115 @@ def change_scene(target_scene_id: str, current_scene_id: str) -> str:
 
 # ==================== GLOBAL SYSTEM PROMPT ====================
 
-def build_global_system_prompt(character: Dict[str, Any], current_scene: str) -> str:
-	"""Build the global system prompt for the Keeper"""
+PROMPT_MODES = ("full", "slim")
+# "slim" (opt-in, or per session) drops the duplicated Player Context stats, gives
+# full NPC entries only to NPCs named in the last SLIM_NPC_WINDOW messages, lists
+# transitions by name and sends the core rules plus the rules retrieved for the
+# turn (agents.rules). The tools and the core tool rules are the same in both modes
+PROMPT_MODE = os.getenv("KP_PROMPT_MODE", "full")
+SLIM_NPC_WINDOW = int(os.getenv("KP_SLIM_NPC_WINDOW", "4"))
+
+# A component of the system prompt: (name, text, tokens)
+PromptPart = Tuple[str, str, int]
+
+
+class _PartCache:
+	"""Bounded LRU of rendered prompt parts, for keys that vary with the turn"""
+
+	def __init__(self, size: int):
+		self.size = size
+		self._parts: "OrderedDict[tuple, Tuple[PromptPart, ...]]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: tuple) -> Optional[Tuple[PromptPart, ...]]:
+		with self._lock:
+			part = self._parts.get(key)
+			if part is not None:
+				self._parts.move_to_end(key)
+			return part
+
+	def put(self, key: tuple, part: Tuple[PromptPart, ...]) -> None:
+		with self._lock:
+			self._parts[key] = part
+			self._parts.move_to_end(key)
+			while len(self._parts) > self.size:
+				self._parts.popitem(last=False)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._parts.clear()
+
+
+# Rendered prompt fragments with their token counts. The static prompt and the
+# parts of known scenes are built once (keyed by scene ID and mode only); NPC
+# blocks (per NPCs in focus), rule sets (per selected rules) and the character
+# tail (per scene, mode, name, background, stats) are memoized in bounded LRUs
+_static_prompt: Optional[str] = None
+_core_prompt: Optional[str] = None
+_scene_prompts: Dict[str, str] = {}
+_scene_heads: Dict[Tuple[str, bool], Tuple[PromptPart, ...]] = {}
+_npc_parts = _PartCache(int(os.getenv("KP_PROMPT_PART_CACHE_SIZE", "256")))
+_rule_parts = _PartCache(int(os.getenv("KP_PROMPT_PART_CACHE_SIZE", "256")))
+_prompt_tails = _PartCache(int(os.getenv("KP_PROMPT_TAIL_CACHE_SIZE", "512")))
+
+# Character fields that appear in the tail of the system prompt
+_CHARACTER_PROMPT_FIELDS = ("name", "background_story", "str", "int", "pow", "spot", "listen", "stealth", "charm", "luck", "san")
+
+
+def build_static_prompt() -> str:
+	"""
+	The Keeper's rules, story overview and tool guidance.
+	
+	Identical for every investigator, scene and turn, so it always leads the system
+	prompt and the provider's prefix cache can reuse it. Rendered once.
+	"""
+	global _static_prompt
+	if _static_prompt is None:
+		_static_prompt = _render_static_prompt()
+	return _static_prompt
+
+
+def build_core_prompt() -> str:
+	"""
+	The static prompt of slim mode: story overview and the core rules only
+	(the other rules are retrieved per turn, see agents.rules). Rendered once.
+	"""
+	global _core_prompt
+	if _core_prompt is None:
+		_core_prompt = _render_static_prompt(core_rules())
+	return _core_prompt
+
+
+def _render_static_prompt(rule_ids: Optional[Iterable[str]] = None) -> str:
+	story_overview = get_story_overview()
+	rules = render_rules(RULES if rule_ids is None else rule_ids)
+	
+	return f"""You are the Keeper (KP) for a solo Call of Cthulhu role-playing game scenario.
+
+{story_overview}
+
+{rules}
+"""
+
+
+def build_scene_prompt(current_scene: str) -> str:
+	"""Scene name, description and exits (shared by every investigator in the scene)"""
+	scene_prompt = _scene_prompts.get(current_scene)
+	if scene_prompt is None:
+		scene_info = SCENES.get(current_scene, {})
+		scene_name = scene_info.get("name", "Unknown Location")
+		scene_description = scene_info.get("description", "")
+		
+		scene_prompt = f"""**Current Scene: {scene_name}**
+{scene_description}
+- Available transitions from current scene: {', '.join(get_available_transitions(current_scene))}"""
+		if scene_info:
+			_scene_prompts[current_scene] = scene_prompt
+	return scene_prompt
+
+
+def build_character_prompt(character: Dict[str, Any]) -> str:
+	"""The investigator's sheet; changes during play (SAN), so it goes last"""
 	name = character.get("name", "Investigator")
 	background = character.get("background_story", "")
 	str_val = character.get("str", 50)
@@ -218,426 +463,1190 @@ def build_global_system_prompt(character: Dict[str, Any], current_scene: str) ->
 	luck = character.get("luck", 50)
 	san = character.get("san", 60)
 	
-	# Get story overview
-	story_overview = get_story_overview()
-	
-	# Get current scene info
-	scene_info = SCENES.get(current_scene, {})
-	scene_name = scene_info.get("name", "Unknown Location")
-	scene_description = scene_info.get("description", "")
-	
-	global_prompt = f"""You are the Keeper (KP) for a solo Call of Cthulhu role-playing game scenario.
-
-{story_overview}
-
-**Player Character:**
+	return f"""**Player Character:**
 - Name: {name}
 - Background: {background if background else "No specific background provided"}
 - Core Attributes: STR {str_val}, INT {int_val}, POW {pow_val}
 - Skills: SPOT {spot}, LISTEN {listen}, STEALTH {stealth}, CHARM {charm}, LUCK {luck}
-- SAN: {san}
+- SAN: {san}"""
 
-**Current Scene: {scene_name}**
-{scene_description}
-
-**Your Role as Keeper:**
-- Narrate the story as the Keeper, responding directly to the investigator's actions
-- Be concise and direct—avoid excessive atmospheric description
-- Focus on what happens, not lengthy environmental details
-- **When a skill check is needed, IMMEDIATELY call the roll_dice tool - do NOT announce or describe the check**
-- Advance the story based on player actions
-- Keep responses brief (1-3 sentences typically, only expand for crucial moments)
-- Show, don't over-describe. Let actions and dialogue carry the atmosphere
-- Avoid repetitive sensory details or purple prose
-- **CRITICAL: Do NOT say "I will roll" or "Let me check" - just call the tool directly**
-
-**Player Action Handling (Critical):**
-- Never invent or describe the player's words or actions.
-- Do not elaborate on, embellish, or expand the player's replies, nor add any internal thoughts or psychological descriptions for the player character.
-- Only narrate NPC reactions, environment, and consequences.
-- **If instructions are vague or unclear, ask for clarification (e.g., "What do you say?" "How do you do it?"). Otherwise, simply narrate what happens without ending with a question. Trust the player will respond with their next action.**
-
-**Tool Usage Workflow:**
-When player action requires a check:
-1. **IMMEDIATELY and SILENTLY call the roll_dice or san_check tool** (do not announce it)
-2. The tool will execute and return a result
-3. Use that result in your narration without mentioning the tool call
-4. Continue narrating based on the result
-
-
-**Do:**
-- Call the tool directly when needed
-- Incorporate results naturally into narration
-- Let tools work in the background
-
-**When to use san_check:**
-- Witness something horrifying or disturbing
-- Encounter cosmic horror or supernatural phenomena
-- See Cthulhu-related runes, symbols, or forbidden clues
-- Discover disturbing truths or things that shouldn't exist
-- Exposed to madness-inducing knowledge
-- Typical SAN loss: 1 (minor), 1d3/1d4 (moderate), 1d6+ (major)
-
-**Scene Transitions (CRITICAL):**
-- Available transitions from current scene: {', '.join(get_available_transitions(current_scene))}
-- You must treat scene changes as soon as the player clearly moves to a new location or starts interacting mainly in that new location.
-
-**Skill Check Guidelines:**
-- SPOT: Finding clues, noticing details, observing surroundings
-- LISTEN: Hearing distant sounds, overhearing conversations, detecting threats
-- STEALTH: Sneaking, hiding, moving quietly
-- CHARM: Persuasion, negotiation, social interaction
-- LUCK: Random events, chance encounters, fortunate coincidences
-- STR: Physical actions, breaking objects, combat
-- INT: Reasoning, remembering information, understanding clues
-- POW: Resisting mental influence, magical resistance, willpower
-
-**Critical Tool Usage Rules:**
-- **NEVER describe or announce that you will perform a check - ALWAYS call the roll_dice tool directly**
-- **DO NOT say "I will roll dice" or "I need to check" - just call the tool immediately**
-- **When a skill check is needed, call roll_dice tool BEFORE responding - do not ask permission or describe the action**
-- Use the correct skill name when calling roll_dice (e.g., "Spot Hidden" for SPOT checks, "Strength" for STR checks)
-- After calling roll_dice, incorporate the result naturally into your narration without mentioning "I rolled" or "the dice show"
-
-**Scene Transition Rules (for change_scene tool):**
-- **CRITICAL:** When the player's actions clearly indicate moving to a new location or entering a different scene, you MUST call the change_scene tool BEFORE continuing narration.
-- Only move to scenes that appear in the "Available scene transitions" list for the current scene.
-- Treat "walking to / going to / entering / heading for / returning to" a place as a scene change intent, not just flavor.
-- The player does **not** need to say the exact scene ID. You should map natural language places to scene IDs using your knowledge of the story.
-
-**Concrete triggers (when to call change_scene immediately):**
-- Player accepts May Ledbetter's offer and goes to or stays at May's house ⇒ call change_scene("leddbetter_house").
-- Player says they go to or enter the village hall / town office / town hall ⇒ call change_scene("village_hall").
-- Player says they go to or enter the ruined / abandoned church ⇒ call change_scene("ruined_church").
-- Player says they go to the Beacon / festival / ritual location at night for the ceremony ⇒ call change_scene("ritual").
-- From the ritual, when the story clearly reaches an epilogue / aftermath, you may move to "ending" ⇒ call change_scene("ending").
-
-**Negative examples (DO NOT change scene):**
-- Player only looks at a distant building, tower, or church from afar without going there.
-- Player asks about a place in conversation but does not go there.
-- Player remembers or dreams about another place.
-
-**Execution rules:**
-- Call change_scene as soon as you infer the scene change, then let the tools and system prompt update the context.
-- After a successful change_scene, you must narrate from the new scene's perspective and tone.
-- Do **not** ask the player "Do you want to go to X?" if they already clearly stated they go there—just change the scene.
-
-
-**General Rules:**
-- Stay in character as the KP and guide the story forward
-- Be creative but stay within the CoC horror atmosphere
-- Follow the scene-specific prompts provided to you for guidance on style and key elements
-- Remember: You have tools available. Use them directly, don't describe using them.
-"""
 
-	return global_prompt
+def build_global_system_prompt(character: Dict[str, Any], current_scene: str) -> str:
+	"""Build the global system prompt for the Keeper (static part first, then scene, then character)"""
+	return "\n\n".join([
+		build_static_prompt(),
+		build_scene_prompt(current_scene),
+		build_character_prompt(character),
+	])
 
 
 # ==================== NODES ====================
 
-def keeper_node(state: AgentState) -> AgentState:
-	"""Main Keeper node with LLM and tools"""
+def _resolve_check_results(state: AgentState) -> Dict[str, Any]:
+	"""
+	Resolve the rolls sent by the player before the LLM is called.
+	
+	Rolls come either as a batch of check_results (one per pending check, matched
+	by request ID) or as a legacy DiceResult/SANResult message, which resolves
+	the first pending check of its kind.
+	
+	Returns:
+		Dict with the (possibly rewritten) messages, updated character, dice history,
+		pending result strings, SAN loss and the checks still waiting for a roll
+	"""
 	messages: List[BaseMessage] = state["messages"]
-	character: Dict[str, Any] = state["character"]
-	api_key: str = state.get("api_key", "")
-	current_scene: str = state.get("current_scene", "arrival_village")
+	pending_checks: List[PendingCheck] = list(state.get("pending_checks") or [])
+	
+	# Legacy clients send no pending_checks; the markers are then in the Keeper's last reply
+	if not pending_checks and len(messages) >= 2 and isinstance(messages[-2], AIMessage):
+		content = messages[-2].content
+		if isinstance(content, str):
+			pending_checks = _checks_from_markers(content)
+	
+	resolved: Dict[str, Any] = {
+		"messages": messages,
+		"character": state["character"],
+		"dice_results": state.get("dice_results", []),
+		"pending_dice_result": None,
+		"pending_san_result": None,
+		"san_loss": 0,
+		"pending_checks": pending_checks,
+		"check_requested": False,
+		"rolled_checks": [],  # (request ID, outcome tier) of each check resolved this turn
+	}
+	
+	check_results = state.get("check_results") or []
+	if check_results:
+		_resolve_check_batch(resolved, check_results)
+	elif messages and isinstance(messages[-1], HumanMessage):
+		_resolve_legacy_result(resolved, messages[-1].content)
+	return resolved
+
+
+def _roll_dice_check(resolved: Dict[str, Any], d100: int, skill_name: str, difficulty: str, skill_value: int) -> str:
+	"""Apply a dice roll to the resolved turn data; returns the outcome tier"""
+	dice_result = process_dice_result(d100, skill_name, difficulty, skill_value)
+	_trace.debug("dice_result", roll=d100, skill=skill_name, difficulty=difficulty, skill_value=skill_value)
+	
+	# Store for later use in response
+	resolved["pending_dice_result"] = _join_results(resolved["pending_dice_result"], dice_result)
+	
+	# Update dice history
+	resolved["dice_results"] = resolved["dice_results"] + [{
+		"skill": skill_name,
+		"difficulty": difficulty,
+		"roll": d100,
+		"result": dice_result
+	}]
+	return check_tier(d100, _difficulty_threshold(difficulty, skill_value)[0])
+
+
+def _roll_san_check(resolved: Dict[str, Any], d100: int, current_san: int, san_loss: int) -> str:
+	"""Apply a SAN check roll to the resolved turn data; returns the outcome tier"""
+	san_result, actual_loss = process_san_check_result(d100, current_san, san_loss)
+	_trace.debug("san_result", roll=d100, current_san=current_san, san_loss=actual_loss)
+	
+	# Update character SAN
+	if actual_loss > 0:
+		character = resolved["character"].copy()
+		character["san"] = max(0, current_san - actual_loss)
+		resolved["character"] = character
+	
+	# Store for later use in response
+	resolved["pending_san_result"] = _join_results(resolved["pending_san_result"], san_result)
+	resolved["san_loss"] += actual_loss
+	return check_tier(d100, current_san)
+
+
+def _resolve_check_batch(resolved: Dict[str, Any], check_results: List[CheckResult]) -> None:
+	"""Resolve several pending checks at once; the LLM then narrates every outcome in one call"""
+	checks = {check.get("request_id"): check for check in resolved["pending_checks"]}
+	lines = []
+	for check_result in check_results:
+		check = checks.pop(check_result["request_id"], None)
+		if check is None:
+			_trace.warning("unknown_check_result", request_id=check_result["request_id"])
+			continue
+		d100 = int(check_result["roll"])
+		if check.get("kind") == "san":
+			# SAN losses of earlier checks in the batch count against later ones
+			current_san = resolved["character"].get("san", check.get("target", 60))
+			tier = _roll_san_check(resolved, d100, current_san, check.get("san_loss", 1))
+		else:
+			tier = _roll_dice_check(resolved, d100, check.get("skill", "Unknown"), check.get("difficulty", "normal"), check.get("target", 50))
+		resolved["rolled_checks"].append((check_result["request_id"], tier))
+		lines.append(f"- {check.get('skill', 'Unknown')} check roll: {d100}")
+	
+	resolved["pending_checks"] = list(checks.values())
+	if lines:
+		# Replace the user message with a formatted version (keeping anything the player said)
+		messages = resolved["messages"]
+		said = messages[-1].content.strip() if messages and isinstance(messages[-1], HumanMessage) else ""
+		content = "Check results:\n" + "\n".join(lines)
+		if said:
+			content = f"{said}\n\n{content}"
+		resolved["messages"] = messages[:-1] + [HumanMessage(content=content)]
+
+
+def _take_pending_check(resolved: Dict[str, Any], kind: str) -> Optional[PendingCheck]:
+	"""Remove and return the first pending check of a kind"""
+	for index, check in enumerate(resolved["pending_checks"]):
+		if check.get("kind") == kind:
+			return resolved["pending_checks"].pop(index)
+	return None
+
+
+def _resolve_legacy_result(resolved: Dict[str, Any], last_user_msg: str) -> None:
+	"""Resolve a "DiceResult: ..." / "SANResult: ..." message against the pending checks"""
+	messages = resolved["messages"]
 	
 	# Check if the last user message contains a DiceResult
 	# Format: "DiceResult: 73" or "DiceResult: 73:skill_name:difficulty:skill_value" or "SANResult: 73:current_san:san_loss"
-	pending_dice_result = None
-	pending_san_result = None
-	san_loss_amount = 0
-	
-	if messages and isinstance(messages[-1], HumanMessage):
-		last_user_msg = messages[-1].content
-		
-		# Check for DiceResult pattern
-		dice_result_match = re.match(r'DiceResult:\s*(\d{1,3})(?::(.+?):(.+?):(\d+))?', last_user_msg, re.IGNORECASE)
-		if dice_result_match:
-			d100 = int(dice_result_match.group(1))
-			# If full parameters provided, use them; otherwise search backwards for the request
-			if dice_result_match.group(2):
-				skill_name = dice_result_match.group(2)
-				difficulty = dice_result_match.group(3)
-				skill_value = int(dice_result_match.group(4))
-			else:
-				# Search backwards for DICE_REQUEST marker
-				skill_name = "Unknown"
-				difficulty = "normal"
-				skill_value = 50
-				for msg in reversed(messages):
-					if isinstance(msg, ToolMessage):
-						content = msg.content
-						request_match = re.match(r'\[DICE_REQUEST:(.+?):(.+?):(\d+)\]', content)
-						if request_match:
-							skill_name = request_match.group(1)
-							difficulty = request_match.group(2)
-							skill_value = int(request_match.group(3))
-							break
-			
-			# Process the dice result
+	dice_result_match = re.match(r'DiceResult:\s*(\d{1,3})(?::(.+?):(.+?):(\d+))?', last_user_msg, re.IGNORECASE)
+	if dice_result_match:
+		d100 = int(dice_result_match.group(1))
+		check = _take_pending_check(resolved, "dice")
+		# If full parameters provided, use them; otherwise take them from the pending check
+		if dice_result_match.group(2):
+			skill_name = dice_result_match.group(2)
+			difficulty = dice_result_match.group(3)
+			skill_value = int(dice_result_match.group(4))
+		elif check:
+			skill_name = check.get("skill", "Unknown")
+			difficulty = check.get("difficulty", "normal")
+			skill_value = check.get("target", 50)
+		else:
+			skill_name = "Unknown"
+			difficulty = "normal"
+			skill_value = 50
+		
+		tier = _roll_dice_check(resolved, d100, skill_name, difficulty, skill_value)
+		resolved["rolled_checks"].append((check.get("request_id") if check else None, tier))
+		
+		# Replace the user message with a formatted version
+		resolved["messages"] = messages[:-1] + [HumanMessage(content=f"Dice roll result: {d100}")]
+	
+	# Check for SANResult pattern
+	san_result_match = re.match(r'SANResult:\s*(\d{1,3})(?::(\d+):(\d+))?', last_user_msg, re.IGNORECASE)
+	if san_result_match:
+		d100 = int(san_result_match.group(1))
+		check = _take_pending_check(resolved, "san")
+		# If full parameters provided, use them; otherwise take them from the pending check
+		if san_result_match.group(2):
+			current_san = int(san_result_match.group(2))
+			san_loss = int(san_result_match.group(3))
+		elif check:
+			current_san = check.get("target", resolved["character"].get("san", 60))
+			san_loss = check.get("san_loss", 1)
+		else:
+			current_san = resolved["character"].get("san", 60)
+			san_loss = 1
+		
+		tier = _roll_san_check(resolved, d100, current_san, san_loss)
+		resolved["rolled_checks"].append((check.get("request_id") if check else None, tier))
+		
+		# Replace the user message with a formatted version
+		resolved["messages"] = messages[:-1] + [HumanMessage(content=f"SAN check result: {d100}")]
+
+
+def _prompt_parts(*parts: Tuple[str, str]) -> Tuple[PromptPart, ...]:
+	"""Count the tokens of (name, text) components, leaving out empty ones"""
+	return tuple((name, text, count_tokens(text)) for name, text in parts if text)
+
+
+def _scene_head(current_scene: str, slim: bool = False) -> Tuple[PromptPart, ...]:
+	"""Static prompt, scene header and scene prompt template (rendered once per scene and mode)"""
+	head = _scene_heads.get((current_scene, slim))
+	if head is None:
+		# Add scene-specific prompt template (this is the main scene guidance)
+		scene_section = get_scene_section(current_scene, slim)
+		head = _prompt_parts(
+			("static", build_core_prompt() if slim else build_static_prompt()),
+			("scene", build_scene_prompt(current_scene)),
+			("scene_template", f"**=== SCENE PROMPT TEMPLATE ===**\n{scene_section.strip()}" if scene_section else ""),
+		)
+		if current_scene in SCENES:
+			_scene_heads[(current_scene, slim)] = head
+	return head
+
+
+def _npc_focus(current_scene: str, messages: Optional[List[BaseMessage]]) -> Optional[Tuple[str, ...]]:
+	"""NPCs named in the recent messages (None: all of them, e.g. on entering a scene)"""
+	if not messages or len(messages) < 2:
+		return None
+	recent = "\n".join(msg.content for msg in messages[-SLIM_NPC_WINDOW:] if isinstance(msg.content, str))
+	return npcs_mentioned(current_scene, recent)
+
+
+def _rules_part(current_scene: str, messages: Optional[List[BaseMessage]]) -> Tuple[PromptPart, ...]:
+	"""Rules retrieved for the player's input and the Keeper's last reply (slim prompts)"""
+	query = " ".join(msg.content for msg in (messages or [])[-2:] if isinstance(msg.content, str))
+	rule_ids = select_rules(query, current_scene)
+	part = _rule_parts.get(rule_ids)
+	if part is None:
+		part = _prompt_parts(("rules", render_rules(rule_ids)))
+		_rule_parts.put(rule_ids, part)
+	_trace.debug("rules_selected", rules=list(rule_ids))
+	return part
+
+
+def _npc_part(current_scene: str, in_focus: Optional[Tuple[str, ...]]) -> Tuple[PromptPart, ...]:
+	"""NPC block of a slim prompt (rendered once per scene and NPCs in focus)"""
+	key = (current_scene, in_focus)
+	part = _npc_parts.get(key)
+	if part is None:
+		part = _prompt_parts(("npcs", get_npc_section(current_scene, in_focus)))
+		if current_scene in SCENES:
+			_npc_parts.put(key, part)
+	return part
+
+
+def _character_tail(character: Dict[str, Any], current_scene: str, slim: bool = False) -> Tuple[PromptPart, ...]:
+	"""
+	Investigator's sheet and the scene's Player Context line (which repeats the
+	stats, so slim prompts leave it out), memoized per scene, mode and stats
+	"""
+	key = (current_scene, slim) + tuple(character.get(field) for field in _CHARACTER_PROMPT_FIELDS)
+	tail = _prompt_tails.get(key)
+	if tail is not None:
+		PROMPT_TAIL_CACHE.inc(result="hit")
+		return tail
+	
+	PROMPT_TAIL_CACHE.inc(result="miss")
+	tail = _prompt_parts(
+		("character", build_character_prompt(character)),
+		("player_context", "" if slim else get_player_context(current_scene, character)),
+	)
+	_prompt_tails.put(key, tail)
+	return tail
+
+
+def clear_prompt_cache() -> None:
+	"""Drop every rendered prompt fragment (call after editing SCENES or the prompt at runtime)"""
+	global _static_prompt, _core_prompt
+	_static_prompt = None
+	_core_prompt = None
+	_scene_prompts.clear()
+	_scene_heads.clear()
+	_npc_parts.clear()
+	_rule_parts.clear()
+	_prompt_tails.clear()
+	clear_scene_cache()
+	clear_rule_index()
+
+
+def build_prompt_parts(
+	character: Dict[str, Any],
+	current_scene: str,
+	prompt_mode: str = "full",
+	messages: Optional[List[BaseMessage]] = None,
+	entering: bool = False
+) -> List[PromptPart]:
+	"""
+	The components of the Keeper system prompt, in order, with their token counts.
+	
+	Ordered from most to least stable so the provider's automatic prefix cache
+	hits: the static rules first, then the scene (header and prompt template),
+	then the investigator's sheet. In slim mode the static part holds only the
+	core rules; the rules retrieved for `messages` and the NPC block (full entries
+	only for NPCs named in `messages`, or every NPC when `entering` the scene) sit
+	between the scene and the sheet.
+	"""
+	slim = prompt_mode == "slim"
+	parts = list(_scene_head(current_scene, slim))
+	if slim:
+		parts.extend(_rules_part(current_scene, messages))
+		parts.extend(_npc_part(current_scene, None if entering else _npc_focus(current_scene, messages)))
+	parts.extend(_character_tail(character, current_scene, slim))
+	return parts
+
+
+def _build_system_message(
+	character: Dict[str, Any],
+	current_scene: str,
+	prompt_mode: str = "full",
+	messages: Optional[List[BaseMessage]] = None,
+	entering: bool = False
+) -> Tuple[SystemMessage, Dict[str, int]]:
+	"""
+	Build the Keeper system message and its token count per component.
+	
+	Every component is cached, so a turn only joins a few strings unless the
+	scene or the investigator's stats changed.
+	"""
+	with phase("prompt"):
+		parts = build_prompt_parts(character, current_scene, prompt_mode, messages, entering)
+		system_prompt = "\n\n".join(text for _, text, _ in parts)
+	
+	return SystemMessage(content=system_prompt), {name: tokens for name, _, tokens in parts}
+
+
+# Tools bound to the Keeper LLM
+KEEPER_TOOLS = [roll_dice, san_check, change_scene]
+
+ENGINE_MODES = ("tools", "structured")
+# "tools": the Keeper calls roll_dice / san_check / change_scene and is re-invoked
+# to narrate their results. "structured" (opt-in, per deployment): one JSON
+# response with the narration, checks and scene change, validated and applied
+# locally with no second completion (see agents.structured)
+ENGINE_MODE = os.getenv("KP_ENGINE", "tools")
+
+
+def configure_engine(mode: str) -> None:
+	"""Switch the Keeper engine (see ENGINE_MODES) for the turns started from now on"""
+	global ENGINE_MODE
+	if mode not in ENGINE_MODES:
+		raise ValueError(f"Unknown engine mode: {mode}")
+	ENGINE_MODE = mode
+
+
+def _build_keeper_llm(api_key: str):
+	"""Get the (pooled) Keeper LLM with tools bound"""
+	return get_chat_model(api_key, model="gpt-4o-mini", temperature=0.7, tools=KEEPER_TOOLS)
+
+
+def _build_structured_llm(api_key: str):
+	"""Get the (pooled) Keeper LLM of the structured engine; its raw JSON is never streamed as narration"""
+	llm = get_chat_model(api_key, model="gpt-4o-mini", temperature=0.7, response_format=KEEPER_OUTPUT_SCHEMA)
+	return llm.with_config(tags=[TAG_NOSTREAM])
+
+
+def _structured_prompt(turn: Dict[str, Any], messages: List[BaseMessage]) -> List[BaseMessage]:
+	"""Messages of a structured-engine call: the Keeper system message, the output format, the conversation"""
+	return [turn["system_msg"], SystemMessage(content=OUTPUT_INSTRUCTIONS)] + messages
+
+
+def _profile_call(turn: Dict[str, Any], call: str, messages: List[BaseMessage], usage: Dict[str, int]) -> None:
+	"""Write the token breakdown of a Keeper LLM call to the session log (KP_PROMPT_PROFILE=1)"""
+	if not profiling_enabled():
+		return
+	components = turn.get("prompt_components", {})
+	tools = KEEPER_TOOLS
+	if turn["engine"] == "structured":
+		components = {**components, "output_format": output_format_tokens()}
+		tools = ()
+	parts = profile_prompt(components, turn["current_scene"], turn["prompt_mode"], messages, tools)
+	log_prompt_profile({
+		"call": call,
+		"engine": turn["engine"],
+		"scene": turn["current_scene"],
+		"mode": turn["prompt_mode"],
+		"tokenizer": tokenizer_name(),
+		"parts": parts,
+		"total": sum(parts.values()),
+		"reported_prompt_tokens": usage.get("prompt_tokens", 0),  # From the provider, when it sent usage
+	})
+
+
+def _start_keeper_turn(state: AgentState, engine: str) -> Dict[str, Any]:
+	"""
+	Prepare the per-turn working data shared by keeper_node and akeeper_node
+	(and the structured nodes; engine: the ENGINE_MODES entry of the calling node).
+	
+	The returned dict is mutated by _apply_tool_calls and turned back into a
+	state update by _finish_keeper_turn.
+	"""
+	turn = _resolve_check_results(state)
+	current_scene: str = state.get("current_scene", "arrival_village")
+	
+	# Fallback to environment variable if not provided in state
+	api_key = state.get("api_key", "") or os.getenv("OPENAI_API_KEY")
+	
+	turn.update({
+		"api_key": api_key,
+		"engine": engine,
+		"current_scene": current_scene,
+		"next_scene": current_scene,
+		"next_action": "continue",
+		"new_messages": list(turn["messages"]),
+		"previous_scene": state.get("previous_scene", current_scene),
+		"scene_transitions": state.get("scene_transitions", 0),
+		"auto_roll": state.get("auto_roll"),
+		"usage": dict(state.get("usage") or {}),
+		"prompt_mode": state.get("prompt_mode") or PROMPT_MODE,
+		"scene_prefetch": state.get("scene_prefetch"),
+		"arrival_narration": None,  # Prefetched narration of this turn's change_scene, if any
+		"start_scene": current_scene,
+	})
+	turn["scene_intent"] = _classify_turn_intent(turn)
+	if api_key and not _preempt_scene_change(turn):
+		turn["system_msg"], turn["prompt_components"] = _build_system_message(
+			turn["character"], current_scene, turn["prompt_mode"], turn["messages"]
+		)
+	return turn
+
+
+def _classify_turn_intent(turn: Dict[str, Any]) -> Optional[SceneIntent]:
+	"""Local scene-change intent of the player's input (KP_SCENE_INTENT), not for turns that resolve rolls"""
+	if INTENT_MODE == "off" or turn["rolled_checks"]:
+		return None
+	messages = turn["messages"]
+	if not messages or not isinstance(messages[-1], HumanMessage) or not isinstance(messages[-1].content, str):
+		return None
+	return classify_scene_intent(turn["current_scene"], messages[-1].content)
+
+
+def _preempt_scene_change(turn: Dict[str, Any]) -> bool:
+	"""
+	Perform a high-confidence scene change before the first LLM call (KP_SCENE_INTENT=on).
+	
+	The turn continues as if the Keeper had called change_scene: the entering
+	prompt of the new scene is swapped in and the call and its result are added
+	to the messages, so the first call already narrates the arrival (and
+	change_scene is refused for the rest of the turn).
+	"""
+	intent: Optional[SceneIntent] = turn["scene_intent"]
+	if INTENT_MODE != "on" or intent is None or intent.confidence != "high":
+		return False
+	if turn["scene_transitions"] >= MAX_SCENE_TRANSITIONS_PER_TURN:
+		return False
+	current_scene = turn["current_scene"]
+	args = {"target_scene_id": intent.target, "current_scene_id": current_scene}
+	scene_result = change_scene.invoke(args)
+	if not scene_result.startswith("✓"):
+		return False
+	
+	_trace.debug("scene_preempted", source=current_scene, target=intent.target, reason=intent.reason)
+	SCENE_INTENT.inc(outcome="preempted")
+	turn["previous_scene"] = current_scene
+	turn["current_scene"] = intent.target
+	turn["next_scene"] = intent.target
+	turn["next_action"] = "change_scene"
+	turn["scene_transitions"] += 1
+	_enter_scene(turn, turn["character"], intent.target)
+	
+	if turn["engine"] != "structured":
+		# (The structured engine sends no tool calls; its entering prompt is enough)
+		tool_call_id = f"intent_{intent.target}"
+		turn["messages"] = turn["messages"] + [
+			AIMessage(content="", tool_calls=[{"name": "change_scene", "args": args, "id": tool_call_id}]),
+			ToolMessage(content=scene_result, tool_call_id=tool_call_id),
+		]
+		turn["new_messages"] = list(turn["messages"])
+	_emit_stream_event(TOOL_EVENT_TYPES["change_scene"], {
+		"name": "change_scene",
+		"args": args,
+		"success": True,
+		"current_scene": intent.target,
+		"result": scene_result,
+		"preempted": True
+	})
+	return True
+
+
+def _missing_api_key_update(turn: Dict[str, Any]) -> AgentState:
+	"""State update returned when no OpenAI API key is available"""
+	fallback_msg = AIMessage(
+		content="⚠️ Please enter your OpenAI API Key in the sidebar configuration to use the LLM agent."
+	)
+	return {
+		"messages": turn["messages"] + [fallback_msg],
+		"next_action": "continue",
+		"next_scene": turn["current_scene"]
+	}
+
+
+# Typed stream events for tool calls (see astream_kp_response)
+TOOL_EVENT_TYPES = {
+	"roll_dice": "dice_request",
+	"san_check": "san_request",
+	"change_scene": "scene_change",
+}
+
+# Stream events for checks the server rolled itself (AutoRoll)
+AUTO_ROLL_EVENT_TYPES = {
+	"roll_dice": "dice_result",
+	"san_check": "san_result",
+}
+
+
+def _emit_stream_event(event: str, data: Dict[str, Any]) -> None:
+	"""Send a typed event to astream_kp_response consumers (no-op outside a graph run)"""
+	try:
+		writer = get_stream_writer()
+	except RuntimeError:
+		return
+	writer({"event": event, "data": data})
+
+
+def _check_skill(tool_call: Dict[str, Any]) -> Optional[str]:
+	"""Skill a check tool call tests (AutoRoll.SAN for sanity checks), None for other tools"""
+	if tool_call["name"] == "roll_dice":
+		return tool_call["args"].get("skill_name", "Unknown")
+	if tool_call["name"] == "san_check":
+		return AutoRoll.SAN
+	return None
+
+
+def _request_check(turn: Dict[str, Any], check: PendingCheck) -> None:
+	"""Record a check the player must roll (a turn's new requests replace older unresolved ones)"""
+	if not turn["check_requested"]:
+		turn["pending_checks"] = []
+		turn["check_requested"] = True
+	turn["pending_checks"] = turn["pending_checks"] + [check]
+
+
+def _join_results(previous: Optional[str], result: str) -> str:
+	return f"{previous}\n\n{result}" if previous else result
+
+
+def _apply_tool_calls(response: AIMessage, turn: Dict[str, Any]) -> bool:
+	"""
+	Execute the tool calls of an LLM response and record the results in the turn.
+	
+	Returns:
+		True if the LLM must be re-invoked to narrate the tool results
+	"""
+	_trace.debug("llm_response", tool_calls=len(response.tool_calls))
+	new_messages: List[BaseMessage] = turn["new_messages"]
+	new_messages.append(response)
+	
+	if not response.tool_calls:
+		return False
+	
+	character = turn["character"]
+	
+	# The server rolls a response's checks only if it may roll every one of them;
+	# otherwise they all go to the player as before
+	auto_roll: Optional[AutoRoll] = turn.get("auto_roll")
+	check_skills = [skill for skill in map(_check_skill, response.tool_calls) if skill is not None]
+	auto = auto_roll is not None and bool(check_skills) and all(auto_roll.applies_to(skill) for skill in check_skills)
+	
+	# Note: san_loss may already be set from DiceResult processing
+	for tool_call in response.tool_calls:
+		tool_name = tool_call["name"]
+		tool_args = tool_call["args"]
+		
+		_trace.debug("tool_call", name=tool_name, args=tool_args)
+		TOOL_CALLS.inc(tool=tool_name)
+		
+		if tool_name == "roll_dice" and auto:
+			# Roll on the server and hand the result straight back to the model
+			skill_name = tool_args.get("skill_name", "Unknown")
+			difficulty = tool_args.get("difficulty", "normal")
+			skill_value = tool_args.get("skill_value", 50)
+			d100 = auto_roll.roll_d100()
 			dice_result = process_dice_result(d100, skill_name, difficulty, skill_value)
-			print(f"    🎲 [DICE_RESULT] Processed result: {d100} for {skill_name} check")
-			
-			# Replace the user message with a formatted version
-			messages = messages[:-1] + [HumanMessage(content=f"Dice roll result: {d100}")]
-			
-			# Store for later use in response
-			pending_dice_result = dice_result
+			_trace.debug("dice_auto_roll", roll=d100, skill=skill_name, difficulty=difficulty, skill_value=skill_value)
 			
-			# Update dice_results in state
-			dice_results = state.get("dice_results", []) + [{
+			new_messages.append(ToolMessage(content=dice_result, tool_call_id=tool_call["id"]))
+			turn["pending_dice_result"] = _join_results(turn["pending_dice_result"], dice_result)
+			turn["dice_results"] = turn["dice_results"] + [{
 				"skill": skill_name,
 				"difficulty": difficulty,
 				"roll": d100,
-				"result": dice_result
+				"result": dice_result,
+				"auto": True
 			}]
-			state = {**state, "dice_results": dice_results}
-		
-		# Check for SANResult pattern
-		san_result_match = re.match(r'SANResult:\s*(\d{1,3})(?::(\d+):(\d+))?', last_user_msg, re.IGNORECASE)
-		if san_result_match:
-			d100 = int(san_result_match.group(1))
-			# If full parameters provided, use them; otherwise search backwards for the request
-			if san_result_match.group(2):
-				current_san = int(san_result_match.group(2))
-				san_loss = int(san_result_match.group(3))
-			else:
-				# Search backwards for SAN_CHECK_REQUEST marker
-				current_san = character.get("san", 60)
-				san_loss = 1
-				for msg in reversed(messages):
-					if isinstance(msg, ToolMessage):
-						content = msg.content
-						request_match = re.match(r'\[SAN_CHECK_REQUEST:(\d+):(\d+)\]', content)
-						if request_match:
-							current_san = int(request_match.group(1))
-							san_loss = int(request_match.group(2))
-							break
-			
-			# Process the SAN check result
+			_emit_stream_event(AUTO_ROLL_EVENT_TYPES[tool_name], {
+				"name": tool_name,
+				"args": tool_args,
+				"roll": d100,
+				"result": dice_result
+			})
+		
+		elif tool_name == "san_check" and auto:
+			# Roll the SAN check on the server and apply the loss right away
+			current_san = character.get("san", 60)
+			san_loss = tool_args.get("san_loss", 1)
+			d100 = auto_roll.roll_d100()
 			san_result, actual_loss = process_san_check_result(d100, current_san, san_loss)
-			print(f"    🧠 [SAN_RESULT] Processed result: {d100}, SAN loss: {actual_loss}")
+			_trace.debug("san_auto_roll", roll=d100, current_san=current_san, san_loss=actual_loss)
 			
-			# Update character SAN
 			if actual_loss > 0:
-				new_san = max(0, current_san - actual_loss)
 				character = character.copy()
-				character["san"] = new_san
+				character["san"] = max(0, current_san - actual_loss)
+				turn["character"] = character
 			
-			# Replace the user message with a formatted version
-			messages = messages[:-1] + [HumanMessage(content=f"SAN check result: {d100}")]
+			new_messages.append(ToolMessage(content=san_result, tool_call_id=tool_call["id"]))
+			turn["pending_san_result"] = _join_results(turn["pending_san_result"], san_result)
+			turn["san_loss"] = turn["san_loss"] + actual_loss
+			_emit_stream_event(AUTO_ROLL_EVENT_TYPES[tool_name], {
+				"name": tool_name,
+				"args": {"current_san": current_san, "san_loss": san_loss},
+				"roll": d100,
+				"result": san_result,
+				"san": character.get("san", current_san)
+			})
+		
+		elif tool_name == "roll_dice":
+			# Request dice roll from frontend (returns special marker)
+			skill_name = tool_args.get("skill_name", "Unknown")
+			difficulty = tool_args.get("difficulty", "normal")
+			skill_value = tool_args.get("skill_value", 50)
+			dice_request = roll_dice.invoke(tool_args)
+			_trace.debug("dice_request", skill=skill_name, difficulty=difficulty, skill_value=skill_value, marker=dice_request)
 			
-			# Store for later use in response
-			pending_san_result = san_result
-			san_loss_amount = actual_loss
-	
-	# Fallback to environment variable if not provided in state
-	if not api_key:
-		api_key = os.getenv("OPENAI_API_KEY")
-	
-	if not api_key:
-		fallback_msg = AIMessage(
-			content="⚠️ Please enter your OpenAI API Key in the sidebar configuration to use the LLM agent."
-		)
-		return {
-			"messages": messages + [fallback_msg],
-			"next_action": "continue",
-			"next_scene": current_scene
-		}
-	
-	# Initialize LLM with tools
-	llm = ChatOpenAI(
-		model="gpt-4o-mini",
-		temperature=0.7,
-		api_key=api_key
-	).bind_tools([roll_dice, san_check, change_scene])
-	
-	# Build global system prompt
-	system_prompt = build_global_system_prompt(character, current_scene)
-	
-	# Add scene-specific prompt template (this is the main scene guidance)
-	scene_prompt = get_scene_prompt(current_scene, character)
-	if scene_prompt:
-		system_prompt += f"\n\n**=== SCENE PROMPT TEMPLATE ===**\n{scene_prompt}"
-	
-	system_msg = SystemMessage(content=system_prompt)
-	
-	# Combine system message with conversation history
-	prompt_messages = [system_msg] + messages
-	
-	# Generate response with tool calling capability
-	print(f"\n🤖 [LLM INVOKE] Calling LLM with {len(prompt_messages)} messages (scene: {current_scene})")
-	response = llm.invoke(prompt_messages)
-	
-	# Check if tools were called
-	print(f"📥 [LLM RESPONSE] Received response, has tool_calls: {bool(response.tool_calls)}")
-	new_messages = messages + [response]
-	next_action = "continue"
-	next_scene = current_scene
-	
-	# Process tool calls if any
-	# Note: san_loss_amount may already be set from DiceResult processing above
-	
-	if response.tool_calls:
-		print(f"\n🔧 [TOOL CALLS] Detected {len(response.tool_calls)} tool call(s)")
-		for tool_call in response.tool_calls:
-			tool_name = tool_call["name"]
-			tool_args = tool_call["args"]
+			# Add tool message with the request marker (frontend will detect this)
+			tool_msg = ToolMessage(
+				content=dice_request,
+				tool_call_id=tool_call["id"]
+			)
+			new_messages.append(tool_msg)
+			_request_check(turn, _dice_check(tool_call["id"], skill_name, difficulty, skill_value, dice_request))
+			_emit_stream_event(TOOL_EVENT_TYPES[tool_name], {"name": tool_name, "args": tool_args, "marker": dice_request})
 			
-			print(f"  📌 [TOOL] {tool_name} called with args: {tool_args}")
+			turn["next_action"] = "roll_dice"
+		
+		elif tool_name == "san_check":
+			# Request SAN check from frontend (returns special marker)
+			current_san = character.get("san", 60)
+			san_loss = tool_args.get("san_loss", 1)
 			
-			if tool_name == "roll_dice":
-				# Request dice roll from frontend (returns special marker)
-				skill_name = tool_args.get("skill_name", "Unknown")
-				difficulty = tool_args.get("difficulty", "normal")
-				skill_value = tool_args.get("skill_value", 50)
-				print(f"    🎲 [ROLL_DICE] Requesting dice roll: Skill: {skill_name}, Difficulty: {difficulty}, Value: {skill_value}")
-				dice_request = roll_dice.invoke(tool_args)
-				print(f"    🎲 [ROLL_DICE] Request marker: {dice_request}")
-				
-				# Add tool message with the request marker (frontend will detect this)
-				tool_msg = ToolMessage(
-					content=dice_request,
-					tool_call_id=tool_call["id"]
-				)
-				new_messages.append(tool_msg)
-				
-				next_action = "roll_dice"
+			san_request = san_check.invoke({
+				"current_san": current_san,
+				"san_loss": san_loss
+			})
+			_trace.debug("san_request", current_san=current_san, san_loss=san_loss, marker=san_request)
 			
-			elif tool_name == "san_check":
-				# Request SAN check from frontend (returns special marker)
-				current_san = character.get("san", 60)
-				san_loss = tool_args.get("san_loss", 1)
-				
-				print(f"    🧠 [SAN_CHECK] Requesting SAN check: Current SAN: {current_san}, SAN Loss: {san_loss}")
-				san_request = san_check.invoke({
-					"current_san": current_san,
-					"san_loss": san_loss
-				})
-				print(f"    🧠 [SAN_CHECK] Request marker: {san_request}")
-				
-				# Add tool message with the request marker (frontend will detect this)
-				tool_msg = ToolMessage(
-					content=san_request,
-					tool_call_id=tool_call["id"]
-				)
-				new_messages.append(tool_msg)
-				
-				next_action = "san_check"
+			# Add tool message with the request marker (frontend will detect this)
+			tool_msg = ToolMessage(
+				content=san_request,
+				tool_call_id=tool_call["id"]
+			)
+			new_messages.append(tool_msg)
+			_request_check(turn, _san_check(tool_call["id"], current_san, san_loss, san_request))
+			_emit_stream_event(TOOL_EVENT_TYPES[tool_name], {
+				"name": tool_name,
+				"args": {"current_san": current_san, "san_loss": san_loss},
+				"marker": san_request
+			})
 			
-			elif tool_name == "change_scene":
-				# Execute scene change
-				target_scene = tool_args.get("target_scene_id", current_scene)
-				
-				print(f"    🔄 [CHANGE_SCENE] Transitioning from '{current_scene}' to '{target_scene}'")
+			turn["next_action"] = "san_check"
+		
+		elif tool_name == "change_scene":
+			# Execute scene change
+			current_scene = turn["current_scene"]
+			target_scene = tool_args.get("target_scene_id", current_scene)
+			
+			if turn["scene_transitions"] >= MAX_SCENE_TRANSITIONS_PER_TURN:
+				# Loop guard: every tool call still needs its ToolMessage
+				scene_result = f"✗ The scene already changed this turn. Stay in '{current_scene}' and narrate the arrival."
+			else:
 				scene_result = change_scene.invoke({
 					"target_scene_id": target_scene,
 					"current_scene_id": current_scene
 				})
-				print(f"    🔄 [CHANGE_SCENE] Result: {scene_result}")
-				
-				# Check if scene change was successful (starts with ✓)
-				if scene_result.startswith("✓"):
-					# Update current scene
-					current_scene = target_scene
-					next_scene = target_scene
-					next_action = "change_scene"
-					print(f"    ✅ [CHANGE_SCENE] Scene successfully changed to '{target_scene}'")
-					
-					# Update system prompt with new scene information
-					# Rebuild system prompt with new scene
-					system_prompt = build_global_system_prompt(character, current_scene)
-					scene_prompt = get_scene_prompt(current_scene, character)
-					if scene_prompt:
-						system_prompt += f"\n\n**=== SCENE PROMPT TEMPLATE ===**\n{scene_prompt}"
-					
-					# Update system message in new_messages
-					system_msg = SystemMessage(content=system_prompt)
+			_trace.debug("change_scene", source=current_scene, target=target_scene, result=scene_result)
+			
+			# Check if scene change was successful (starts with ✓)
+			if scene_result.startswith("✓"):
+				# Update current scene
+				turn["previous_scene"] = current_scene
+				turn["current_scene"] = target_scene
+				turn["next_scene"] = target_scene
+				turn["next_action"] = "change_scene"
+				turn["scene_transitions"] += 1
 				
-				# Add tool message to conversation
-				tool_msg = ToolMessage(
-					content=scene_result,
-					tool_call_id=tool_call["id"]
-				)
-				new_messages.append(tool_msg)
-	
-	# Get final response after tool calls
-	if response.tool_calls:
-		# Check if we only have dice/SAN check requests (no need to re-invoke LLM)
-		only_dice_requests = True
-		for tool_call in response.tool_calls:
-			tool_name = tool_call["name"]
-			if tool_name not in ["roll_dice", "san_check"]:
-				only_dice_requests = False
-				break
-		
-		if only_dice_requests:
-			# For dice/SAN check requests, don't generate additional response
-			# The tool message with the request marker is enough
-			# Create a minimal response that will be replaced by the request marker
-			print(f"\n🎲 [DICE/SAN REQUEST] Skipping LLM re-invoke for dice/SAN check request")
-			final_response = AIMessage(content="")  # Empty content, frontend will detect the marker
-			new_messages.append(final_response)
-		else:
-			# Re-invoke to get response after tool execution
-			# If scene was changed via change_scene tool, system_msg already updated with new scene info
-			# Otherwise use original system_msg
-			print(f"\n🔄 [LLM RE-INVOKE] Getting final response after tool execution (scene: {current_scene})")
-			final_response = llm.invoke([system_msg] + new_messages)
-			new_messages.append(final_response)
-			print(f"✅ [FINAL RESPONSE] Generated final response")
+				# Swap in the new scene prompt (every NPC of the new scene is in focus);
+				# the re-invoke below narrates the arrival
+				_enter_scene(turn, character, target_scene)
+			
+			# Add tool message to conversation
+			tool_msg = ToolMessage(
+				content=scene_result,
+				tool_call_id=tool_call["id"]
+			)
+			new_messages.append(tool_msg)
+			_emit_stream_event(TOOL_EVENT_TYPES[tool_name], {
+				"name": tool_name,
+				"args": tool_args,
+				"success": scene_result.startswith("✓"),
+				"current_scene": turn["current_scene"],
+				"result": scene_result
+			})
+	
+	# Check if we only have dice/SAN check requests (no need to re-invoke LLM)
+	only_dice_requests = all(
+		tool_call["name"] in ["roll_dice", "san_check"] for tool_call in response.tool_calls
+	)
+	if only_dice_requests and not auto:
+		# For dice/SAN check requests, don't generate additional response
+		# The tool message with the request marker is enough
+		# Create a minimal response that will be replaced by the request marker
+		_trace.debug("skip_reinvoke", reason="check_request")
+		new_messages.append(AIMessage(content=""))  # Empty content, frontend will detect the marker
+		return False
+	
+	# Re-invoke to get response after tool execution (including auto-rolled check results)
+	# If scene was changed via change_scene tool, system_msg already updated with new scene info
+	_trace.debug("llm_reinvoke", scene=turn["current_scene"])
+	return True
+
+
+def _drop_reinvoke_tool_calls(response: AIMessage, turn: Dict[str, Any]) -> None:
+	"""
+	Report the tool calls of a re-invoke response: a turn runs tools once, so a
+	scene change or check asked for while narrating the results is not made
+	"""
+	for tool_call in response.tool_calls or []:
+		TOOL_CALLS_DROPPED.inc(tool=tool_call["name"])
+		_trace.warning("reinvoke_tool_call_dropped", tool=tool_call["name"], args=tool_call.get("args"), scene=turn["current_scene"])
+
+
+def _prompt_key(character: Dict[str, Any], prompt_mode: str) -> Tuple[Any, ...]:
+	"""What a scene-entry prompt depends on besides the scene (see PrefetchedScene)"""
+	return (prompt_mode,) + tuple(character.get(field) for field in _CHARACTER_PROMPT_FIELDS)
+
+
+def _conversation_key(messages: List[BaseMessage]) -> Tuple[Any, ...]:
+	"""Identifies the messages a continuation follows (their number and the last one)"""
+	last = messages[-1].content if messages else ""
+	return (len(messages), last if isinstance(last, str) else "")
+
 
+def _enter_scene(turn: Dict[str, Any], character: Dict[str, Any], target_scene: str) -> None:
+	"""Switch the turn to the entering prompt of a scene, taking a prefetched one when it still fits"""
+	prefetcher: Optional[ScenePrefetcher] = turn.get("scene_prefetch")
+	prefetched = prefetcher.take(target_scene) if prefetcher is not None else None
+	if prefetched is not None and prefetched.prompt_key == _prompt_key(character, turn["prompt_mode"]):
+		turn["system_msg"], turn["prompt_components"] = prefetched.system_msg, dict(prefetched.prompt_components)
+		turn["arrival_narration"] = prefetched.take_narration(_conversation_key(turn["messages"]))
+		return
+	if prefetched is not None:
+		prefetched.discard()  # Built for other stats (SAN changed) or another prompt mode
+	turn["system_msg"], turn["prompt_components"] = _build_system_message(
+		character, target_scene, turn["prompt_mode"], turn["messages"], entering=True
+	)
+
+
+def _add_usage(turn: Dict[str, Any], counts: Dict[str, int]) -> None:
+	"""Accumulate the token usage of one Keeper LLM call into the turn"""
+	usage = turn["usage"]
+	for key, value in counts.items():
+		usage[key] = usage.get(key, 0) + value
+
+
+def _finish_keeper_turn(turn: Dict[str, Any]) -> AgentState:
+	"""Turn the per-turn working data into the keeper node's state update"""
+	if turn["scene_intent"] is not None and INTENT_MODE == "shadow":
+		moved = turn["current_scene"] if turn["current_scene"] != turn["start_scene"] else None
+		outcome = record_intent_outcome(turn["scene_intent"], moved)
+		_trace.debug("scene_intent", outcome=outcome, predicted=turn["scene_intent"].target, actual=moved)
 	return {
-		"messages": new_messages,
-		"character": character,  # Updated character with new SAN if applicable
-		"current_scene": current_scene,  # Updated scene if change_scene was called
-		"next_action": next_action,
-		"next_scene": next_scene,
-		"dice_results": state.get("dice_results", []),
-		"san_loss": san_loss_amount,
-		"pending_dice_result": pending_dice_result,
-		"pending_san_result": pending_san_result
+		"messages": turn["new_messages"],
+		"character": turn["character"],  # Updated character with new SAN if applicable
+		"current_scene": turn["current_scene"],  # Updated scene if change_scene was called
+		"next_action": turn["next_action"],
+		"next_scene": turn["next_scene"],
+		"dice_results": turn["dice_results"],
+		"san_loss": turn["san_loss"],
+		"pending_dice_result": turn["pending_dice_result"],
+		"pending_san_result": turn["pending_san_result"],
+		"previous_scene": turn["previous_scene"],
+		"scene_transitions": turn["scene_transitions"],
+		"pending_checks": turn["pending_checks"],
+		"check_requested": turn["check_requested"],
+		"usage": turn["usage"],
+		"prompt_mode": turn["prompt_mode"],
+		"prompt_components": turn.get("prompt_components", {})
 	}
 
 
-def scene_node(state: AgentState) -> AgentState:
-	"""Handle scene transition logic"""
-	current_scene = state.get("current_scene", "arrival_village")
-	next_scene = state.get("next_scene", current_scene)
-	scene_history = state.get("scene_history", [])
-	
-	print(f"\n🎬 [SCENE_NODE] Processing scene transition")
-	print(f"    Current scene: {current_scene}")
-	print(f"    Next scene: {next_scene}")
+def keeper_node(state: AgentState) -> AgentState:
+	"""Main Keeper node with LLM and tools"""
+	with NODE_SECONDS.time(node="keeper"):
+		turn = _start_keeper_turn(state, "tools")
+		if not turn["api_key"]:
+			return _missing_api_key_update(turn)
+		
+		llm = _build_keeper_llm(turn["api_key"])
+		
+		# Combine system message with conversation history
+		prompt_messages = [turn["system_msg"]] + turn["messages"]
+		
+		# Generate response with tool calling capability
+		_trace.debug("llm_invoke", messages=len(prompt_messages), scene=turn["current_scene"])
+		with phase("llm_first"), LLM_CALL_SECONDS.time(call="first"):
+			response = llm.invoke(prompt_messages)
+		usage = record_usage("first", response)
+		_add_usage(turn, usage)
+		_profile_call(turn, "first", turn["messages"], usage)
+		
+		with phase("tools"):
+			reinvoke = _apply_tool_calls(response, turn)
+		
+		if reinvoke:
+			with phase("llm_reinvoke"), LLM_CALL_SECONDS.time(call="reinvoke"):
+				final_response = llm.invoke([turn["system_msg"]] + turn["new_messages"])
+			usage = record_usage("reinvoke", final_response)
+			_add_usage(turn, usage)
+			_profile_call(turn, "reinvoke", turn["new_messages"], usage)
+			_drop_reinvoke_tool_calls(final_response, turn)
+			turn["new_messages"].append(final_response)
+		
+		return _finish_keeper_turn(turn)
+
+
+async def akeeper_node(state: AgentState) -> AgentState:
+	"""Async variant of keeper_node; awaits the LLM instead of blocking the event loop"""
+	with NODE_SECONDS.time(node="keeper"):
+		turn = _start_keeper_turn(state, "tools")
+		if not turn["api_key"]:
+			return _missing_api_key_update(turn)
+		
+		llm = _build_keeper_llm(turn["api_key"])
+		
+		# Combine system message with conversation history
+		prompt_messages = [turn["system_msg"]] + turn["messages"]
+		
+		# Generate response with tool calling capability (or take the one generated while the player rolled)
+		with phase("llm_first"):
+			response = await _take_speculation(state.get("speculation"), turn)
+			if response is None:
+				# Scene changed up front (see _preempt_scene_change) with a prefetched arrival
+				response = await _take_arrival_narration(turn)
+			if response is None:
+				_trace.debug("llm_invoke", messages=len(prompt_messages), scene=turn["current_scene"])
+				with LLM_CALL_SECONDS.time(call="first"):
+					response = await llm.ainvoke(prompt_messages)
+		usage = record_usage("first", response)
+		_add_usage(turn, usage)
+		_profile_call(turn, "first", turn["messages"], usage)
+		
+		with phase("tools"):
+			reinvoke = _apply_tool_calls(response, turn)
+		
+		if reinvoke:
+			with phase("llm_reinvoke"):
+				final_response = await _take_arrival_narration(turn, response)
+				if final_response is None:
+					with LLM_CALL_SECONDS.time(call="reinvoke"):
+						final_response = await llm.ainvoke([turn["system_msg"]] + turn["new_messages"])
+			usage = record_usage("reinvoke", final_response)
+			_add_usage(turn, usage)
+			_profile_call(turn, "reinvoke", turn["new_messages"], usage)
+			_drop_reinvoke_tool_calls(final_response, turn)
+			turn["new_messages"].append(final_response)
+		
+		return _finish_keeper_turn(turn)
+
+
+def _tool_call(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+	return {"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:24]}"}
+
+
+def _apply_structured_output(response: AIMessage, turn: Dict[str, Any]) -> Optional[List[BaseMessage]]:
+	"""
+	Validate a structured Keeper response and apply it as the equivalent tool calls.
 	
-	if next_scene != current_scene:
-		# Update scene
-		scene_history = scene_history + [current_scene]
+	The narration already covers the scene change, so nothing is re-invoked for
+	it. Returns the messages of a follow-up call only when the server rolled
+	the checks itself (AutoRoll) and their results still need narrating.
+	"""
+	output, problems = parse_keeper_output(response.content, turn["current_scene"], turn["character"])
+	if problems:
+		_trace.warning("structured_output_invalid", scene=turn["current_scene"], problems=problems)
+	
+	tool_calls = []
+	if output["scene_change"] is not None:
+		tool_calls.append(_tool_call("change_scene", {
+			"target_scene_id": output["scene_change"],
+			"current_scene_id": turn["current_scene"]
+		}))
+	for check in output["checks"]:
+		if check["kind"] == "san":
+			tool_calls.append(_tool_call("san_check", {
+				"current_san": turn["character"].get("san", 60),
+				"san_loss": check["san_loss"]
+			}))
+		else:
+			tool_calls.append(_tool_call("roll_dice", {
+				"skill_name": check["skill_name"],
+				"difficulty": check["difficulty"],
+				"skill_value": check["skill_value"]
+			}))
+	message = AIMessage(content=output["narration"], tool_calls=tool_calls, usage_metadata=response.usage_metadata)
+	_apply_tool_calls(message, turn)
+	
+	if turn["check_requested"]:
+		return None  # The player rolls; the reply is the check markers
+	if not output["checks"]:
+		_emit_narration(message)
+		return None
+	
+	check_ids = {tool_call["id"] for tool_call in tool_calls if tool_call["name"] != "change_scene"}
+	results = [msg.content for msg in turn["new_messages"] if isinstance(msg, ToolMessage) and msg.tool_call_id in check_ids]
+	follow_up = list(turn["messages"])
+	if output["narration"]:
+		follow_up.append(AIMessage(content=output["narration"]))
+	follow_up.append(HumanMessage(content="Check results:\n" + "\n\n".join(results)))
+	return follow_up
+
+
+def _finish_structured_follow_up(response: AIMessage, turn: Dict[str, Any]) -> None:
+	"""Add the narration of the auto-rolled checks (a follow-up's own actions are not applied, as in tools mode)"""
+	output, _ = parse_keeper_output(response.content, turn["current_scene"], turn["character"])
+	for check in output["checks"]:
+		TOOL_CALLS_DROPPED.inc(tool="san_check" if check["kind"] == "san" else "roll_dice")
+	if output["scene_change"]:
+		TOOL_CALLS_DROPPED.inc(tool="change_scene")
+	if output["checks"] or output["scene_change"]:
+		_trace.warning("structured_follow_up_actions_dropped", checks=len(output["checks"]), scene_change=output["scene_change"])
+	message = AIMessage(content=output["narration"], usage_metadata=response.usage_metadata)
+	_emit_narration(message)
+	turn["new_messages"].append(message)
+
+
+def _record_call(turn: Dict[str, Any], call: str, messages: List[BaseMessage], response: AIMessage) -> None:
+	usage = record_usage(call, response)
+	_add_usage(turn, usage)
+	_profile_call(turn, call, messages, usage)
+
+
+def structured_keeper_node(state: AgentState) -> AgentState:
+	"""Keeper node of the structured engine (KP_ENGINE=structured): one JSON response per turn"""
+	with NODE_SECONDS.time(node="keeper"):
+		turn = _start_keeper_turn(state, "structured")
+		if not turn["api_key"]:
+			return _missing_api_key_update(turn)
 		
-		# Add scene transition message
-		scene_info = SCENES.get(next_scene, {})
-		scene_name = scene_info.get("name", next_scene)
+		llm = _build_structured_llm(turn["api_key"])
+		_trace.debug("llm_invoke", messages=len(turn["messages"]), scene=turn["current_scene"], engine="structured")
+		with phase("llm_first"), LLM_CALL_SECONDS.time(call="first"):
+			response = llm.invoke(_structured_prompt(turn, turn["messages"]))
+		_record_call(turn, "first", turn["messages"], response)
 		
-		print(f"    ✅ [SCENE_NODE] Scene transition confirmed: {current_scene} → {next_scene} ({scene_name})")
+		with phase("tools"):
+			follow_up = _apply_structured_output(response, turn)
 		
-		transition_msg = AIMessage(
-			content=f"\n\n*[Scene Transition: You have entered {scene_name}]*\n"
-		)
+		if follow_up is not None:
+			with phase("llm_reinvoke"), LLM_CALL_SECONDS.time(call="reinvoke"):
+				final_response = llm.invoke(_structured_prompt(turn, follow_up))
+			_record_call(turn, "reinvoke", follow_up, final_response)
+			_finish_structured_follow_up(final_response, turn)
 		
-		messages = state["messages"] + [transition_msg]
+		return _finish_keeper_turn(turn)
+
+
+async def astructured_keeper_node(state: AgentState) -> AgentState:
+	"""Async variant of structured_keeper_node (takes a speculative response like akeeper_node)"""
+	with NODE_SECONDS.time(node="keeper"):
+		turn = _start_keeper_turn(state, "structured")
+		if not turn["api_key"]:
+			return _missing_api_key_update(turn)
 		
-		return {
-			"messages": messages,
-			"current_scene": next_scene,
-			"scene_history": scene_history,
-			"next_action": "continue",
-			"next_scene": next_scene
-		}
+		llm = _build_structured_llm(turn["api_key"])
+		with phase("llm_first"):
+			response = await _take_speculation(state.get("speculation"), turn)
+			if response is None:
+				_trace.debug("llm_invoke", messages=len(turn["messages"]), scene=turn["current_scene"], engine="structured")
+				with LLM_CALL_SECONDS.time(call="first"):
+					response = await llm.ainvoke(_structured_prompt(turn, turn["messages"]))
+		_record_call(turn, "first", turn["messages"], response)
+		
+		with phase("tools"):
+			follow_up = _apply_structured_output(response, turn)
+		
+		if follow_up is not None:
+			with phase("llm_reinvoke"), LLM_CALL_SECONDS.time(call="reinvoke"):
+				final_response = await llm.ainvoke(_structured_prompt(turn, follow_up))
+			_record_call(turn, "reinvoke", follow_up, final_response)
+			_finish_structured_follow_up(final_response, turn)
+		
+		return _finish_keeper_turn(turn)
+
+
+async def _take_speculation(speculation: Optional[CheckSpeculation], turn: Dict[str, Any]) -> Optional[AIMessage]:
+	"""The speculative first response for this turn's roll, if one was generated for its tier"""
+	if speculation is None:
+		return None
+	rolled = turn["rolled_checks"]
+	if not rolled:
+		speculation.discard()  # The player did something else; the check stays pending
+		return None
+	request_id, tier = rolled[0] if len(rolled) == 1 else (None, None)
+	response = await speculation.take(request_id, tier, _conversation_key(turn["messages"][:-1]))
+	if response is not None and turn["engine"] != "structured":
+		_emit_narration(response)  # (The structured engine streams the narration once it is parsed)
+	return response
+
+
+def _emit_narration(response: AIMessage) -> None:
+	"""Stream a precomputed narration (never streamed by the LLM callbacks) as one chunk"""
+	if isinstance(response.content, str) and response.content:
+		_emit_stream_event("token", {"text": response.content})
+
+
+async def _take_arrival_narration(turn: Dict[str, Any], response: Optional[AIMessage] = None) -> Optional[AIMessage]:
+	"""
+	The prefetched narration of this turn's scene change, when change_scene was
+	the response's only tool call (other tool results need narrating too)
+	"""
+	narration = turn["arrival_narration"]
+	turn["arrival_narration"] = None
+	if narration is None:
+		return None
+	if response is not None and any(tool_call["name"] != "change_scene" for tool_call in response.tool_calls):
+		narration.cancel()
+		SCENE_PREFETCH.inc(result="cancelled")
+		return None
+	try:
+		final_response = await narration
+	except Exception as exc:
+		_trace.warning("arrival_narration_failed", scene=turn["current_scene"], error=str(exc))
+		return None
+	_emit_narration(final_response)
+	return final_response
+
+
+async def _aprefetch_arrival(
+	system_msg: SystemMessage,
+	messages: List[BaseMessage],
+	api_key: str,
+	current_scene: str,
+	target_scene: str
+) -> AIMessage:
+	"""The Keeper's re-invoke after a change_scene to target_scene, as if the model called it now"""
+	args = {"target_scene_id": target_scene, "current_scene_id": current_scene}
+	tool_call_id = f"prefetch_{target_scene}"
+	messages = messages + [
+		AIMessage(content="", tool_calls=[{"name": "change_scene", "args": args, "id": tool_call_id}]),
+		ToolMessage(content=change_scene.invoke(args), tool_call_id=tool_call_id),
+	]
+	llm = _build_keeper_llm(api_key)
+	with LLM_CALL_SECONDS.time(call="prefetch"):
+		return await llm.ainvoke([system_msg] + messages)
+
+
+def prefetch_scene_entries(prefetcher: ScenePrefetcher, state: AgentState) -> Tuple[str, ...]:
+	"""
+	Warm the scenes the player's input points to (see transitions_mentioned),
+	e.g. the church when they mention it: build the entering prompt now and,
+	if the prefetcher narrates, start the arrival narration in the background,
+	alongside the turn's first LLM call. Returns the warmed scene IDs.
+	"""
+	prefetcher.expire()
+	messages = state["messages"]
+	if not messages or not isinstance(messages[-1], HumanMessage):
+		return ()
+	current_scene = state.get("current_scene", "arrival_village")
+	targets = transitions_mentioned(current_scene, messages[-1].content)
+	if not targets:
+		return ()
+	
+	character = state["character"]
+	prompt_mode = state.get("prompt_mode") or PROMPT_MODE
+	api_key = state.get("api_key", "") or os.getenv("OPENAI_API_KEY")
+	prompt_key = _prompt_key(character, prompt_mode)
+	conversation = _conversation_key(messages)
+	for target in targets:
+		if prefetcher.fresh(target, prompt_key, conversation):
+			continue  # Retried turn
+		system_msg, components = _build_system_message(character, target, prompt_mode, messages, entering=True)
+		narration = None
+		# The structured engine narrates the arrival in the same call, so there is no re-invoke to prefetch
+		if prefetcher.narrate and api_key and ENGINE_MODE != "structured":
+			if speculation_capacity() > 0:
+				narration = start_continuation(_aprefetch_arrival(system_msg, messages, api_key, current_scene, target))
+			else:
+				SCENE_PREFETCH.inc(result="skipped_load")
+		prefetcher.put(PrefetchedScene(target, prompt_key, conversation, system_msg, components, narration))
+	_trace.debug("scene_prefetch", scene=current_scene, targets=list(targets), narrate=prefetcher.narrate)
+	return targets
+
+
+# How a speculative turn reports the assumed outcome to the LLM
+_TIER_LABELS = {"success": "Success", "failure": "Failure", "critical": "Critical Success", "fumble": "Fumble"}
+
+
+async def _aspeculative_response(state: AgentState, skill: str, tier: str) -> AIMessage:
+	"""First Keeper LLM call of a turn that resolves a check with an assumed roll of a tier"""
+	turn = _start_keeper_turn(state, ENGINE_MODE)
+	# Only the outcome, so the narration can't quote the assumed roll (the real one comes with the result)
+	messages = turn["messages"][:-1] + [HumanMessage(content=f"Check results:\n- {skill} check: {_TIER_LABELS[tier]}")]
+	with LLM_CALL_SECONDS.time(call="speculative"):
+		if turn["engine"] == "structured":
+			return await _build_structured_llm(turn["api_key"]).ainvoke(_structured_prompt(turn, messages))
+		return await _build_keeper_llm(turn["api_key"]).ainvoke([turn["system_msg"]] + messages)
+
+
+# Server defaults for sessions that don't choose (see KPSession.speculate_checks / scene_prefetch)
+SPECULATE_CHECKS = os.getenv("KP_SPECULATE_CHECKS", "0") == "1"
+PREFETCH_NARRATION = os.getenv("KP_PREFETCH_NARRATION", "0") == "1"
+
+
+def speculate_check_outcomes(
+	character: Dict[str, Any],
+	chat_history: List[Dict[str, str]],
+	api_key: str,
+	current_scene: str,
+	pending_checks: List[PendingCheck],
+	prompt_mode: Optional[str] = None,
+	tiers: Iterable[str] = SPECULATE_TIERS
+) -> Optional[CheckSpeculation]:
+	"""
+	Start the Keeper's reply to each likely outcome of a pending check in the
+	background, while the player rolls (call from the event loop).
+	
+	Each tier's continuation resolves the check with a representative roll of
+	that tier (see tier_roll), and the LLM is told the outcome, not the roll. Pass the returned
+	CheckSpeculation as speculation to the turn that sends the real roll.
+	Only a single pending check is speculated on; None when there is nothing
+	to do or too many continuations are already in flight.
+	"""
+	if len(pending_checks) != 1 or not api_key:
+		return None
+	check = pending_checks[0]
+	if check.get("kind") == "san":
+		threshold = check.get("target", character.get("san", 60))
 	else:
-		print(f"    ℹ️ [SCENE_NODE] No scene change (already in {current_scene})")
+		threshold = _difficulty_threshold(check.get("difficulty", "normal"), check.get("target", 50))[0]
+	rolls = {tier: tier_roll(tier, threshold) for tier in tiers}
+	rolls = {tier: roll for tier, roll in rolls.items() if roll is not None}
+	if not rolls:
+		return None
+	if speculation_capacity() < len(rolls):
+		SPECULATION.inc(result="skipped_load")
+		return None
+	
+	tasks = {}
+	conversation: Tuple[Any, ...] = ()
+	for tier, roll in rolls.items():
+		state = _build_initial_state(
+			"", character, chat_history, api_key, current_scene,
+			pending_checks=[check],
+			check_results=[{"request_id": check.get("request_id"), "roll": roll}],
+			prompt_mode=prompt_mode
+		)
+		conversation = _conversation_key(state["messages"][:-1])
+		tasks[tier] = start_continuation(_aspeculative_response(state, check.get("skill", "Unknown"), tier))
+	# Every tier shares the same prompt but for the roll; estimate it once for the waste metric
+	prompt_tokens = sum(_build_system_message(character, current_scene, prompt_mode or PROMPT_MODE)[1].values())
+	prompt_tokens += history_tokens(chat_history)
+	SPECULATION.inc(len(tasks), result="started")
+	_trace.debug("speculation_start", request_id=check.get("request_id"), skill=check.get("skill"), tiers=list(tasks))
+	return CheckSpeculation(check.get("request_id"), tasks, prompt_tokens, conversation)
+
+
+def scene_node(state: AgentState) -> AgentState:
+	"""Handle scene transition logic"""
+	with NODE_SECONDS.time(node="scene_transition"):
+		return _scene_transition(state)
+
+
+def _scene_transition(state: AgentState) -> AgentState:
+	"""
+	Bookkeeping after a scene change.
 	
-	return state
+	keeper_node has already switched to the new scene prompt and narrated the
+	arrival in its single re-invoke, so no further LLM call is made here and
+	the graph ends after this node.
+	"""
+	current_scene = state.get("current_scene", "arrival_village")
+	previous_scene = state.get("previous_scene", current_scene)
+	scene_history = state.get("scene_history", [])
+	
+	_trace.debug("scene_node", previous_scene=previous_scene, current_scene=current_scene)
+	
+	if previous_scene != current_scene:
+		scene_history = scene_history + [previous_scene]
+	
+	return {
+		"scene_history": scene_history,
+		"next_action": "continue",
+		"next_scene": current_scene
+	}
 
 
 # ==================== ROUTING ====================
@@ -646,25 +1655,26 @@ def route_after_keeper(state: AgentState) -> str:
 	"""Route decision after keeper node"""
 	next_action = state.get("next_action", "continue")
 	
-	print(f"\n🔀 [ROUTE] Routing after keeper, next_action: {next_action}")
+	_trace.debug("route_after_keeper", next_action=next_action)
 	
 	if next_action == "change_scene":
-		print(f"    → Routing to scene_transition node")
 		return "scene_transition"
 	else:
 		# After tool execution (roll_dice, san_check) or continue, end
-		print(f"    → Routing to END")
 		return END
 
 
 # ==================== GRAPH BUILDER ====================
 
-def build_kp_graph() -> StateGraph:
-	"""Build and compile the LangGraph for KP agent with scenes and tools"""
+def build_kp_graph(engine: Optional[str] = None) -> StateGraph:
+	"""Build and compile the LangGraph for KP agent with scenes and tools (engine: ENGINE_MODES, default ENGINE_MODE)"""
 	graph = StateGraph(AgentState)
 	
-	# Add nodes
-	graph.add_node("keeper", keeper_node)
+	# Add nodes (keeper runs keeper_node on invoke and akeeper_node on ainvoke)
+	if (engine or ENGINE_MODE) == "structured":
+		graph.add_node("keeper", RunnableLambda(structured_keeper_node, afunc=astructured_keeper_node))
+	else:
+		graph.add_node("keeper", RunnableLambda(keeper_node, afunc=akeeper_node))
 	graph.add_node("scene_transition", scene_node)
 	
 	# Define flow
@@ -677,71 +1687,114 @@ def build_kp_graph() -> StateGraph:
 			END: END
 		}
 	)
-	graph.add_edge("scene_transition", "keeper")  # Return to keeper after scene change
+	# The keeper already narrated the arrival: ending here (instead of looping back
+	# into the keeper) keeps a scene change to two LLM calls per turn
+	graph.add_edge("scene_transition", END)
 	
 	# Compile
 	return graph.compile()
 
 
+_kp_graphs: Dict[str, Any] = {}
+
+
+def get_kp_graph():
+	"""Return the process-wide compiled KP graph of the current engine (compiled on first use)"""
+	graph = _kp_graphs.get(ENGINE_MODE)
+	if graph is None:
+		graph = _kp_graphs[ENGINE_MODE] = build_kp_graph(ENGINE_MODE)
+	return graph
+
+
+
+
 # ==================== PUBLIC API ====================
 
-def get_kp_response(
-	user_input: str,
-	character: Dict[str, Any],
+# Token budget for the history part of the Keeper prompt (summary + recent messages)
+HISTORY_TOKEN_BUDGET = int(os.getenv("KP_HISTORY_TOKEN_BUDGET", "2000"))
+
+
+# Keep at most the last 6 messages (3 rounds) uncompressed, fewer if they alone exceed half the budget
+_COMPRESSION_KWARGS = {
+	"min_messages_before_compress": 6,
+	"keep_recent_messages": 6,
+	"token_budget": HISTORY_TOKEN_BUDGET,
+}
+
+
+def _should_compress(chat_history: List[Dict[str, str]], api_key: str) -> bool:
+	"""
+	Compress chat history once it exceeds its token budget and compression would
+	summarize something (counted locally, no API call)
+	"""
+	if not compressible(chat_history, api_key, **_COMPRESSION_KWARGS):
+		return False
+	_trace.debug("compression_start", tokens=history_tokens(chat_history), budget=HISTORY_TOKEN_BUDGET)
+	return True
+
+
+# Compression jobs of async turns run in the background (see _compress_in_background)
+background_compressor = BackgroundCompressor(max_jobs=int(os.getenv("KP_COMPRESSION_MAX_JOBS", "8")))
+
+
+def _compress_in_background(
+	compression_key: str,
 	chat_history: List[Dict[str, str]],
-	api_key: str = "",
-	current_scene: str = "arrival_village"
-) -> Dict[str, Any]:
+	character: Dict[str, Any],
+	current_scene: str,
+	api_key: str
+) -> List[Dict[str, str]]:
 	"""
-	Main function to get KP response using LangGraph with scenes and tools
-	
-	Args:
-		user_input: User's message
-		character: Character dictionary
-		chat_history: List of previous messages
-		api_key: OpenAI API key
-		current_scene: Current scene ID
-	
-	Returns:
-		KP's response as string
-	"""
-	print(f"\n🚀 [GET_KP_RESPONSE] Starting KP response generation")
-	print(f"    User input: {user_input[:100]}...")
-	print(f"    Current scene: {current_scene}")
-	print(f"    Character: {character.get('name', 'Unknown')}")
-	
-	# Count user messages to determine if we should compress
-	# Count only non-summary messages (summary messages start with "**Summary of earlier events:**")
-	user_message_count = sum(
-		1 for msg in chat_history 
-		if msg.get("role") == "user" and not msg.get("content", "").startswith("**Summary of earlier events:**")
+	Apply the session's finished background compression, if any, and schedule a
+	new job when the history is over budget. Never waits for the summarizer.
+	"""
+	history = background_compressor.take_result(compression_key, chat_history)
+	if history is not None:
+		_report_compression(chat_history, history)
+	else:
+		history = chat_history
+	
+	if _should_compress(history, api_key):
+		async def compress(snapshot: List[Dict[str, str]]) -> List[Dict[str, str]]:
+			with COMPRESSION_SECONDS.time():
+				return await acompress_chat_history(
+					chat_history=snapshot,
+					character=character,
+					current_scene=current_scene,
+					api_key=api_key,
+					**_COMPRESSION_KWARGS,
+				)
+		
+		scheduled = background_compressor.schedule(compression_key, history, compress)
+		_trace.debug("compression_scheduled", key=compression_key, scheduled=scheduled)
+	return history
+
+
+def _report_compression(chat_history: List[Dict[str, str]], compressed_history: List[Dict[str, str]]) -> None:
+	_trace.debug(
+		"compression_done",
+		before=len(chat_history),
+		after=len(compressed_history),
+		skipped=compressed_history == chat_history
 	)
-	
-	# Compress chat history every 3 rounds (every 3 user messages)
-	# We compress when we have 3, 6, 9, etc. user messages (before adding the current one)
-	compressed_history = chat_history
-	if user_message_count > 0 and user_message_count % 3 == 0:
-		print(f"\n [COMPRESSION] Compressing chat history (round {user_message_count})")
-		try:
-			compressed_history = compress_chat_history(
-				chat_history=chat_history,
-				character=character,
-				current_scene=current_scene,
-				api_key=api_key,
-				min_messages_before_compress=6,  # Lower threshold for more frequent compression
-				keep_recent_messages=6,  # Keep last 6 messages (3 rounds) uncompressed
-			)
-			if len(compressed_history) < len(chat_history):
-				print(f"    ✅ Compressed from {len(chat_history)} to {len(compressed_history)} messages")
-			else:
-				print("Compression skipped (history too short or no API key)")
-		except Exception as e:
-			print(f"    ⚠️ Compression failed: {e}, using original history")
-			compressed_history = chat_history
-	
-	# Convert chat history to LangChain messages
+
+
+def _build_initial_state(
+	user_input: str,
+	character: Dict[str, Any],
+	history: List[Dict[str, str]],
+	api_key: str,
+	current_scene: str,
+	auto_roll: Optional[AutoRoll] = None,
+	pending_checks: Optional[List[PendingCheck]] = None,
+	check_results: Optional[List[CheckResult]] = None,
+	prompt_mode: Optional[str] = None,
+	speculation: Optional[CheckSpeculation] = None,
+	scene_prefetch: Optional[ScenePrefetcher] = None
+) -> AgentState:
+	"""Convert chat history to LangChain messages and build the graph input state"""
 	lc_messages = []
-	for msg in compressed_history:
+	for msg in history:
 		if msg["role"] == "user":
 			lc_messages.append(HumanMessage(content=msg["content"]))
 		elif msg["role"] == "assistant":
@@ -750,11 +1803,7 @@ def get_kp_response(
 	# Add current user input
 	lc_messages.append(HumanMessage(content=user_input))
 	
-	# Build graph
-	graph = build_kp_graph()
-	
-	# Invoke graph
-	state = {
+	return {
 		"messages": lc_messages,
 		"character": character,
 		"api_key": api_key,
@@ -762,17 +1811,26 @@ def get_kp_response(
 		"scene_history": [],
 		"dice_results": [],
 		"next_action": "continue",
-		"next_scene": current_scene
+		"next_scene": current_scene,
+		"scene_transitions": 0,
+		"auto_roll": auto_roll,
+		"pending_checks": pending_checks or [],
+		"check_results": check_results or [],
+		"prompt_mode": prompt_mode or PROMPT_MODE,
+		"speculation": speculation,
+		"scene_prefetch": scene_prefetch
 	}
-	
-	print(f"\n📊 [GRAPH] Invoking LangGraph with state")
-	print(f"    Initial scene: {state['current_scene']}")
-	
-	result = graph.invoke(state)
-	
-	print(f"\n📊 [GRAPH] Graph execution completed")
-	print(f"    Final scene: {result.get('current_scene', 'N/A')}")
-	print(f"    Next action: {result.get('next_action', 'N/A')}")
+
+
+def _build_kp_result(
+	result: AgentState,
+	character: Dict[str, Any],
+	current_scene: str,
+	chat_history: List[Dict[str, str]],
+	compressed_history: List[Dict[str, str]]
+) -> Dict[str, Any]:
+	"""Extract the player-facing response from the final graph state"""
+	_trace.debug("graph_done", scene=result.get("current_scene"), next_action=result.get("next_action"))
 	
 	# Extract the last assistant message(s)
 	messages = result.get("messages", [])
@@ -797,52 +1855,255 @@ def get_kp_response(
 	# If we have pending results, user has already rolled dice, so we should show results
 	pending_dice_result = result.get("pending_dice_result")
 	pending_san_result = result.get("pending_san_result")
-	
-	dice_request_found = False
-	san_request_found = False
+	# Markers of the rolls the Keeper asked for this turn, one per line so legacy clients still find the first one
+	markers = "\n".join(check["marker"] for check in result["pending_checks"]) if result.get("check_requested") else ""
 	
 	if pending_dice_result or pending_san_result:
-		# User has rolled dice, show the result and LLM response
-		tool_results_text = pending_dice_result or pending_san_result
+		# User (or AutoRoll) has rolled dice, show the result(s) and LLM response
+		tool_results_text = "\n\n".join(text for text in (pending_dice_result, pending_san_result) if text)
 		if tool_results_text:
 			final_response = tool_results_text + "\n---\n\n" + final_response
-	else:
-		# No pending results, check for dice/SAN check request markers
-		# If found, return only the marker (no LLM response yet)
-		for msg in messages:
-			if isinstance(msg, ToolMessage):
-				content = msg.content.strip()
-				
-				# Check for dice request marker
-				dice_request_match = re.match(r'\[DICE_REQUEST:(.+?):(.+?):(\d+)\]', content)
-				if dice_request_match:
-					# Found dice request - return only the marker, skip LLM response
-					final_response = content
-					dice_request_found = True
-					break
-				
-				# Check for SAN check request marker
-				san_request_match = re.match(r'\[SAN_CHECK_REQUEST:(\d+):(\d+)\]', content)
-				if san_request_match:
-					# Found SAN check request - return only the marker, skip LLM response
-					final_response = content
-					san_request_found = True
-					break
+		if markers:
+			# The follow-up asks for the next roll right away
+			final_response += "\n\n" + markers
+	elif markers:
+		# The Keeper asked for rolls this turn: return only the markers (no LLM response yet)
+		final_response = markers
 	
 	# Get updated character from result (with SAN changes if any)
 	updated_character = result.get("character", character)
 	
+	usage = result.get("usage") or {}
+	if usage:
+		_trace.info("turn_usage", **usage)
+	prompt_components = result.get("prompt_components") or {}
+	if prompt_components:
+		_trace.info("prompt_size", mode=result.get("prompt_mode"), total=sum(prompt_components.values()), **prompt_components)
+	
 	# Return response with scene info and updated character
-	# Include compressed_history if compression occurred (so frontend can update its state)
+	pending_checks = result.get("pending_checks") or []
 	return_dict = {
 		"response": final_response,
 		"current_scene": result.get("current_scene", current_scene),
 		"next_action": result.get("next_action", "continue"),
-		"character": updated_character  # Include updated character with new SAN value
+		"character": updated_character,  # Include updated character with new SAN value
+		"pending_checks": pending_checks,  # Structured form of the markers, empty once resolved
+		"pending_check": pending_checks[0] if pending_checks else None,  # First of them (single-check clients)
+		"usage": usage,  # Keeper tokens this turn, including cached_tokens served from the prompt cache
+		"prompt_components": prompt_components  # System prompt tokens per component
 	}
 	
-	# If compression occurred, include the compressed history
-	if len(compressed_history) < len(chat_history):
+	# If compression occurred, include the compressed history (so frontend can update its state)
+	if compressed_history != chat_history:
 		return_dict["compressed_history"] = compressed_history
 	
 	return return_dict
+
+
+def get_kp_response(
+	user_input: str,
+	character: Dict[str, Any],
+	chat_history: List[Dict[str, str]],
+	api_key: str = "",
+	current_scene: str = "arrival_village",
+	auto_roll: Optional[AutoRoll] = None,
+	pending_checks: Optional[List[PendingCheck]] = None,
+	check_results: Optional[List[CheckResult]] = None,
+	prompt_mode: Optional[str] = None
+) -> Dict[str, Any]:
+	"""
+	Main function to get KP response using LangGraph with scenes and tools
+	
+	Args:
+		user_input: User's message
+		character: Character dictionary
+		chat_history: List of previous messages
+		api_key: OpenAI API key
+		current_scene: Current scene ID
+		auto_roll: Server-side rolling settings (None: the player rolls every check)
+		pending_checks: Checks awaiting the player's rolls, as returned by the previous turn
+		check_results: The player's rolls for several pending checks, resolved in one turn
+		prompt_mode: "full" or "slim" system prompt (None: KP_PROMPT_MODE)
+	
+	Returns:
+		Dict with the KP's response, current scene, next action, updated character
+		and the pending checks (if the Keeper asked for rolls)
+	"""
+	with TURN_SECONDS.time(mode="sync"):
+		_trace.info("turn_start", mode="sync", scene=current_scene, character=character.get("name", "Unknown"))
+		_trace.debug("user_input", text=user_input[:100])
+		
+		compressed_history = chat_history
+		if _should_compress(chat_history, api_key):
+			try:
+				with phase("compress"), COMPRESSION_SECONDS.time():
+					compressed_history = compress_chat_history(
+						chat_history=chat_history,
+						character=character,
+						current_scene=current_scene,
+						api_key=api_key,
+						**_COMPRESSION_KWARGS,
+					)
+				_report_compression(chat_history, compressed_history)
+			except Exception as e:
+				_trace.warning("compression_failed", error=str(e))
+				compressed_history = chat_history
+		
+		graph = get_kp_graph()
+		state = _build_initial_state(
+			user_input, character, compressed_history, api_key, current_scene,
+			auto_roll, pending_checks, check_results, prompt_mode
+		)
+		result = graph.invoke(state)
+		
+		return _build_kp_result(result, character, current_scene, chat_history, compressed_history)
+
+
+async def _aprepare_turn(
+	user_input: str,
+	character: Dict[str, Any],
+	chat_history: List[Dict[str, str]],
+	api_key: str,
+	current_scene: str,
+	auto_roll: Optional[AutoRoll] = None,
+	pending_checks: Optional[List[PendingCheck]] = None,
+	check_results: Optional[List[CheckResult]] = None,
+	compression_key: Optional[str] = None,
+	prompt_mode: Optional[str] = None,
+	speculation: Optional[CheckSpeculation] = None,
+	scene_prefetch: Optional[ScenePrefetcher] = None
+) -> tuple[AgentState, List[Dict[str, str]]]:
+	"""
+	Compress history (in the background with a compression_key), build the graph
+	input state and warm the scenes the input points to (with a scene_prefetch)
+	"""
+	_trace.debug("user_input", text=user_input[:100])
+	
+	compressed_history = chat_history
+	if compression_key is not None:
+		with phase("compress"):
+			compressed_history = _compress_in_background(
+				compression_key, chat_history, character, current_scene, api_key
+			)
+	elif _should_compress(chat_history, api_key):
+		try:
+			with phase("compress"), COMPRESSION_SECONDS.time():
+				compressed_history = await acompress_chat_history(
+					chat_history=chat_history,
+					character=character,
+					current_scene=current_scene,
+					api_key=api_key,
+					**_COMPRESSION_KWARGS,
+				)
+			_report_compression(chat_history, compressed_history)
+		except Exception as e:
+			_trace.warning("compression_failed", error=str(e))
+			compressed_history = chat_history
+	
+	state = _build_initial_state(
+		user_input, character, compressed_history, api_key, current_scene,
+		auto_roll, pending_checks, check_results, prompt_mode, speculation, scene_prefetch
+	)
+	if scene_prefetch is not None:
+		with phase("prefetch"):
+			prefetch_scene_entries(scene_prefetch, state)
+	return state, compressed_history
+
+
+async def aget_kp_response(
+	user_input: str,
+	character: Dict[str, Any],
+	chat_history: List[Dict[str, str]],
+	api_key: str = "",
+	current_scene: str = "arrival_village",
+	auto_roll: Optional[AutoRoll] = None,
+	pending_checks: Optional[List[PendingCheck]] = None,
+	check_results: Optional[List[CheckResult]] = None,
+	compression_key: Optional[str] = None,
+	prompt_mode: Optional[str] = None,
+	speculation: Optional[CheckSpeculation] = None,
+	scene_prefetch: Optional[ScenePrefetcher] = None
+) -> Dict[str, Any]:
+	"""
+	Async variant of get_kp_response for the API server.
+	
+	Compression and every LLM call are awaited (graph.ainvoke, llm.ainvoke), so a
+	single event loop can serve many turns concurrently. With a compression_key
+	(one per session) compression runs in the background instead and its result
+	is returned as compressed_history on a later turn. A speculation (see
+	speculate_check_outcomes) supplies the first LLM response when it covers
+	the rolled outcome; it is always used up by the turn. A scene_prefetch (one
+	per session) warms the scenes the input points to and serves this or a later
+	turn's change_scene.
+	"""
+	with TURN_SECONDS.time(mode="async"):
+		_trace.info("turn_start", mode="async", scene=current_scene, character=character.get("name", "Unknown"))
+		try:
+			state, compressed_history = await _aprepare_turn(
+				user_input, character, chat_history, api_key, current_scene,
+				auto_roll, pending_checks, check_results, compression_key, prompt_mode, speculation, scene_prefetch
+			)
+			
+			result = await get_kp_graph().ainvoke(state)
+		finally:
+			if speculation is not None:
+				speculation.discard()  # Continuations the turn did not take
+		
+		return _build_kp_result(result, character, current_scene, chat_history, compressed_history)
+
+
+async def astream_kp_response(
+	user_input: str,
+	character: Dict[str, Any],
+	chat_history: List[Dict[str, str]],
+	api_key: str = "",
+	current_scene: str = "arrival_village",
+	auto_roll: Optional[AutoRoll] = None,
+	pending_checks: Optional[List[PendingCheck]] = None,
+	check_results: Optional[List[CheckResult]] = None,
+	compression_key: Optional[str] = None,
+	prompt_mode: Optional[str] = None,
+	speculation: Optional[CheckSpeculation] = None,
+	scene_prefetch: Optional[ScenePrefetcher] = None
+) -> AsyncIterator[Dict[str, Any]]:
+	"""
+	Stream a KP turn as typed events.
+	
+	Yields dicts of the form {"event": ..., "data": ...}:
+		- "token": narration text chunk from the Keeper LLM ({"text": ...})
+		- "dice_request" / "san_request" / "scene_change": tool call as it is executed
+		- "dice_result" / "san_result": check rolled by the server (AutoRoll)
+		- "result": the same dict get_kp_response returns (always the final event)
+	"""
+	with TURN_SECONDS.time(mode="stream"):
+		_trace.info("turn_start", mode="stream", scene=current_scene, character=character.get("name", "Unknown"))
+		try:
+			state, compressed_history = await _aprepare_turn(
+				user_input, character, chat_history, api_key, current_scene,
+				auto_roll, pending_checks, check_results, compression_key, prompt_mode, speculation, scene_prefetch
+			)
+			
+			result: AgentState = state
+			async for mode, chunk in get_kp_graph().astream(state, stream_mode=["messages", "custom", "values"]):
+				if mode == "messages":
+					message, metadata = chunk
+					# Only narration from the Keeper LLM; tool messages and tool-call chunks carry no text
+					if (
+						metadata.get("langgraph_node") == "keeper"
+						and isinstance(message, AIMessageChunk)
+						and isinstance(message.content, str)
+						and message.content
+					):
+						yield {"event": "token", "data": {"text": message.content}}
+				elif mode == "custom":
+					yield chunk
+				else:
+					result = chunk
+		finally:
+			if speculation is not None:
+				speculation.discard()  # Continuations the turn did not take
+	
+	yield {
+		"event": "result",
+		"data": _build_kp_result(result, character, current_scene, chat_history, compressed_history),
+	}
@@ -0,0 +1,166 @@
+"""
+Process-wide pool of chat model clients sharing keep-alive HTTP connections,
+for the configured LLM backend
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from utils.metrics import counter, histogram
+
+# Shared connection pools: every pooled client reuses the same keep-alive
+# connections instead of opening a new one (and a TLS handshake) per turn
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0)
+_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+
+_pool: "OrderedDict[Tuple[Any, ...], Any]" = OrderedDict()
+_pool_lock = threading.Lock()
+_pool_size = int(os.getenv("KP_LLM_POOL_SIZE", "64"))
+
+LLM_BACKENDS = ("openai", "fake")
+# "openai": ChatOpenAI against the OpenAI API, or against any OpenAI-compatible
+# server at KP_LLM_BASE_URL (vLLM, Ollama, llama.cpp...), which then serves
+# KP_LLM_MODEL instead of the model the caller asks for. "fake": the offline
+# FakeChatModel of agents.fake_llm (settings: KP_FAKE_*), for load tests
+_backend = os.getenv("KP_LLM_BACKEND", "openai")
+_base_url: Optional[str] = os.getenv("KP_LLM_BASE_URL") or None
+_model_override: Optional[str] = os.getenv("KP_LLM_MODEL") or None
+_fake_options: Dict[str, Any] = {}
+
+LLM_CALL_SECONDS = histogram("kp_llm_call_seconds", "LLM completion latency", ["call"])
+LLM_TOKENS = counter("kp_llm_tokens_total", "Tokens reported in LLM response metadata", ["call", "kind"])
+
+
+def record_usage(call: str, message: Any) -> Dict[str, int]:
+	"""
+	Count prompt/cached/completion tokens from a response's usage metadata.
+	
+	Returns them as {"prompt_tokens", "cached_tokens", "completion_tokens"}
+	(zeros when the provider reported no usage).
+	"""
+	usage = getattr(message, "usage_metadata", None) or {}
+	counts = {
+		"prompt_tokens": usage.get("input_tokens", 0),
+		# Prompt tokens served from the provider's prefix cache
+		"cached_tokens": (usage.get("input_token_details") or {}).get("cache_read", 0) or 0,
+		"completion_tokens": usage.get("output_tokens", 0),
+	}
+	if usage:
+		LLM_TOKENS.inc(counts["prompt_tokens"], call=call, kind="prompt")
+		LLM_TOKENS.inc(counts["cached_tokens"], call=call, kind="cached")
+		LLM_TOKENS.inc(counts["completion_tokens"], call=call, kind="completion")
+	return counts
+
+
+def _hash_api_key(api_key: str) -> str:
+	"""Pool key component; the raw API key is never used as a dict key"""
+	return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+	global _http_client, _http_async_client
+	if _http_client is None:
+		_http_client = httpx.Client(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+	if _http_async_client is None:
+		_http_async_client = httpx.AsyncClient(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+	return _http_client, _http_async_client
+
+
+def configure_backend(
+	backend: str,
+	base_url: Optional[str] = None,
+	model: Optional[str] = None,
+	**fake_options: Any
+) -> None:
+	"""
+	Switch the LLM backend (see LLM_BACKENDS) for the clients handed out from
+	now on; pooled clients of the previous backend are dropped. fake_options
+	override the fake model's settings (see agents.fake_llm.FAKE_DEFAULTS).
+	"""
+	global _backend, _base_url, _model_override, _fake_options
+	if backend not in LLM_BACKENDS:
+		raise ValueError(f"Unknown LLM backend: {backend}")
+	_backend, _base_url, _model_override, _fake_options = backend, base_url, model, dict(fake_options)
+	clear_pool()
+
+
+def llm_backend() -> str:
+	return _backend
+
+
+def get_chat_model(
+	api_key: str,
+	model: str = "gpt-4o-mini",
+	temperature: float = 0.7,
+	tools: Optional[Sequence[Any]] = None,
+	response_format: Optional[Dict[str, Any]] = None,
+):
+	"""
+	Return a pooled chat model client of the configured backend (with tools
+	bound, or bound to a JSON schema response_format, if given).
+
+	Clients are cached in a bounded LRU keyed by (hashed api_key, model,
+	temperature, tool names, schema name) and share one keep-alive httpx
+	connection pool.
+	"""
+	tool_names = tuple(getattr(t, "name", str(t)) for t in tools) if tools else ()
+	schema_name = response_format["name"] if response_format else None
+	key = (_hash_api_key(api_key), model, temperature, tool_names, schema_name)
+
+	with _pool_lock:
+		client = _pool.get(key)
+		if client is not None:
+			_pool.move_to_end(key)
+			return client
+
+	if _backend == "fake":
+		from agents.fake_llm import FakeChatModel
+		client = FakeChatModel(model=model, temperature=temperature, **_fake_options)
+	else:
+		http_client, http_async_client = _get_http_clients()
+		client = ChatOpenAI(
+			model=_model_override or model,
+			temperature=temperature,
+			api_key=api_key,
+			http_client=http_client,
+			http_async_client=http_async_client,
+			stream_usage=True,  # Keep token usage when responses are streamed
+			**({"base_url": _base_url} if _base_url else {}),  # Otherwise OPENAI_API_BASE or api.openai.com
+		)
+	if tools:
+		client = client.bind_tools(list(tools))
+	elif response_format:
+		client = client.bind(response_format={"type": "json_schema", "json_schema": response_format})
+
+	with _pool_lock:
+		_pool[key] = client
+		_pool.move_to_end(key)
+		while len(_pool) > _pool_size:
+			_pool.popitem(last=False)
+	return client
+
+
+def clear_pool() -> None:
+	"""Drop all pooled clients (e.g. after rotating API keys)"""
+	with _pool_lock:
+		_pool.clear()
+
+
+async def aclose_http_clients() -> None:
+	"""Close the shared HTTP connection pools (call on server shutdown)"""
+	global _http_client, _http_async_client
+	clear_pool()
+	if _http_async_client is not None:
+		await _http_async_client.aclose()
+		_http_async_client = None
+	if _http_client is not None:
+		_http_client.close()
+		_http_client = None
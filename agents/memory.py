@@ -1,18 +1,43 @@
-from typing import Any, Dict, List
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from langchain_openai import ChatOpenAI
+from agents.llm import LLM_CALL_SECONDS, get_chat_model, record_usage
+from utils.metrics import counter
+from utils.tokens import count_message_tokens
+
+# Marks the assistant message that replaces compressed history
+SUMMARY_PREFIX = "**Summary of earlier events:**"
+
+# Heads messages appended to the summary verbatim (fold_into_summary) until a compression condenses them
+UNSUMMARIZED_HEADING = "**Earlier messages not yet summarized:**"
+
+# Upper bound for the rolling summary, so folding new events in costs the same every time
+SUMMARY_MAX_WORDS = int(os.getenv("KP_SUMMARY_MAX_WORDS", "150"))
+
+SUMMARY_CACHE = counter("kp_summary_cache_total", "Summary memo lookups", ["result"])
+COMPRESSION_JOBS = counter("kp_compression_jobs_total", "Background compression jobs by outcome", ["result"])
+
+# Summaries memoized by a hash of their inputs (retries and replays don't pay again)
+_summary_cache: "OrderedDict[str, str]" = OrderedDict()
+_summary_cache_lock = threading.Lock()
+_summary_cache_size = int(os.getenv("KP_SUMMARY_CACHE_SIZE", "256"))
 
 
 def _build_summary_prompt(
     chat_history: List[Dict[str, str]],
     character: Dict[str, Any],
     current_scene: str,
+    previous_summary: Optional[str] = None,
 ) -> str:
-    """Build a concise prompt for summarizing older chat history."""
+    """Build a concise prompt folding newly aged-out messages into the running summary."""
     name = character.get("name", "Investigator")
     san = character.get("san", 60)
 
-    # We only feed in the older part, but we still give a bit of context
+    # We only feed in the messages that just aged out, plus the summary so far
     history_text = ""
     for msg in chat_history:
         role = msg.get("role", "assistant")
@@ -22,13 +47,18 @@ def _build_summary_prompt(
             continue
         history_text += f"{prefix}: {content}\n\n"
 
+    summary_text = previous_summary.strip() if previous_summary else "(nothing yet)"
+    history_text = history_text or "(nothing new: only shorten the summary)"
+
     prompt = f"""
 You are helping maintain a concise memory for a solo Call of Cthulhu game log.
 
 Player character: {name}, current SAN {san}, current scene id: {current_scene}.
 
-Below is an excerpt of the **older** part of the conversation between the player and the Keeper.
-Your job is to rewrite it as a short, information-dense summary that preserves:
+Below is the summary of the game so far, followed by the part of the conversation between
+the player and the Keeper that happened after it.
+Your job is to fold the new part into the summary, producing one short, information-dense
+summary that preserves:
 - Key events and discoveries
 - Important NPCs and their attitudes
 - Scene transitions and locations visited
@@ -36,9 +66,14 @@ Your job is to rewrite it as a short, information-dense summary that preserves:
 - Any persistent character changes (e.g., SAN loss, injuries, promises, enemies)
 
 Do **not** invent new events. Do **not** include meta-comments about summarizing.
-Write 1 to 3 short sentences or a compact bullet list in plain Markdown.
+Write a compact bullet list in plain Markdown of at most {SUMMARY_MAX_WORDS} words;
+when space runs out, drop the least important older details first.
 
-Older conversation:
+Summary so far:
+
+{summary_text}
+
+New conversation:
 
 {history_text}
 """
@@ -46,6 +81,158 @@ Older conversation:
     return prompt.strip()
 
 
+def history_tokens(chat_history: List[Dict[str, str]]) -> int:
+    """Local token count of the history part of the Keeper prompt (summary included)."""
+    return count_message_tokens(chat_history)
+
+
+def needs_compression(chat_history: List[Dict[str, str]], token_budget: int) -> bool:
+    """True when the history no longer fits its share of the prompt budget."""
+    return history_tokens(chat_history) > token_budget
+
+
+def _split_summary(
+    chat_history: List[Dict[str, str]],
+) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """Split a leading summary message off the history: (summary text, messages)."""
+    if chat_history and chat_history[0].get("content", "").startswith(SUMMARY_PREFIX):
+        return chat_history[0]["content"][len(SUMMARY_PREFIX):].strip(), chat_history[1:]
+    return None, chat_history
+
+
+def _split_for_compression(
+    chat_history: List[Dict[str, str]],
+    api_key: str,
+    min_messages_before_compress: int,
+    keep_recent_messages: int,
+    token_budget: Optional[int],
+) -> Optional[Tuple[Optional[str], List[Dict[str, str]], List[Dict[str, str]]]]:
+    """
+    Return (previous summary, aged-out messages, recent messages), or None when
+    compression should be skipped.
+
+    With a token budget, compression only runs once the history exceeds it, and the
+    recent tail is shortened further if it alone would take more than half the budget.
+    A summary that alone takes more than the other half (e.g. messages folded in
+    verbatim, see fold_into_summary) is summarized again even with no messages aged out.
+    """
+    if token_budget is not None and not needs_compression(chat_history, token_budget):
+        return None
+
+    # If we have no API key here, we can't summarize safely → return as-is
+    if not api_key:
+        return None
+
+    previous_summary, messages = _split_summary(chat_history)
+    oversized = (
+        previous_summary is not None
+        and token_budget is not None
+        and count_message_tokens(chat_history[:1]) > token_budget // 2
+    )
+    if len(chat_history) < min_messages_before_compress and not oversized:
+        return None
+
+    # Split into aged-out and recent segments
+    cutoff = max(0, len(messages) - keep_recent_messages)
+    if token_budget is not None:
+        while cutoff < len(messages) - 2 and count_message_tokens(messages[cutoff:]) > token_budget // 2:
+            cutoff += 1
+    aged_out = messages[:cutoff]
+    recent = messages[cutoff:]
+
+    if not aged_out and not oversized:
+        return None
+
+    return previous_summary, aged_out, recent
+
+
+def compressible(
+    chat_history: List[Dict[str, str]],
+    api_key: str,
+    *,
+    min_messages_before_compress: int = 24,
+    keep_recent_messages: int = 8,
+    token_budget: Optional[int] = None,
+) -> bool:
+    """True when compress_chat_history would summarize something (no API call)."""
+    return _split_for_compression(
+        chat_history, api_key, min_messages_before_compress, keep_recent_messages, token_budget
+    ) is not None
+
+
+def _summary_key(
+    previous_summary: Optional[str],
+    aged_out: List[Dict[str, str]],
+    character: Dict[str, Any],
+    current_scene: str,
+) -> str:
+    digest = hashlib.sha256()
+    for part in (
+        previous_summary or "",
+        character.get("name", ""),
+        str(character.get("san", "")),
+        current_scene,
+        str(SUMMARY_MAX_WORDS),
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    for msg in aged_out:
+        digest.update(msg.get("role", "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(msg.get("content", "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _cached_summary(key: str) -> Optional[str]:
+    with _summary_cache_lock:
+        summary = _summary_cache.get(key)
+        if summary is not None:
+            _summary_cache.move_to_end(key)
+    SUMMARY_CACHE.inc(result="hit" if summary is not None else "miss")
+    return summary
+
+
+def _store_summary(key: str, summary: str) -> None:
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        _summary_cache.move_to_end(key)
+        while len(_summary_cache) > _summary_cache_size:
+            _summary_cache.popitem(last=False)
+
+
+def _build_summary_llm(api_key: str):
+    # Use a small, cheap model; pooled like the Keeper client in kp_agent
+    return get_chat_model(api_key, model="gpt-4o-mini", temperature=0.3)
+
+
+def fold_into_summary(summary: Optional[str], messages: List[Dict[str, str]]) -> str:
+    """
+    Append messages verbatim to a summary message's content (SUMMARY_PREFIX
+    included), without an LLM call. The folded text still counts against the
+    history token budget, so the next compression condenses it with the rest.
+    """
+    content = summary or SUMMARY_PREFIX
+    lines = []
+    for msg in messages:
+        text = msg.get("content", "").strip()
+        if text:
+            lines.append(f"{'Player' if msg.get('role') == 'user' else 'Keeper'}: {text}")
+    if not lines:
+        return content
+    if UNSUMMARIZED_HEADING not in content:
+        content += f"\n\n{UNSUMMARIZED_HEADING}"
+    return content + "\n\n" + "\n\n".join(lines)
+
+
+def _summary_entry(summary: str) -> Dict[str, str]:
+    # Represent summary as an assistant message that future turns can see
+    return {
+        "role": "assistant",
+        "content": f"{SUMMARY_PREFIX}\n\n{summary}",
+    }
+
+
 def compress_chat_history(
     chat_history: List[Dict[str, str]],
     character: Dict[str, Any],
@@ -54,48 +241,139 @@ def compress_chat_history(
     *,
     min_messages_before_compress: int = 24,
     keep_recent_messages: int = 8,
+    token_budget: Optional[int] = None,
 ) -> List[Dict[str, str]]:
     """
     Optionally compress older chat history into a single summary message.
 
-    - If history is short, return it unchanged.
-    - If long, summarize all but the most recent N messages into one assistant message,
-      then append the recent messages after that.
+    - If history is short (or, with token_budget, fits the budget), return it unchanged.
+    - If long, fold all but the most recent N messages into the running summary
+      (only the messages that aged out since the last summary are sent, so the
+      cost stays flat however long the session runs), then append the recent messages.
+    - Summaries are memoized by a hash of their inputs.
     """
-    # Simple length-based heuristic; token-based would require extra deps
-    if len(chat_history) < min_messages_before_compress:
+    segments = _split_for_compression(
+        chat_history, api_key, min_messages_before_compress, keep_recent_messages, token_budget
+    )
+    if segments is None:
         return chat_history
+    previous_summary, aged_out, recent = segments
 
-    # If we have no API key here, we can't summarize safely → return as-is
-    if not api_key:
-        return chat_history
+    key = _summary_key(previous_summary, aged_out, character, current_scene)
+    summary = _cached_summary(key)
+    if summary is None:
+        prompt = _build_summary_prompt(aged_out, character, current_scene, previous_summary)
+        with LLM_CALL_SECONDS.time(call="summary"):
+            summary_msg = _build_summary_llm(api_key).invoke(prompt)
+        record_usage("summary", summary_msg)
+        summary = summary_msg.content
+        _store_summary(key, summary)
+
+    return [_summary_entry(summary)] + recent
 
-    # Split into older and recent segments
-    cutoff = max(0, len(chat_history) - keep_recent_messages)
-    older = chat_history[:cutoff]
-    recent = chat_history[cutoff:]
 
-    if not older:
+async def acompress_chat_history(
+    chat_history: List[Dict[str, str]],
+    character: Dict[str, Any],
+    current_scene: str,
+    api_key: str,
+    *,
+    min_messages_before_compress: int = 24,
+    keep_recent_messages: int = 8,
+    token_budget: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """Async variant of compress_chat_history; awaits the summarizer call."""
+    segments = _split_for_compression(
+        chat_history, api_key, min_messages_before_compress, keep_recent_messages, token_budget
+    )
+    if segments is None:
         return chat_history
+    previous_summary, aged_out, recent = segments
 
-    # Build summarization prompt
-    prompt = _build_summary_prompt(older, character, current_scene)
+    key = _summary_key(previous_summary, aged_out, character, current_scene)
+    summary = _cached_summary(key)
+    if summary is None:
+        prompt = _build_summary_prompt(aged_out, character, current_scene, previous_summary)
+        with LLM_CALL_SECONDS.time(call="summary"):
+            summary_msg = await _build_summary_llm(api_key).ainvoke(prompt)
+        record_usage("summary", summary_msg)
+        summary = summary_msg.content
+        _store_summary(key, summary)
 
-    # Use a small, cheap model; follow the same config style as kp_agent
-    llm = ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0.3,
-        api_key=api_key,
-    )
+    return [_summary_entry(summary)] + recent
 
-    summary_msg = llm.invoke(prompt)
 
-    # Represent summary as an assistant message that future turns can see
-    summary_entry: Dict[str, str] = {
-        "role": "assistant",
-        "content": f"**Summary of earlier events:**\n\n{summary_msg.content}",
-    }
+class BackgroundCompressor:
+    """
+    Runs history compression off the critical path.
+
+    A turn that finds the history over budget schedules a job and goes on with
+    the uncompressed history; a later turn of the same session picks up the
+    finished result. At most one job runs per session, and no new jobs start
+    while max_jobs are already running (the history is simply compressed on a
+    later turn).
+    """
+
+    def __init__(self, max_jobs: int = 8):
+        self.max_jobs = max_jobs
+        # key -> (history the job compresses, task)
+        self._jobs: Dict[str, Tuple[List[Dict[str, str]], "asyncio.Task[List[Dict[str, str]]]"]] = {}
+
+    def running(self) -> int:
+        return sum(1 for _, task in self._jobs.values() if not task.done())
+
+    def schedule(
+        self,
+        key: str,
+        chat_history: List[Dict[str, str]],
+        compress: Callable[[List[Dict[str, str]]], Awaitable[List[Dict[str, str]]]],
+    ) -> bool:
+        """Start compress(chat_history) in the background; False if deduplicated or skipped."""
+        if key in self._jobs:
+            COMPRESSION_JOBS.inc(result="deduplicated")
+            return False
+        if self.running() >= self.max_jobs:
+            COMPRESSION_JOBS.inc(result="skipped_load")
+            return False
+
+        snapshot = list(chat_history)
+        task = asyncio.get_running_loop().create_task(compress(snapshot))
+        task.add_done_callback(_retrieve_exception)
+        self._jobs[key] = (snapshot, task)
+        COMPRESSION_JOBS.inc(result="scheduled")
+        return True
+
+    def take_result(self, key: str, chat_history: List[Dict[str, str]]) -> Optional[List[Dict[str, str]]]:
+        """
+        Apply a finished job to the current history: the compressed snapshot plus
+        every message added since. None if nothing is ready or the job is stale.
+        """
+        job = self._jobs.get(key)
+        if job is None or not job[1].done():
+            return None
+        del self._jobs[key]
+        snapshot, task = job
+
+        if task.cancelled() or task.exception() is not None:
+            COMPRESSION_JOBS.inc(result="failed")
+            return None
+        compressed = task.result()
+        # Nothing summarized, or the history was replaced meanwhile (client reset, another compression)
+        if compressed == snapshot or chat_history[: len(snapshot)] != snapshot:
+            COMPRESSION_JOBS.inc(result="stale")
+            return None
+
+        COMPRESSION_JOBS.inc(result="applied")
+        return compressed + chat_history[len(snapshot):]
 
-    return [summary_entry] + recent
+    def discard(self, key: str) -> None:
+        """Forget a session's job (e.g. when the session is deleted)."""
+        job = self._jobs.pop(key, None)
+        if job is not None and not job[1].done():
+            job[1].cancel()
 
 
+def _retrieve_exception(task: "asyncio.Task") -> None:
+    # Mark failures as retrieved; take_result reports them when the session comes back
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,131 @@
+"""Per-call prompt size profile: tokens by part of the Keeper prompt, counted locally"""
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from agents.memory import SUMMARY_PREFIX
+from agents.scenes import get_scene_blocks, get_story_overview
+from utils.tokens import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+# Parts of a Keeper LLM call, in report order
+PROFILE_PARTS = (
+	"story_overview",  # STORY_OVERVIEW inside the static prompt
+	"rules",  # Keeper rules: the rest of the static prompt, plus retrieved rules (slim)
+	"scene",  # Scene name, description and exit IDs
+	"scene_template",  # Key clues, creative space and closing instructions of the scene template
+	"npcs",
+	"transitions",  # Transition block of the scene template
+	"character",  # Character sheet and the Player Context line
+	"summary",  # Compressed "Summary of earlier events" message
+	"history",  # Recent messages, tool calls and tool results (with per-message overhead)
+	"tool_schemas",  # Schemas of the bound tools, as rendered for the model (structured engine: response schema and format)
+)
+
+_enabled = os.getenv("KP_PROMPT_PROFILE", "0") == "1"
+_scene_block_tokens: Dict[Tuple[str, bool], Tuple[int, int]] = {}
+_tool_tokens: Dict[Tuple[str, ...], int] = {}
+_overview_tokens: Optional[int] = None
+
+
+def profiling_enabled() -> bool:
+	return _enabled
+
+
+def configure_prompt_profiling(enabled: bool) -> None:
+	"""Turn per-call prompt profiles (written to the session log) on or off"""
+	global _enabled
+	_enabled = enabled
+
+
+def _block_tokens(scene_id: str, slim: bool) -> Tuple[int, int]:
+	"""(NPC, transition) tokens inside a scene template"""
+	key = (scene_id, slim)
+	tokens = _scene_block_tokens.get(key)
+	if tokens is None:
+		blocks = get_scene_blocks(scene_id, slim)
+		tokens = _scene_block_tokens[key] = (count_tokens(blocks["npcs"]), count_tokens(blocks["transitions"]))
+	return tokens
+
+
+def _tool_text(tool: Any) -> str:
+	"""
+	A tool's schema the way OpenAI renders functions into the prompt (a
+	TypeScript-like signature), which is far denser than the JSON schema
+	"""
+	function = convert_to_openai_tool(tool)["function"]
+	lines = [f"// {function.get('description', '')}", f"type {function['name']} = (_: {{"]
+	for name, schema in function.get("parameters", {}).get("properties", {}).items():
+		if schema.get("description"):
+			lines.append(f"// {schema['description']}")
+		lines.append(f"{name}: {schema.get('type', 'any')},")
+	lines.append("}) => any;")
+	return "\n".join(lines)
+
+
+def _tool_schema_tokens(tools: Sequence[Any]) -> int:
+	key = tuple(getattr(tool, "name", str(tool)) for tool in tools)
+	tokens = _tool_tokens.get(key)
+	if tokens is None:
+		tokens = _tool_tokens[key] = sum(count_tokens(_tool_text(tool)) for tool in tools)
+	return tokens
+
+
+def _message_tokens(message: BaseMessage) -> int:
+	tokens = MESSAGE_OVERHEAD_TOKENS
+	if isinstance(message.content, str):
+		tokens += count_tokens(message.content)
+	for tool_call in getattr(message, "tool_calls", None) or []:
+		tokens += count_tokens(tool_call.get("name", "")) + count_tokens(json.dumps(tool_call.get("args", {})))
+	return tokens
+
+
+def profile_prompt(
+	prompt_components: Dict[str, int],
+	scene_id: str,
+	prompt_mode: str,
+	messages: List[BaseMessage],
+	tools: Sequence[Any] = ()
+) -> Dict[str, int]:
+	"""
+	Tokens per part (PROFILE_PARTS) of one Keeper LLM call.
+
+	prompt_components is the system prompt breakdown from build_prompt_parts;
+	messages are the conversation messages sent after the system message.
+	"""
+	global _overview_tokens
+	if _overview_tokens is None:
+		_overview_tokens = count_tokens(get_story_overview())
+
+	slim = prompt_mode == "slim"
+	npc_tokens, transition_tokens = _block_tokens(scene_id, slim)
+	template_tokens = prompt_components.get("scene_template", 0)
+
+	parts = dict.fromkeys(PROFILE_PARTS, 0)
+	parts["story_overview"] = _overview_tokens
+	parts["rules"] = max(0, prompt_components.get("static", 0) - _overview_tokens) + prompt_components.get("rules", 0)
+	parts["scene"] = prompt_components.get("scene", 0)
+	if slim:
+		parts["npcs"] = prompt_components.get("npcs", 0)
+	elif template_tokens:
+		parts["npcs"] = npc_tokens
+	if template_tokens:
+		parts["transitions"] = transition_tokens
+	parts["scene_template"] = max(0, template_tokens - (0 if slim else npc_tokens) - transition_tokens)
+	parts["character"] = prompt_components.get("character", 0) + prompt_components.get("player_context", 0)
+	# The system message's own overhead goes with the rules
+	parts["rules"] += MESSAGE_OVERHEAD_TOKENS
+
+	for message in messages:
+		content = message.content if isinstance(message.content, str) else ""
+		if isinstance(message, AIMessage) and content.startswith(SUMMARY_PREFIX):
+			parts["summary"] += _message_tokens(message)
+		else:
+			parts["history"] += _message_tokens(message)
+
+	if tools:
+		parts["tool_schemas"] = _tool_schema_tokens(tools)
+	parts["tool_schemas"] += prompt_components.get("output_format", 0)
+	return parts
@@ -0,0 +1,290 @@
+"""Keeper rule snippets and a local BM25 index that picks the ones a turn needs"""
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from agents.scenes import get_available_transitions
+
+# Keeper rules in prompt order. Full prompts include all of them; slim prompts
+# include the "core" rules plus the ones retrieved for the turn (see select_rules).
+# - tags: extra search terms (weighted like TAG_WEIGHT occurrences in the text)
+# - scenes: always included in these scenes
+# - transitions: only useful where the scene has transitions
+# - requires: rules that must come along when this one is picked
+RULES: Dict[str, Dict[str, Any]] = {
+	"role": {
+		"core": True,
+		"text": """
+**Your Role as Keeper:**
+- Narrate the story as the Keeper, responding directly to the investigator's actions
+- Be concise and direct—avoid excessive atmospheric description
+- Focus on what happens, not lengthy environmental details
+- **When a skill check is needed, IMMEDIATELY call the roll_dice tool - do NOT announce or describe the check**
+- Advance the story based on player actions
+- Keep responses brief (1-3 sentences typically, only expand for crucial moments)
+- Show, don't over-describe. Let actions and dialogue carry the atmosphere
+- Avoid repetitive sensory details or purple prose
+- **CRITICAL: Do NOT say "I will roll" or "Let me check" - just call the tool directly**
+""",
+	},
+
+	"player_actions": {
+		"core": True,
+		"text": """
+**Player Action Handling (Critical):**
+- Never invent or describe the player's words or actions.
+- Do not elaborate on, embellish, or expand the player's replies, nor add any internal thoughts or psychological descriptions for the player character.
+- Only narrate NPC reactions, environment, and consequences.
+- **If instructions are vague or unclear, ask for clarification (e.g., "What do you say?" "How do you do it?"). Otherwise, simply narrate what happens without ending with a question. Trust the player will respond with their next action.**
+""",
+	},
+
+	"tool_workflow": {
+		"tags": ["check", "roll", "dice", "test", "try", "attempt", "chance", "succeed", "fail", "result", "skill"],
+		"text": """
+**Tool Usage Workflow:**
+When player action requires a check:
+1. **IMMEDIATELY and SILENTLY call the roll_dice or san_check tool** (do not announce it)
+2. The tool will execute and return a result
+3. Use that result in your narration without mentioning the tool call
+4. Continue narrating based on the result
+
+
+**Do:**
+- Call the tool directly when needed
+- Incorporate results naturally into narration
+- Let tools work in the background
+""",
+	},
+
+	"san_check": {
+		"tags": ["horror", "horrible", "horrifying", "terror", "terrified", "scream", "corpse", "body", "bones", "dead", "blood", "monster", "creature", "thing", "sacrifice", "burn", "burning", "fire", "flame", "symbol", "rune", "drawing", "madness", "insane", "sanity", "nightmare", "witness", "strange"],
+		"scenes": ["ritual"],  # SAN checks are part of every ritual turn
+		"text": """
+**When to use san_check:**
+- Witness something horrifying or disturbing
+- Encounter cosmic horror or supernatural phenomena
+- See Cthulhu-related runes, symbols, or forbidden clues
+- Discover disturbing truths or things that shouldn't exist
+- Exposed to madness-inducing knowledge
+- Typical SAN loss: 1 (minor), 1d3/1d4 (moderate), 1d6+ (major)
+""",
+	},
+
+	"scene_transitions": {
+		"tags": ["go", "leave", "location", "place", "move", "walk", "enter"],
+		"transitions": True,
+		"text": """
+**Scene Transitions (CRITICAL):**
+- You must treat scene changes as soon as the player clearly moves to a new location or starts interacting mainly in that new location.
+""",
+	},
+
+	"skill_checks": {
+		"tags": ["spot", "search", "examine", "inspect", "notice", "investigate", "listen", "hear", "eavesdrop", "sneak", "hide", "quietly", "persuade", "convince", "lie", "negotiate", "charm", "lucky", "break", "force", "climb", "fight", "attack", "run", "remember", "recall", "read", "resist"],
+		"text": """
+**Skill Check Guidelines:**
+- SPOT: Finding clues, noticing details, observing surroundings
+- LISTEN: Hearing distant sounds, overhearing conversations, detecting threats
+- STEALTH: Sneaking, hiding, moving quietly
+- CHARM: Persuasion, negotiation, social interaction
+- LUCK: Random events, chance encounters, fortunate coincidences
+- STR: Physical actions, breaking objects, combat
+- INT: Reasoning, remembering information, understanding clues
+- POW: Resisting mental influence, magical resistance, willpower
+""",
+	},
+
+	"tool_rules": {
+		"core": True,
+		"text": """
+**Critical Tool Usage Rules:**
+- **NEVER describe or announce that you will perform a check - ALWAYS call the roll_dice tool directly**
+- **DO NOT say "I will roll dice" or "I need to check" - just call the tool immediately**
+- **When a skill check is needed, call roll_dice tool BEFORE responding - do not ask permission or describe the action**
+- Use the correct skill name when calling roll_dice (e.g., "Spot Hidden" for SPOT checks, "Strength" for STR checks)
+- After calling roll_dice, incorporate the result naturally into your narration without mentioning "I rolled" or "the dice show"
+""",
+	},
+
+	"change_scene_rules": {
+		"tags": ["go", "walk", "enter", "head", "leave", "return", "move", "visit", "travel", "follow", "inside", "toward"],
+		"transitions": True,
+		"text": """
+**Scene Transition Rules (for change_scene tool):**
+- **CRITICAL:** When the player's actions clearly indicate moving to a new location or entering a different scene, you MUST call the change_scene tool BEFORE continuing narration.
+- Only move to scenes that appear in the "Available scene transitions" list for the current scene.
+- Treat "walking to / going to / entering / heading for / returning to" a place as a scene change intent, not just flavor.
+- The player does **not** need to say the exact scene ID. You should map natural language places to scene IDs using your knowledge of the story.
+""",
+	},
+
+	"change_scene_triggers": {
+		"tags": ["house", "home", "stay", "night", "inn", "hall", "office", "telegraph", "telephone", "church", "ruins", "beacon", "tower", "festival", "ritual", "ceremony", "epilogue", "aftermath", "accept", "offer", "invitation"],
+		"transitions": True,
+		"requires": ["change_scene_rules"],
+		"text": """
+**Concrete triggers (when to call change_scene immediately):**
+- Player accepts May Ledbetter's offer and goes to or stays at May's house ⇒ call change_scene("leddbetter_house").
+- Player says they go to or enter the village hall / town office / town hall ⇒ call change_scene("village_hall").
+- Player says they go to or enter the ruined / abandoned church ⇒ call change_scene("ruined_church").
+- Player says they go to the Beacon / festival / ritual location at night for the ceremony ⇒ call change_scene("ritual").
+- From the ritual, when the story clearly reaches an epilogue / aftermath, you may move to "ending" ⇒ call change_scene("ending").
+""",
+	},
+
+	"change_scene_negative": {
+		"tags": ["look", "see", "distant", "far", "watch", "ask", "talk", "dream", "remember", "window"],
+		"transitions": True,
+		"requires": ["change_scene_rules"],
+		"text": """
+**Negative examples (DO NOT change scene):**
+- Player only looks at a distant building, tower, or church from afar without going there.
+- Player asks about a place in conversation but does not go there.
+- Player remembers or dreams about another place.
+""",
+	},
+
+	"change_scene_execution": {
+		"tags": ["arrive", "enter", "inside", "reach"],
+		"transitions": True,
+		"requires": ["change_scene_rules"],
+		"text": """
+**Execution rules:**
+- Call change_scene as soon as you infer the scene change, then let the tools and system prompt update the context.
+- After a successful change_scene, you must narrate from the new scene's perspective and tone.
+- Do **not** ask the player "Do you want to go to X?" if they already clearly stated they go there—just change the scene.
+""",
+	},
+
+	"general": {
+		"core": True,
+		"text": """
+**General Rules:**
+- Stay in character as the KP and guide the story forward
+- Be creative but stay within the CoC horror atmosphere
+- Follow the scene-specific prompts provided to you for guidance on style and key elements
+- Remember: You have tools available. Use them directly, don't describe using them.
+""",
+	},
+}
+
+# Retrieval settings: at most RULES_TOP_K rules scoring at least RULES_MIN_SCORE
+RULES_TOP_K = int(os.getenv("KP_RULES_TOP_K", "3"))
+RULES_MIN_SCORE = float(os.getenv("KP_RULES_MIN_SCORE", "1.5"))
+TAG_WEIGHT = 3
+
+_WORD = re.compile(r"[a-z]+")
+_STOPWORDS = {
+	"a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "for", "from", "he", "her", "his", "i", "if",
+	"in", "is", "it", "its", "me", "my", "not", "of", "on", "or", "she", "so", "that", "the", "their", "them",
+	"then", "there", "they", "this", "to", "up", "was", "we", "what", "with", "you", "your",
+}
+
+
+def _stem(word: str) -> str:
+	"""Crude suffix stripping, so looks / looking / looked all match look"""
+	for suffix in ("ing", "ed", "es", "s"):
+		if len(word) > len(suffix) + 3 and word.endswith(suffix):
+			return word[:-len(suffix)]
+	return word
+
+
+def _terms(text: str) -> List[str]:
+	return [_stem(word) for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+
+class RuleIndex:
+	"""Okapi BM25 over rule texts and tags, built once in memory (no network, no model)"""
+
+	def __init__(self, rules: Dict[str, Dict[str, Any]], k1: float = 1.2, b: float = 0.75):
+		self.k1 = k1
+		self.b = b
+		self.docs: Dict[str, Counter] = {}
+		for rule_id, rule in rules.items():
+			terms = _terms(rule["text"])
+			for tag in rule.get("tags", []):
+				terms.extend(_terms(tag) * TAG_WEIGHT)
+			self.docs[rule_id] = Counter(terms)
+		self.lengths = {rule_id: sum(doc.values()) for rule_id, doc in self.docs.items()}
+		self.avg_length = sum(self.lengths.values()) / max(1, len(self.docs))
+		df = Counter(term for doc in self.docs.values() for term in doc)
+		n = len(self.docs)
+		self.idf = {term: math.log(1 + (n - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+
+	def search(self, query: str) -> List[Tuple[str, float]]:
+		"""(rule_id, score) of every rule matching the query, best first"""
+		terms = set(_terms(query)) & self.idf.keys()
+		if not terms:
+			return []
+		scores = []
+		for rule_id, doc in self.docs.items():
+			norm = self.k1 * (1 - self.b + self.b * self.lengths[rule_id] / self.avg_length)
+			score = sum(
+				self.idf[term] * doc[term] * (self.k1 + 1) / (doc[term] + norm)
+				for term in terms if term in doc
+			)
+			if score > 0:
+				scores.append((rule_id, score))
+		scores.sort(key=lambda item: item[1], reverse=True)
+		return scores
+
+
+_index: Optional[RuleIndex] = None
+
+
+def get_rule_index() -> RuleIndex:
+	"""The index over the retrievable (non-core) rules, built on first use"""
+	global _index
+	if _index is None:
+		_index = RuleIndex({rule_id: rule for rule_id, rule in RULES.items() if not rule.get("core")})
+	return _index
+
+
+def clear_rule_index() -> None:
+	"""Rebuild the index on next use (call after editing RULES at runtime)"""
+	global _index
+	_index = None
+
+
+def core_rules() -> Tuple[str, ...]:
+	"""IDs of the rules included in every prompt"""
+	return tuple(rule_id for rule_id, rule in RULES.items() if rule.get("core"))
+
+
+def select_rules(
+	query: str,
+	scene_id: str,
+	top_k: Optional[int] = None,
+	min_score: Optional[float] = None
+) -> Tuple[str, ...]:
+	"""
+	IDs of the non-core rules a turn needs, in prompt order.
+	
+	The best matches of the query (the player's input and the Keeper's last reply),
+	the rules pinned to the scene, and the rules those require.
+	"""
+	top_k = RULES_TOP_K if top_k is None else top_k
+	min_score = RULES_MIN_SCORE if min_score is None else min_score
+	has_transitions = bool(get_available_transitions(scene_id))
+	
+	selected = {rule_id for rule_id, rule in RULES.items() if scene_id in rule.get("scenes", ())}
+	picked = 0
+	for rule_id, score in get_rule_index().search(query):
+		if picked >= top_k or score < min_score:
+			break
+		if RULES[rule_id].get("transitions") and not has_transitions:
+			continue
+		selected.add(rule_id)
+		picked += 1
+	for rule_id in list(selected):
+		selected.update(RULES[rule_id].get("requires", ()))
+	return tuple(rule_id for rule_id in RULES if rule_id in selected)
+
+
+def render_rules(rule_ids: Iterable[str]) -> str:
+	"""The texts of the given rules, in prompt order"""
+	wanted = set(rule_ids)
+	return "\n\n".join(rule["text"].strip("\n") for rule_id, rule in RULES.items() if rule_id in wanted)
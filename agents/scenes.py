@@ -1,5 +1,6 @@
 """Scene definitions based on 'Alone Against the Flames' - Semi-open prompt templates"""
-from typing import List, Dict, Any
+import re
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
 # Story Overview for Global Keeper Prompt
 STORY_OVERVIEW = """
@@ -25,6 +26,8 @@ As dusk falls, the investigator discovers the villagers are preparing for a "fes
 
 
 # Scene Templates with semi-open prompt structure
+# ("keywords": what a player calls the place, besides its name and its NPCs, when heading there;
+# "places": its distinctive multi-word names, the only mentions that make a scene change certain)
 SCENES: Dict[str, Dict[str, Any]] = {
 	"arrival_village": {
 		"name": "Arrival at Emberhead",
@@ -105,6 +108,8 @@ Respond concisely. Integrate anchors naturally. Use roll_dice where checks are i
 Stay concise. Only ask for specifics if the player's intent is genuinely unclear; otherwise, narrate what happens and let the player decide their next action. Use roll_dice for checks.
 		""",
 		"transitions": ["village_hall", "ruined_church", "ritual"],
+		"keywords": ["house", "home", "lodging", "bedroom", "May", "Ledbetter", "Ruth", "her house", "她家", "梅", "莱德", "住处"],
+		"places": ["May's house", "Ledbetter house", "Ledbetter's house", "Ledbetters' house", "Ledbetter home", "梅的家", "莱德贝特家"],
 		"npcs": [
 			{"name": "May Ledbetter", "role": "Host", "personality": "Thoughtful, cautious, maternal, melancholic.", "plot_behaviors": "Actively invites player to stay, states inn is closed; prepares meals and bedroom for player; friendly but clearly masks tension; avoids discussing village's 'festival,' changes subject when asked; may burn incense and pray softly in front of fireplace at night.", "keeper_intent": "May is one of the participants in the ritual, responsible for 'caring for' outsiders. She is inwardly fearful but unable to resist. Although she shows kindness to the player, it is actually to keep the player in the village until the day of the ritual."},
 			{"name": "Ruth Ledbetter", "role": "May's daughter", "personality": "Sensitive, timid, innocent, sincere.", "plot_behaviors": "Quiet during the day, secretly approaches player at night; whispers warning: 'Leave here before the festival'; if player talks to her, reveals mother is 'preparing for guests for the festival'; often draws strange patterns (flames and human figures).", "keeper_intent": "Ruth secretly witnessed the ritual preparations and knows that the 'festival' will involve sacrificing living people. She genuinely wants to help the player escape, but being young and powerless, she can only express her fear through warnings."}
@@ -142,6 +147,8 @@ Stay concise. Only ask for specifics if the player's intent is genuinely unclear
 Narrate succinctly. Use roll_dice for social checks and searches.
 		""",
 		"transitions": ["leddbetter_house", "ruined_church", "ritual"],
+		"keywords": ["village hall", "town hall", "town office", "hall", "office", "telegraph", "clerk", "市政厅", "镇公所", "村公所", "办公室", "电报"],
+		"places": ["village hall", "town hall", "town office", "telegraph office", "市政厅", "镇公所", "村公所"],
 		"npcs": [
 			{"name": "Clyde Winters", "role": "Town office clerk", "personality": "", "plot_behaviors": "Claims telegraph is down/being repaired; avoids questions about communications; shifts uncomfortably when pressed; becomes defensive; nervous about player's presence; may hint at knowing more but won't say", "keeper_intent": ""}
 		]
@@ -178,6 +185,8 @@ Narrate succinctly. Use roll_dice for social checks and searches.
 Narrate succinctly. Use roll_dice for social checks and investigations.
 		""",
 		"transitions": ["leddbetter_house", "village_hall", "ritual"],
+		"keywords": ["church", "chapel", "ruins", "graveyard", "priest", "caretaker", "教堂", "废墟", "墓地", "神父"],
+		"places": ["ruined church", "old church", "abandoned church", "church ruins", "破教堂", "废弃的教堂", "教堂废墟"],
 		"npcs": [
 			{"name": "Old Priest/Caretaker", "role": "Church caretaker", "personality": "", "plot_behaviors": "Found near church ruins; mutters cryptic phrases like 'The Beacon protects us'; avoids direct answers; speaks in riddles; may have deeper knowledge but won't reveal it directly", "keeper_intent": ""}
 		]
@@ -217,6 +226,8 @@ Narrate succinctly. Use roll_dice for social checks and investigations.
 Drive toward a resolution. Use roll_dice for all contested actions and SAN. Choices here determine the ending.
 		""",
 		"transitions": ["ending"],
+		"keywords": ["festival", "ritual", "Beacon", "bonfire", "ceremony", "祭典", "节日", "仪式", "灯塔", "篝火"],
+		"places": ["the Beacon", "Beacon tower", "festival grounds", "ritual site", "祭典现场", "仪式现场"],
 		"npcs": [
 			{"name": "Masked Leader/High Priest", "role": "Ritual master", "personality": "", "plot_behaviors": "Presides before Beacon; leads chanting 'The flame will purify all'; invites or forces player toward Beacon top; voice and gestures command attention", "keeper_intent": ""},
 			{"name": "May Ledbetter", "role": "Controlled participant", "personality": "", "plot_behaviors": "Stands glassy-eyed, entranced; no longer the warm host; appears under ritual's influence; cannot help player", "keeper_intent": ""},
@@ -255,6 +266,8 @@ Drive toward a resolution. Use roll_dice for all contested actions and SAN. Choi
 Provide closure aligned to the chosen path. Keep it brief and resonant.
 		""",
 		"transitions": [],
+		"keywords": ["escape", "flee", "leave the village", "逃离", "逃跑"],
+		"places": ["leave the village", "leave Emberhead"],
 		"npcs": [
 			{"name": "Silas", "role": "May appear if escaped", "personality": "", "plot_behaviors": "If escape ending: may be encountered on road; shows relief but doesn't want to discuss what happened", "keeper_intent": ""},
 			{"name": "Investigator/Researcher", "role": "Epilogue narrator", "personality": "", "plot_behaviors": "May investigate aftermath; discovers official cover story vs. truth; finds evidence of other victims", "keeper_intent": ""},
@@ -264,47 +277,48 @@ Provide closure aligned to the chosen path. Keep it brief and resonant.
 }
 
 
-def get_scene_prompt(scene_id: str, character: Dict[str, Any]) -> str:
-	"""Get the formatted prompt template for a scene"""
-	scene = SCENES.get(scene_id, {})
-	if not scene:
-		return ""
+def _format_npc(npc: Dict[str, Any]) -> str:
+	"""One NPC entry of a scene prompt template"""
+	name = npc.get("name", "Unknown")
+	role = npc.get("role", "")
+	personality = npc.get("personality", "")
+	plot_behaviors = npc.get("plot_behaviors", "")
+	keeper_intent = npc.get("keeper_intent", "")
 	
-	template = scene.get("prompt_template", "")
-	character_name = character.get("name", "Investigator")
+	npc_text = f"- **{name}** ({role})\n"
+	if personality:
+		npc_text += f"  - Personality: {personality}\n"
+	if plot_behaviors:
+		npc_text += f"  - Plot Behaviors: {plot_behaviors}\n"
+	if keeper_intent:
+		npc_text += f"  - Keeper Intent (for reference): {keeper_intent}\n"
+	return npc_text + "\n"
+
+
+def _format_npcs(scene: Dict[str, Any], in_focus: Optional[Tuple[str, ...]] = None) -> str:
+	"""
+	NPC block of a scene prompt template.
 	
-	# Format NPCs information
+	With in_focus, only those NPCs get their full entry; the others are listed
+	by name and role (slim prompts).
+	"""
 	npcs = scene.get("npcs", [])
 	npcs_text = ""
 	if npcs:
 		npcs_text = "👥 **NPCs in this Scene:**\n"
 		for npc in npcs:
-			name = npc.get("name", "Unknown")
-			role = npc.get("role", "")
-			personality = npc.get("personality", "")
-			plot_behaviors = npc.get("plot_behaviors", "")
-			keeper_intent = npc.get("keeper_intent", "")
-			
-			npcs_text += f"- **{name}** ({role})\n"
-			if personality:
-				npcs_text += f"  - Personality: {personality}\n"
-			if plot_behaviors:
-				npcs_text += f"  - Plot Behaviors: {plot_behaviors}\n"
-			if keeper_intent:
-				npcs_text += f"  - Keeper Intent (for reference): {keeper_intent}\n"
-			npcs_text += "\n"
-	
-	# Format transitions information
+			if in_focus is None or npc.get("name") in in_focus:
+				npcs_text += _format_npc(npc)
+			else:
+				npcs_text += f"- **{npc.get('name', 'Unknown')}** ({npc.get('role', '')})\n"
+	return npcs_text
+
+
+def _format_transitions(scene: Dict[str, Any], names_only: bool = False) -> str:
+	"""Transition block of a scene prompt template (names_only: without descriptions)"""
 	transitions = scene.get("transitions", [])
 	transitions_text = ""
 	if transitions:
-		# Get scene names for better readability
-		transition_names = []
-		for trans_id in transitions:
-			trans_scene = SCENES.get(trans_id, {})
-			trans_name = trans_scene.get("name", trans_id)
-			transition_names.append(f"{trans_id} ({trans_name})")
-		
 		transitions_text = "🔄 **Available Scene Transitions:**\n"
 		transitions_text += f"When the player's actions suggest moving to a new location, you can call the change_scene tool with one of these scene IDs:\n"
 		for trans_id in transitions:
@@ -312,34 +326,271 @@ def get_scene_prompt(scene_id: str, character: Dict[str, Any]) -> str:
 			trans_name = trans_scene.get("name", trans_id)
 			trans_desc = trans_scene.get("description", "")
 			transitions_text += f"- **{trans_id}**: {trans_name}"
-			if trans_desc:
+			if trans_desc and not names_only:
 				transitions_text += f" - {trans_desc}"
 			transitions_text += "\n"
 		transitions_text += "\n"
 	else:
 		transitions_text = "🔄 **Scene Transitions:**\nNo transitions available from this scene (likely an ending scene).\n\n"
+	return transitions_text
+
+
+def _character_fields(character: Dict[str, Any]) -> Dict[str, Any]:
+	"""Character placeholders of the scene prompt templates"""
+	return {
+		"character_name": character.get("name", "Investigator"),
+		"str": character.get("str", 50),
+		"int_val": character.get("int", 50),
+		"pow": character.get("pow", 50),
+		"spot": character.get("spot", 50),
+		"listen": character.get("listen", 50),
+		"stealth": character.get("stealth", 50),
+		"charm": character.get("charm", 50),
+		"luck": character.get("luck", 50),
+		"san": character.get("san", 60),
+	}
+
+
+# The per-character line of each prompt template
+_PLAYER_CONTEXT = re.compile(r"\*\*Player Context:\*\*\n[^\n]*\n")
+
+
+def _split_template(template: str) -> Tuple[str, str]:
+	"""Split a prompt template into its scene part and its Player Context part"""
+	match = _PLAYER_CONTEXT.search(template)
+	if not match:
+		return template, ""
+	return template[:match.start()] + template[match.end():], match.group(0)
+
+
+# Rendered fragments of known scenes, filled on first use: scene_id -> {key_clues,
+# npcs, transitions, creative_space} blocks, the section without Player Context
+# (per scene and slim flag), the Player Context template, the slim NPC blocks
+# (per scene and NPCs in focus), the NPC name patterns and the transition intent
+# patterns (any mention, and distinctive place names only)
+_scene_blocks: Dict[str, Dict[str, str]] = {}
+_scene_sections: Dict[Tuple[str, bool], str] = {}
+_player_context_templates: Dict[str, str] = {}
+_npc_sections: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+_npc_patterns: Dict[str, List[Tuple[str, "re.Pattern[str]"]]] = {}
+_transition_patterns: Dict[str, List[Tuple[str, "re.Pattern[str]"]]] = {}
+_place_patterns: Dict[str, List[Tuple[str, "re.Pattern[str]"]]] = {}
+
+# Words of NPC names that say nothing about who is meant
+_GENERIC_NAME_WORDS = {"Old", "High", "Masked", "The"}
+
+# Trailing whitespace and runs of blank lines left by empty template blocks
+_TRAILING_SPACE = re.compile(r"[ \t]+\n")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def _get_scene_blocks(scene_id: str) -> Dict[str, str]:
+	"""The rendered scene blocks of a prompt template (rendered once per scene)"""
+	blocks = _scene_blocks.get(scene_id)
+	if blocks is None:
+		scene = SCENES.get(scene_id, {})
+		blocks = {
+			"key_clues": scene.get("key_clues", ""),
+			"npcs": _format_npcs(scene),
+			"transitions": _format_transitions(scene),
+			"creative_space": scene.get("creative_space", ""),
+		}
+		if scene:
+			_scene_blocks[scene_id] = blocks
+	return blocks
+
+
+def clear_scene_cache() -> None:
+	"""Drop rendered scene fragments (call after editing SCENES at runtime)"""
+	_scene_blocks.clear()
+	_scene_sections.clear()
+	_player_context_templates.clear()
+	_npc_sections.clear()
+	_npc_patterns.clear()
+	_transition_patterns.clear()
+	_place_patterns.clear()
+
+
+def get_scene_prompt(scene_id: str, character: Dict[str, Any]) -> str:
+	"""Get the formatted prompt template for a scene"""
+	scene = SCENES.get(scene_id, {})
+	if not scene:
+		return ""
+	
+	template = scene.get("prompt_template", "")
 	
-	# Format template with character attributes
+	# Format template with scene blocks and character attributes
 	formatted = template.format(
-		key_clues=scene.get("key_clues", ""),
-		npcs=npcs_text,
-		transitions=transitions_text,
-		creative_space=scene.get("creative_space", ""),
-		character_name=character_name,
-		str=character.get("str", 50),
-		int_val=character.get("int", 50),
-		pow=character.get("pow", 50),
-		spot=character.get("spot", 50),
-		listen=character.get("listen", 50),
-		stealth=character.get("stealth", 50),
-		charm=character.get("charm", 50),
-		luck=character.get("luck", 50),
-		san=character.get("san", 60)
+		**_get_scene_blocks(scene_id),
+		**_character_fields(character)
 	)
 	
 	return formatted
 
 
+def get_scene_section(scene_id: str, slim: bool = False) -> str:
+	"""
+	The scene's prompt template without its Player Context line.
+	
+	The same text for every investigator, so it can sit before per-character
+	state in the system prompt (see get_player_context). Rendered once per scene.
+	
+	With slim, the NPC block is left out (see get_npc_section) and transitions
+	are listed by name only.
+	"""
+	section = _scene_sections.get((scene_id, slim))
+	if section is None:
+		scene = SCENES.get(scene_id, {})
+		if not scene:
+			return ""
+		scene_part, _ = _split_template(scene.get("prompt_template", ""))
+		section = scene_part.format(**get_scene_blocks(scene_id, slim))
+		if slim:
+			section = _BLANK_LINES.sub("\n\n", _TRAILING_SPACE.sub("\n", section))
+		_scene_sections[(scene_id, slim)] = section
+	return section
+
+
+def get_scene_blocks(scene_id: str, slim: bool = False) -> Dict[str, str]:
+	"""The key_clues, npcs, transitions and creative_space blocks as get_scene_section renders them"""
+	blocks = _get_scene_blocks(scene_id)
+	if slim:
+		blocks = {**blocks, "npcs": "", "transitions": _format_transitions(SCENES.get(scene_id, {}), names_only=True)}
+	return blocks
+
+
+def get_player_context(scene_id: str, character: Dict[str, Any]) -> str:
+	"""The Player Context line of a scene's prompt template, filled in for a character"""
+	template = _player_context_templates.get(scene_id)
+	if template is None:
+		scene = SCENES.get(scene_id, {})
+		_, template = _split_template(scene.get("prompt_template", ""))
+		if scene:
+			_player_context_templates[scene_id] = template
+	return template.format(**_character_fields(character)).strip()
+
+
+def _name_aliases(name: str) -> set:
+	"""A name and its distinctive words ("Old Priest/Caretaker" -> Old Priest, Priest, Caretaker)"""
+	aliases = set()
+	for part in name.split("/"):
+		aliases.add(part.strip())
+		aliases.update(word for word in part.split() if len(word) >= 3 and word not in _GENERIC_NAME_WORDS)
+	return aliases
+
+
+def _alias_pattern(aliases: Iterable[str]) -> Optional["re.Pattern[str]"]:
+	"""
+	Whole-word pattern for any alias; short ones ("May") only count capitalized,
+	long ones in any case. Chinese aliases match anywhere (no word boundaries).
+	"""
+	words = [a for a in aliases if a.isascii()]
+	long_aliases = sorted((re.escape(a) for a in words if len(a) > 3), key=len, reverse=True)
+	short_aliases = sorted(re.escape(a) for a in words if 0 < len(a) <= 3)
+	alternatives = []
+	if long_aliases:
+		alternatives.append(f"(?i:{'|'.join(long_aliases)})")
+	alternatives.extend(short_aliases)
+	patterns = [rf"\b(?:{'|'.join(alternatives)})\b"] if alternatives else []
+	other = sorted((re.escape(a) for a in aliases if a and not a.isascii()), key=len, reverse=True)
+	if other:
+		patterns.append("|".join(other))
+	return re.compile("|".join(patterns)) if patterns else None
+
+
+def _name_patterns(scene_id: str) -> List[Tuple[str, "re.Pattern[str]"]]:
+	"""(NPC name, pattern matching the name or a distinctive part of it) for a scene"""
+	patterns = _npc_patterns.get(scene_id)
+	if patterns is None:
+		patterns = []
+		for npc in SCENES.get(scene_id, {}).get("npcs", []):
+			name = npc.get("name", "")
+			pattern = _alias_pattern(_name_aliases(name))
+			if pattern is not None:
+				patterns.append((name, pattern))
+		if scene_id in SCENES:
+			_npc_patterns[scene_id] = patterns
+	return patterns
+
+
+def npcs_mentioned(scene_id: str, text: str) -> Tuple[str, ...]:
+	"""Names of the scene's NPCs mentioned in a text, in scene order"""
+	return tuple(name for name, pattern in _name_patterns(scene_id) if pattern.search(text))
+
+
+def _intent_patterns(scene_id: str) -> List[Tuple[str, "re.Pattern[str]"]]:
+	"""
+	(target scene ID, pattern) for each transition of a scene, matching the
+	target's name, its keywords and places and the NPCs met only there (not in
+	this scene or another of its transitions)
+	"""
+	patterns = _transition_patterns.get(scene_id)
+	if patterns is None:
+		patterns = []
+		targets = get_available_transitions(scene_id)
+		npc_aliases = {
+			target_id: {alias for npc in SCENES.get(target_id, {}).get("npcs", []) for alias in _name_aliases(npc.get("name", ""))}
+			for target_id in [scene_id] + targets
+		}
+		for target_id in targets:
+			target = SCENES.get(target_id, {})
+			aliases = set(target.get("keywords", [])) | set(target.get("places", []))
+			aliases.update(part.strip() for part in target.get("name", "").split("/"))
+			elsewhere = set().union(*(names for other, names in npc_aliases.items() if other != target_id))
+			aliases.update(npc_aliases[target_id] - elsewhere)
+			pattern = _alias_pattern(aliases)
+			if pattern is not None:
+				patterns.append((target_id, pattern))
+		if scene_id in SCENES:
+			_transition_patterns[scene_id] = patterns
+	return patterns
+
+
+def transitions_mentioned(scene_id: str, text: str) -> Tuple[str, ...]:
+	"""IDs of the scenes reachable from a scene that a text points to (e.g. "the church"), in transition order"""
+	return tuple(target for target, pattern in _intent_patterns(scene_id) if pattern.search(text))
+
+
+def _place_name_patterns(scene_id: str) -> List[Tuple[str, "re.Pattern[str]"]]:
+	"""(target scene ID, pattern) for each transition of a scene, matching only the target's name and places"""
+	patterns = _place_patterns.get(scene_id)
+	if patterns is None:
+		patterns = []
+		for target_id in get_available_transitions(scene_id):
+			target = SCENES.get(target_id, {})
+			aliases = set(target.get("places", []))
+			aliases.update(part.strip() for part in target.get("name", "").split("/"))
+			pattern = _alias_pattern(aliases)
+			if pattern is not None:
+				patterns.append((target_id, pattern))
+		if scene_id in SCENES:
+			_place_patterns[scene_id] = patterns
+	return patterns
+
+
+def places_mentioned(scene_id: str, text: str) -> Tuple[str, ...]:
+	"""
+	IDs of the scenes reachable from a scene that a text names unambiguously
+	("the ruined church", not "the church" or "the priest"), in transition order
+	"""
+	return tuple(target for target, pattern in _place_name_patterns(scene_id) if pattern.search(text))
+
+
+def get_npc_section(scene_id: str, in_focus: Optional[Tuple[str, ...]] = None) -> str:
+	"""
+	NPC block of a slim scene prompt: full entries only for the NPCs in focus
+	(all of them when in_focus is None), the others by name and role.
+	"""
+	key = (scene_id, in_focus if in_focus is not None else ("*",))
+	section = _npc_sections.get(key)
+	if section is None:
+		scene = SCENES.get(scene_id, {})
+		section = _format_npcs(scene, in_focus).strip()
+		if scene:
+			_npc_sections[key] = section
+	return section
+
+
 def get_available_transitions(scene_id: str) -> List[str]:
 	"""Get available scene transitions from current scene"""
 	return SCENES.get(scene_id, {}).get("transitions", [])
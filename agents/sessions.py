@@ -0,0 +1,186 @@
+"""Server-side KP session store (history, summary, character sheet and scene per session)"""
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from agents.kp_agent import AutoRoll, PendingCheck
+from agents.speculation import CheckSpeculation, ScenePrefetcher
+from agents.memory import SUMMARY_PREFIX, fold_into_summary
+from utils.metrics import counter
+from utils.tracing import get_tracer
+
+HISTORY_FOLDED = counter(
+	"kp_session_history_folded_total", "Messages over the session history cap folded into the summary uncompressed"
+)
+
+_trace = get_tracer("sessions")
+
+
+class KPSession:
+	"""State kept on the server for one investigator's game session"""
+
+	def __init__(
+		self,
+		character: Dict[str, Any],
+		current_scene: str = "arrival_village",
+		history: Optional[List[Dict[str, str]]] = None,
+		max_history_messages: int = 40,
+		auto_roll: Optional[AutoRoll] = None,
+		prompt_mode: Optional[str] = None,
+		speculate_checks: bool = False,
+		prefetch_narration: bool = False,
+	):
+		self.session_id: str = uuid.uuid4().hex
+		self.character: Dict[str, Any] = character
+		self.current_scene: str = current_scene
+		self.summary: Optional[str] = None  # Content of the compressed "Summary of earlier events" message
+		self.history: List[Dict[str, str]] = []
+		self.max_history_messages = max_history_messages
+		self.auto_roll = auto_roll  # Server-side rolling with this session's own RNG stream (opt-in)
+		self.pending_checks: List[PendingCheck] = []  # Checks the player still has to roll
+		self.prompt_mode = prompt_mode  # "full" / "slim" system prompt (None: server default)
+		self.speculate_checks = speculate_checks  # Pre-generate check outcomes while the player rolls (opt-in)
+		self.speculation: Optional[CheckSpeculation] = None  # For the pending check, until the roll arrives
+		# Scenes the player's input pointed to, warmed for a coming change_scene (narrated: opt-in)
+		self.scene_prefetch = ScenePrefetcher(narrate=prefetch_narration)
+		self.created_at = time.time()
+		self.updated_at = self.created_at
+		# Serializes turns of the same session (concurrent requests from one player)
+		self.lock = asyncio.Lock()
+
+		if history:
+			self.replace_history(history)
+
+	def chat_history(self) -> List[Dict[str, str]]:
+		"""History in the chat_history format expected by get_kp_response"""
+		if self.summary:
+			return [{"role": "assistant", "content": self.summary}] + self.history
+		return list(self.history)
+
+	def replace_history(self, history: List[Dict[str, str]]) -> None:
+		"""Replace history, splitting off a leading summary message if present"""
+		if history and history[0].get("content", "").startswith(SUMMARY_PREFIX):
+			self.summary = history[0]["content"]
+			history = history[1:]
+		self.history = [{"role": msg["role"], "content": msg["content"]} for msg in history]
+		self._trim()
+
+	def record_turn(self, user_input: str, result: Dict[str, Any]) -> None:
+		"""Apply a get_kp_response result to the session"""
+		if "compressed_history" in result:
+			self.replace_history(result["compressed_history"])
+
+		self.history.append({"role": "user", "content": user_input})
+		self.history.append({"role": "assistant", "content": result["response"]})
+		self._trim()
+
+		self.character = result.get("character") or self.character
+		self.current_scene = result.get("current_scene", self.current_scene)
+		self.pending_checks = result.get("pending_checks") or []
+		self.updated_at = time.time()
+
+	def take_speculation(self) -> Optional[CheckSpeculation]:
+		"""Hand the held speculation to the turn that resolves the check"""
+		speculation, self.speculation = self.speculation, None
+		return speculation
+
+	def discard_speculation(self) -> None:
+		speculation = self.take_speculation()
+		if speculation is not None:
+			speculation.discard()
+
+	def _trim(self) -> None:
+		# Bound the message list; compression normally keeps history well under the cap.
+		# When it has not run (short messages, skipped under load) the oldest messages
+		# go into the summary verbatim rather than being lost, for the next compression.
+		overflow = len(self.history) - self.max_history_messages
+		if overflow > 0:
+			self.summary = fold_into_summary(self.summary, self.history[:overflow])
+			del self.history[:overflow]
+			HISTORY_FOLDED.inc(overflow)
+			_trace.info("history_folded", session_id=self.session_id, messages=overflow)
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {
+			"session_id": self.session_id,
+			"character": self.character,
+			"current_scene": self.current_scene,
+			"chat_history": self.chat_history(),
+			"auto_roll": self.auto_roll.to_dict() if self.auto_roll is not None else None,
+			"pending_checks": self.pending_checks,
+			"prompt_mode": self.prompt_mode,
+			"speculate_checks": self.speculate_checks,
+			"prefetch_narration": self.scene_prefetch.narrate,
+		}
+
+
+class SessionStore:
+	"""In-memory LRU store of KPSession objects"""
+
+	def __init__(
+		self,
+		max_sessions: int = 1000,
+		max_history_messages: int = 40,
+		on_evict: Optional[Callable[[KPSession], None]] = None,
+	):
+		self.max_sessions = max_sessions
+		self.max_history_messages = max_history_messages
+		self.on_evict = on_evict  # Called for sessions dropped by LRU eviction or delete()
+		self._sessions: "OrderedDict[str, KPSession]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def create(
+		self,
+		character: Dict[str, Any],
+		current_scene: str = "arrival_village",
+		chat_history: Optional[List[Dict[str, str]]] = None,
+		auto_roll: Optional[AutoRoll] = None,
+		prompt_mode: Optional[str] = None,
+		speculate_checks: bool = False,
+		prefetch_narration: bool = False,
+	) -> KPSession:
+		"""Create a session, evicting the least recently used one if the store is full"""
+		session = KPSession(
+			character,
+			current_scene=current_scene,
+			history=chat_history,
+			max_history_messages=self.max_history_messages,
+			auto_roll=auto_roll,
+			prompt_mode=prompt_mode,
+			speculate_checks=speculate_checks,
+			prefetch_narration=prefetch_narration,
+		)
+		evicted = []
+		with self._lock:
+			self._sessions[session.session_id] = session
+			while len(self._sessions) > self.max_sessions:
+				evicted.append(self._sessions.popitem(last=False)[1])
+		for old in evicted:
+			self._evicted(old)
+		return session
+
+	def get(self, session_id: str) -> Optional[KPSession]:
+		"""Look up a session and mark it as recently used"""
+		with self._lock:
+			session = self._sessions.get(session_id)
+			if session is not None:
+				self._sessions.move_to_end(session_id)
+			return session
+
+	def delete(self, session_id: str) -> bool:
+		with self._lock:
+			session = self._sessions.pop(session_id, None)
+		if session is None:
+			return False
+		self._evicted(session)
+		return True
+
+	def _evicted(self, session: KPSession) -> None:
+		if self.on_evict is not None:
+			self.on_evict(session)
+
+	def __len__(self) -> int:
+		return len(self._sessions)
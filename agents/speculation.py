@@ -0,0 +1,278 @@
+"""
+Speculative Keeper continuations: narrate the likely outcomes of a check while
+the player rolls, and warm the scenes the player is likely to move to next
+"""
+import asyncio
+import contextvars
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from agents.llm import record_usage
+from utils.logging import bind_session, current_session
+from utils.metrics import counter
+from utils.tracing import get_tracer
+
+# Outcome tiers of a check; hard and extreme successes narrate like "success"
+CHECK_TIERS = ("success", "failure", "critical", "fumble")
+
+# Tiers generated ahead of the roll; critical and fumble (2% of rolls between them) are opt-in
+SPECULATE_TIERS = tuple(
+	tier for tier in (part.strip() for part in os.getenv("KP_SPECULATE_TIERS", "success,failure").split(","))
+	if tier in CHECK_TIERS
+)
+# No new speculation starts while this many continuations are in flight
+SPECULATE_MAX_TASKS = int(os.getenv("KP_SPECULATE_MAX_TASKS", "32"))
+
+SPECULATION = counter(
+	"kp_speculation_total", "Speculative check continuations by outcome", ["result"]
+)  # hit / miss / stale / failed (taken) and wasted / cancelled (not taken); hit rate = hit / (hit + miss + stale + failed)
+SPECULATION_WASTED_TOKENS = counter(
+	"kp_speculation_wasted_tokens_total", "Tokens spent on speculative continuations that were not used", ["kind"]
+)
+
+# Warmed scenes stay usable this long (seconds)
+PREFETCH_TTL = float(os.getenv("KP_PREFETCH_TTL", "300"))
+
+SCENE_PREFETCH = counter(
+	"kp_scene_prefetch_total", "Scene-entry prefetches by outcome", ["result"]
+)  # warmed / narrated when started; hit / miss / expired / narration_hit / narration_stale on change_scene; wasted / cancelled
+SCENE_PREFETCH_WASTED_TOKENS = counter(
+	"kp_scene_prefetch_wasted_tokens_total", "Tokens spent on prefetched arrival narrations that were not used", ["kind"]
+)
+
+_trace = get_tracer("speculation")
+_running: "set[asyncio.Task]" = set()
+
+
+def check_tier(d100: int, threshold: int) -> str:
+	"""Outcome tier of a roll against a (difficulty-adjusted) threshold"""
+	if d100 == 1:
+		return "critical"
+	if d100 == 100:
+		return "fumble"
+	return "success" if d100 <= threshold else "failure"
+
+
+def tier_roll(tier: str, threshold: int) -> Optional[int]:
+	"""A representative roll of a tier (mid-range, so not an extreme success), or None if the tier can't occur"""
+	if tier == "critical":
+		return 1
+	if tier == "fumble":
+		return 100
+	if tier == "success":
+		low, high = max(2, threshold // 5 + 1), min(99, threshold)
+		if high < 2:
+			return None
+		return (min(low, high) + high) // 2
+	low = max(2, threshold + 1)
+	return (low + 99) // 2 if low <= 99 else None
+
+
+def speculation_capacity() -> int:
+	"""How many more continuations may start now"""
+	return max(0, SPECULATE_MAX_TASKS - len(_running))
+
+
+def start_continuation(coro: Any) -> "asyncio.Task":
+	"""
+	Run one speculative continuation in the background (call from the event loop).
+
+	The task gets a fresh context with only the session's logger bound: the
+	request that started it (its ID, Server-Timing phases, stream writer) has
+	usually finished by the time the continuation runs.
+	"""
+	context = contextvars.Context()
+	context.run(bind_session, current_session())
+	task = context.run(asyncio.get_running_loop().create_task, coro)
+	_running.add(task)
+	task.add_done_callback(_running.discard)
+	task.add_done_callback(_retrieve_exception)
+	return task
+
+
+class CheckSpeculation:
+	"""
+	Continuations of the Keeper's next turn for one pending check, one per tier.
+
+	Held by the session between the check request and the roll. The turn that
+	resolves the check takes the continuation of the rolled tier (awaiting it if
+	it is still running) instead of calling the LLM, provided it continues the
+	same conversation; the rest are cancelled, or counted as wasted tokens if
+	they already finished.
+	"""
+
+	def __init__(
+		self,
+		request_id: Optional[str],
+		tasks: Dict[str, "asyncio.Task"],
+		prompt_tokens: int = 0,
+		conversation: Tuple[Any, ...] = (),
+	):
+		self.request_id = request_id
+		self.prompt_tokens = prompt_tokens  # Local estimate, billed for cancelled in-flight calls too
+		self.conversation = conversation  # Marks the history the continuations follow
+		self._tasks = tasks
+
+	def tiers(self) -> Tuple[str, ...]:
+		return tuple(self._tasks)
+
+	async def take(self, request_id: Optional[str], tier: Optional[str], conversation: Tuple[Any, ...]) -> Optional[Any]:
+		"""
+		The continuation for the rolled check and tier, or None (the caller then
+		calls the LLM); None as well when the history has moved on since it started
+		"""
+		task = self._tasks.pop(tier, None) if request_id == self.request_id and tier else None
+		self.discard()
+		if task is not None and conversation != self.conversation:
+			_discard_task(task, self.prompt_tokens, SPECULATION, SPECULATION_WASTED_TOKENS, "speculative")
+			SPECULATION.inc(result="stale")
+			_trace.debug("speculation_stale", request_id=request_id, tier=tier)
+			return None
+		if task is None:
+			SPECULATION.inc(result="miss")
+			_trace.debug("speculation_miss", request_id=request_id, tier=tier)
+			return None
+		try:
+			response = await task
+		except Exception as exc:
+			SPECULATION.inc(result="failed")
+			_trace.warning("speculation_failed", tier=tier, error=str(exc))
+			return None
+		SPECULATION.inc(result="hit")
+		_trace.debug("speculation_hit", request_id=request_id, tier=tier)
+		return response
+
+	def discard(self) -> None:
+		"""Cancel the continuations still running and count the unused ones as waste (idempotent)"""
+		for task in self._tasks.values():
+			_discard_task(task, self.prompt_tokens, SPECULATION, SPECULATION_WASTED_TOKENS, "speculative")
+		self._tasks.clear()
+
+
+def _discard_task(task: Optional["asyncio.Task"], prompt_tokens: int, wasted: Any, tokens: Any, call: str) -> None:
+	"""Cancel an unused continuation, or count its tokens as wasted if it already finished"""
+	if task is None:
+		return
+	if task.done() and not task.cancelled() and task.exception() is None:
+		usage = record_usage(call, task.result())
+		wasted.inc(result="wasted")
+		tokens.inc(usage["prompt_tokens"] or prompt_tokens, kind="prompt")
+		tokens.inc(usage["completion_tokens"], kind="completion")
+	elif not task.done():
+		task.cancel()
+		wasted.inc(result="cancelled")
+		tokens.inc(prompt_tokens, kind="prompt")
+
+
+class PrefetchedScene:
+	"""
+	A scene warmed ahead of its change_scene: the system prompt for entering it
+	and, optionally, the Keeper's arrival narration (still running or done)
+	"""
+
+	def __init__(
+		self,
+		scene_id: str,
+		prompt_key: Tuple[Any, ...],
+		conversation: Tuple[Any, ...],
+		system_msg: Any,
+		prompt_components: Dict[str, int],
+		narration: Optional["asyncio.Task"] = None,
+	):
+		self.scene_id = scene_id
+		self.prompt_key = prompt_key  # Prompt mode and the investigator's stats the prompt was built for
+		self.conversation = conversation  # Marks the messages the narration continues
+		self.system_msg = system_msg
+		self.prompt_components = prompt_components
+		self.narration = narration
+		self.prompt_tokens = sum(prompt_components.values())
+		self.created_at = time.monotonic()
+
+	def take_narration(self, conversation: Tuple[Any, ...]) -> Optional["asyncio.Task"]:
+		"""The arrival narration if it continues this conversation; otherwise it is dropped"""
+		narration, self.narration = self.narration, None
+		if narration is None:
+			return None
+		if conversation != self.conversation:
+			SCENE_PREFETCH.inc(result="narration_stale")
+			_discard_task(narration, self.prompt_tokens, SCENE_PREFETCH, SCENE_PREFETCH_WASTED_TOKENS, "prefetch")
+			return None
+		SCENE_PREFETCH.inc(result="narration_hit")
+		return narration
+
+	def discard(self) -> None:
+		narration, self.narration = self.narration, None
+		_discard_task(narration, self.prompt_tokens, SCENE_PREFETCH, SCENE_PREFETCH_WASTED_TOKENS, "prefetch")
+
+
+class ScenePrefetcher:
+	"""
+	Scenes warmed for one session, by scene ID, each usable for ttl seconds.
+
+	Held by the session across turns: a turn whose input points to a reachable
+	scene warms it (see prefetch_scene_entries in kp_agent), and a later
+	successful change_scene to that scene takes it instead of building the
+	prompt, and instead of the re-invoke when the narration continues the same
+	conversation. Arrival narrations cost an LLM call each, so they are opt-in
+	(narrate).
+	"""
+
+	def __init__(self, narrate: bool = False, ttl: float = PREFETCH_TTL):
+		self.narrate = narrate
+		self.ttl = ttl
+		self._scenes: Dict[str, PrefetchedScene] = {}
+
+	def fresh(self, scene_id: str, prompt_key: Tuple[Any, ...], conversation: Tuple[Any, ...]) -> bool:
+		"""True if the scene is already warmed for this prompt and conversation (e.g. a retried turn)"""
+		entry = self._scenes.get(scene_id)
+		return (
+			entry is not None
+			and time.monotonic() - entry.created_at <= self.ttl
+			and entry.prompt_key == prompt_key
+			and entry.conversation == conversation
+		)
+
+	def put(self, entry: PrefetchedScene) -> None:
+		old = self._scenes.pop(entry.scene_id, None)
+		if old is not None:
+			old.discard()
+		self._scenes[entry.scene_id] = entry
+		SCENE_PREFETCH.inc(result="warmed")
+		if entry.narration is not None:
+			SCENE_PREFETCH.inc(result="narrated")
+
+	def take(self, scene_id: str) -> Optional[PrefetchedScene]:
+		"""The warmed scene for a change_scene, or None if it was not warmed or has expired"""
+		entry = self._scenes.pop(scene_id, None)
+		if entry is None:
+			SCENE_PREFETCH.inc(result="miss")
+			return None
+		if time.monotonic() - entry.created_at > self.ttl:
+			SCENE_PREFETCH.inc(result="expired")
+			entry.discard()
+			return None
+		SCENE_PREFETCH.inc(result="hit")
+		_trace.debug("scene_prefetch_hit", scene=scene_id, narration=entry.narration is not None)
+		return entry
+
+	def expire(self) -> None:
+		"""Drop the entries older than the TTL"""
+		now = time.monotonic()
+		for scene_id, entry in list(self._scenes.items()):
+			if now - entry.created_at > self.ttl:
+				del self._scenes[scene_id]
+				SCENE_PREFETCH.inc(result="expired")
+				entry.discard()
+
+	def discard(self) -> None:
+		"""Drop every warmed scene (e.g. when the session is deleted)"""
+		for entry in self._scenes.values():
+			entry.discard()
+		self._scenes.clear()
+
+
+def _retrieve_exception(task: "asyncio.Task") -> None:
+	# Failed continuations are reported by take(); don't log "exception was never retrieved"
+	if not task.cancelled():
+		task.exception()
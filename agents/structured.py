@@ -0,0 +1,188 @@
+"""
+Single-call Keeper engine: one JSON object with the narration and the actions,
+instead of tool calls followed by a second completion that narrates them
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+
+from agents.scenes import SCENES, get_available_transitions
+from utils.metrics import counter
+from utils.tokens import count_tokens
+
+STRUCTURED_OUTPUT = counter(
+	"kp_structured_output_total", "Structured Keeper responses by validation result", ["result"]
+)  # ok / invalid_json (used as plain narration) / invalid_check / invalid_scene (dropped)
+
+
+class StructuredCheck(TypedDict):
+	"""A check in the Keeper's structured response (the roll_dice / san_check arguments)"""
+	kind: str  # "dice" / "san"
+	skill_name: Optional[str]
+	difficulty: Optional[str]
+	skill_value: Optional[int]
+	san_loss: Optional[int]
+
+
+class KeeperOutput(TypedDict):
+	narration: str
+	checks: List[StructuredCheck]
+	scene_change: Optional[str]  # Scene ID to move to, validated against the current scene's transitions
+
+
+DIFFICULTIES = ("easy", "normal", "hard", "extreme")
+
+# Character sheet field of a skill, by the names the rules ask the Keeper to use
+SHEET_SKILLS = {
+	"spot hidden": "spot", "spot": "spot",
+	"listen": "listen",
+	"stealth": "stealth",
+	"charm": "charm",
+	"luck": "luck",
+	"strength": "str", "str": "str",
+	"intelligence": "int", "int": "int",
+	"power": "pow", "pow": "pow",
+}
+
+# Strict JSON schema (every field required, nulls for "not set") sent as response_format
+KEEPER_OUTPUT_SCHEMA: Dict[str, Any] = {
+	"name": "keeper_turn",
+	"strict": True,
+	"schema": {
+		"type": "object",
+		"additionalProperties": False,
+		"required": ["narration", "checks", "scene_change"],
+		"properties": {
+			"narration": {
+				"type": "string",
+				"description": "What the Keeper says to the player this turn (empty when only asking for a roll)",
+			},
+			"checks": {
+				"type": "array",
+				"description": "Checks the investigator must roll now; usually empty",
+				"items": {
+					"type": "object",
+					"additionalProperties": False,
+					"required": ["kind", "skill_name", "difficulty", "skill_value", "san_loss"],
+					"properties": {
+						"kind": {"type": "string", "enum": ["dice", "san"]},
+						"skill_name": {"type": ["string", "null"], "description": "Skill tested (dice checks)"},
+						"difficulty": {"type": ["string", "null"], "enum": list(DIFFICULTIES) + [None]},
+						"skill_value": {"type": ["integer", "null"], "description": "The investigator's skill value (dice checks)"},
+						"san_loss": {"type": ["integer", "null"], "description": "SAN lost on a failed sanity check (san checks)"},
+					},
+				},
+			},
+			"scene_change": {
+				"type": ["string", "null"],
+				"enum": list(SCENES) + [None],
+				"description": "Scene ID the investigator moves to this turn, from the available transitions; null to stay",
+			},
+		},
+	},
+}
+
+# Appended to the Keeper's system prompt (as a second system message, so the
+# provider's prefix cache is shared with the tool-calling engine)
+OUTPUT_INSTRUCTIONS = """**Response Format (no tools in this mode):**
+Reply with one JSON object instead of calling tools:
+- "narration": your reply to the player, following every rule above
+- "checks": one entry per roll_dice / san_check call you would make: {"kind": "dice", "skill_name", "difficulty", "skill_value"} or {"kind": "san", "san_loss"}; other fields null. When you ask for a roll, leave "narration" empty or one short line and do not describe the outcome
+- "scene_change": the scene ID you would pass to change_scene, or null. When you move the investigator, "narration" already describes the arrival in the new scene"""
+
+_output_tokens: Optional[int] = None
+
+
+def output_format_tokens() -> int:
+	"""Tokens of the output instructions and the response schema (counted once)"""
+	global _output_tokens
+	if _output_tokens is None:
+		_output_tokens = count_tokens(OUTPUT_INSTRUCTIONS) + count_tokens(json.dumps(KEEPER_OUTPUT_SCHEMA["schema"]))
+	return _output_tokens
+
+
+def _sheet_value(character: Optional[Dict[str, Any]], skill_name: str) -> Optional[int]:
+	field = SHEET_SKILLS.get(skill_name.strip().lower())
+	value = (character or {}).get(field) if field else None
+	return value if isinstance(value, int) and 0 < value <= 100 else None
+
+
+def _valid_check(check: Any, character: Optional[Dict[str, Any]]) -> Optional[StructuredCheck]:
+	"""
+	The check with its numbers, or None when they cannot be trusted: a dice check
+	without a usable skill value (from the response, else the character sheet)
+	or a SAN check without a SAN loss. Nothing is made up, since the numbers decide the roll.
+	"""
+	if not isinstance(check, dict) or check.get("kind") not in ("dice", "san"):
+		return None
+	skill_name = check.get("skill_name")
+	skill_value = check.get("skill_value")
+	san_loss = check.get("san_loss")
+	if check["kind"] == "san":
+		if not isinstance(san_loss, int) or san_loss <= 0:
+			return None
+		skill_value = None
+	else:
+		if not (isinstance(skill_name, str) and skill_name.strip()):
+			return None
+		if not (isinstance(skill_value, int) and 0 < skill_value <= 100):
+			skill_value = _sheet_value(character, skill_name)
+			if skill_value is None:
+				return None
+		san_loss = None
+	return {
+		"kind": check["kind"],
+		"skill_name": skill_name,
+		"difficulty": check.get("difficulty") if check.get("difficulty") in DIFFICULTIES else "normal",
+		"skill_value": skill_value,
+		"san_loss": san_loss,
+	}
+
+
+def parse_keeper_output(
+	content: Any, current_scene: str, character: Optional[Dict[str, Any]] = None
+) -> Tuple[KeeperOutput, List[str]]:
+	"""
+	Validate a structured Keeper response for the current scene.
+
+	Malformed checks (see _valid_check; skill values missing from the response
+	are read from the character's sheet) and a scene change that is not an
+	available transition are dropped (the narration is kept); a response that is not a JSON object
+	at all is taken as plain narration. Returns the output and the problems
+	found (the kp_structured_output_total results other than "ok").
+	"""
+	text = content if isinstance(content, str) else ""
+	try:
+		data = json.loads(text)
+	except json.JSONDecodeError:
+		data = None
+	if not isinstance(data, dict):
+		STRUCTURED_OUTPUT.inc(result="invalid_json")
+		return {"narration": text, "checks": [], "scene_change": None}, ["invalid_json"]
+
+	problems = []
+	narration = data.get("narration")
+	checks = []
+	for check in data.get("checks") or []:
+		valid = _valid_check(check, character)
+		if valid is None:
+			problems.append("invalid_check")
+		else:
+			checks.append(valid)
+
+	scene_change = data.get("scene_change")
+	if scene_change == current_scene:
+		scene_change = None
+	if scene_change is not None and scene_change not in get_available_transitions(current_scene):
+		problems.append("invalid_scene")
+		scene_change = None
+
+	for problem in problems:
+		STRUCTURED_OUTPUT.inc(result=problem)
+	if not problems:
+		STRUCTURED_OUTPUT.inc(result="ok")
+	output: KeeperOutput = {
+		"narration": narration if isinstance(narration, str) else "",
+		"checks": checks,
+		"scene_change": scene_change,
+	}
+	return output, problems
@@ -3,21 +3,59 @@ FastAPI bridge for Next.js frontend.
 Run locally: uvicorn api_server:app --reload --port 8000
 """
 
+import json
 import os
 import sys
-from typing import Any, Dict, List, Optional
+import uuid
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, Dict, List, Literal, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from agents.kp_agent import get_kp_response  # noqa: E402
-from utils.logging import get_logger, init_logger, log_message  # noqa: E402
+from agents.kp_agent import (  # noqa: E402
+  PREFETCH_NARRATION,
+  ROLL_RESULT_PATTERN,
+  SPECULATE_CHECKS,
+  AutoRoll,
+  aget_kp_response,
+  astream_kp_response,
+  background_compressor,
+  get_kp_graph,
+  speculate_check_outcomes,
+)
+from agents.llm import aclose_http_clients  # noqa: E402
+from agents.sessions import KPSession, SessionStore  # noqa: E402
+from agents.speculation import CheckSpeculation  # noqa: E402
+from utils.logging import (  # noqa: E402
+  bind_request,
+  bind_session,
+  find_logger,
+  get_logger,
+  init_logger,
+  log_message,
+  shutdown_loggers,
+  stop_logger,
+)
+from utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics  # noqa: E402
+from utils.timing import RequestTimings, current_timings, phase, start_request_timings  # noqa: E402
+from utils.tracing import disable_session_tracing, enable_session_tracing  # noqa: E402
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  get_kp_graph()  # Compile once at startup instead of on the first turn
+  yield
+  await aclose_http_clients()
+  shutdown_loggers()  # Drain queued log entries before exit
+
 
-app = FastAPI(title="CoC Solo API")
+app = FastAPI(title="CoC Solo API", lifespan=lifespan)
 
 
 allowed_origins = [
@@ -35,59 +73,388 @@ app.add_middleware(
   allow_credentials=True,
   allow_methods=["*"],
   allow_headers=["*"],
+  expose_headers=["X-Request-ID", "Server-Timing"],
 )
 
 
-class KPRequest(BaseModel):
-  user_input: str
+def _drop_session(session: KPSession) -> None:
+  stop_logger(session.session_id)
+  background_compressor.discard(session.session_id)
+  session.discard_speculation()
+  session.scene_prefetch.discard()
+
+
+session_store = SessionStore(
+  max_sessions=int(os.getenv("KP_MAX_SESSIONS", "1000")),
+  max_history_messages=int(os.getenv("KP_SESSION_MAX_HISTORY", "40")),
+  on_evict=_drop_session,
+)
+
+
+class SessionCreateRequest(BaseModel):
+  character: Dict[str, Any]
+  current_scene: str = "arrival_village"
+  chat_history: List[Dict[str, str]] = []
+  # Opt-in server-side rolling: every check, or only the listed skills ("SAN" for sanity checks)
+  auto_roll: bool = False
+  auto_roll_skills: List[str] = []
+  rng_seed: Optional[int] = None  # Fixed seed for reproducible rolls
+  prompt_mode: Optional[Literal["full", "slim"]] = None  # None: KP_PROMPT_MODE
+  # Narrate the likely outcomes of a requested check while the player rolls (None: KP_SPECULATE_CHECKS)
+  speculate_checks: Optional[bool] = None
+  # Also pre-generate the arrival narration of scenes the player mentions (None: KP_PREFETCH_NARRATION)
+  prefetch_narration: Optional[bool] = None
+
+
+class SessionState(BaseModel):
+  session_id: str
   character: Dict[str, Any]
+  current_scene: str
   chat_history: List[Dict[str, str]]
+  auto_roll: Optional[Dict[str, Any]] = None
+  pending_checks: List[Dict[str, Any]] = []
+  prompt_mode: Optional[str] = None
+  speculate_checks: bool = False
+  prefetch_narration: bool = False
+
+
+class AutoRollRequest(BaseModel):
+  enabled: bool = True  # Roll every check on the server
+  skills: List[str] = []  # Or only these skills ("SAN" for sanity checks)
+  seed: Optional[int] = None
+
+
+class TracingRequest(BaseModel):
+  level: str = "DEBUG"  # DEBUG / INFO / WARNING / ERROR, or OFF to disable
+
+
+class CheckResultModel(BaseModel):
+  request_id: str
+  roll: int = Field(ge=1, le=100)
+
+
+class KPRequest(BaseModel):
+  user_input: str
   api_key: str
+  # With a session_id the server keeps history, summary, character and scene;
+  # without one the client sends the full state every turn (stateless mode).
+  session_id: Optional[str] = None
+  character: Optional[Dict[str, Any]] = None
+  chat_history: List[Dict[str, str]] = []
   current_scene: str = "arrival_village"
+  pending_checks: List[Dict[str, Any]] = []  # Stateless mode: echo the previous result's pending_checks
+  # Rolls for several pending checks at once ({"request_id": ..., "roll": 1-100}); one narration covers them all
+  check_results: List[CheckResultModel] = []
+  # "slim" sends a pruned system prompt (fewer input tokens); overrides the session's mode
+  prompt_mode: Optional[Literal["full", "slim"]] = None
 
 
 class KPResult(BaseModel):
-  response: str
+  response: str  # Narration, or the legacy [DICE_REQUEST:...] / [SAN_CHECK_REQUEST:...] marker
   current_scene: str
   character: Optional[Dict[str, Any]] = None
+  session_id: Optional[str] = None
+  request_id: Optional[str] = None
+  pending_checks: List[Dict[str, Any]] = []  # Structured form of the markers (skill, difficulty, target, ...)
+  pending_check: Optional[Dict[str, Any]] = None  # First of pending_checks
+  usage: Dict[str, int] = {}  # Keeper tokens this turn (prompt, cached, completion)
+  prompt_components: Dict[str, int] = {}  # System prompt tokens per component (static, scene, npcs, ...)
+  # Stateless mode: the summarized history to send back next turn instead of chat_history
+  compressed_history: Optional[List[Dict[str, str]]] = None
 
 
-@app.post("/api/kp/response", response_model=KPResult)
-async def api_kp_response(payload: KPRequest):
-  try:
-    logger = get_logger()
-    if not logger:
-      init_logger(payload.character.get("name", "Investigator"), enable_print_capture=True)
-
-    log_message("user", payload.user_input, payload.current_scene)
-
-    result = get_kp_response(
-      user_input=payload.user_input,
-      character=payload.character,
-      chat_history=payload.chat_history,
-      api_key=payload.api_key,
-      current_scene=payload.current_scene,
-    )
+def _get_session(payload: KPRequest) -> Optional[KPSession]:
+  if not payload.session_id:
+    if payload.character is None:
+      raise HTTPException(status_code=422, detail="character is required when no session_id is given")
+    return None
+
+  session = session_store.get(payload.session_id)
+  if session is None:
+    raise HTTPException(status_code=404, detail="Session not found")
+  return session
+
+
+def _auto_roll(all_checks: bool, skills: List[str], seed: Optional[int]) -> Optional[AutoRoll]:
+  if not all_checks and not skills:
+    return None
+  return AutoRoll(all_checks=all_checks, skills=skills, seed=seed)
+
+
+def _turn_args(payload: KPRequest, session: Optional[KPSession]) -> Dict[str, Any]:
+  """get_kp_response arguments, read from the session when there is one"""
+  if session is not None:
+    return {
+      "user_input": payload.user_input,
+      "character": session.character,
+      "chat_history": session.chat_history(),
+      "api_key": payload.api_key,
+      "current_scene": session.current_scene,
+      "auto_roll": session.auto_roll,
+      "pending_checks": session.pending_checks,
+      "check_results": [result.model_dump() for result in payload.check_results],
+      "compression_key": session.session_id,
+      "prompt_mode": payload.prompt_mode or session.prompt_mode,
+      "speculation": _held_speculation(payload, session),
+      "scene_prefetch": session.scene_prefetch,
+    }
+  return {
+    "user_input": payload.user_input,
+    "character": payload.character,
+    "chat_history": payload.chat_history,
+    "api_key": payload.api_key,
+    "current_scene": payload.current_scene,
+    "pending_checks": payload.pending_checks,
+    "check_results": [result.model_dump() for result in payload.check_results],
+    # No compression_key: nothing identifies a stateless client across turns (players share
+    # character names), so history is compressed inline and handed back as compressed_history
+    "prompt_mode": payload.prompt_mode,
+  }
+
+
+def _held_speculation(payload: KPRequest, session: KPSession) -> Optional[CheckSpeculation]:
+  """
+  The session's speculation for a turn that sends the roll. Any other turn moves
+  the history on, so the continuations no longer fit and are dropped; the emptied
+  speculation stays held so the same check is not speculated on again.
+  """
+  if _carries_roll(payload):
+    return session.take_speculation()
+  if session.speculation is not None:
+    session.speculation.discard()
+  return None
+
+
+def _carries_roll(payload: KPRequest) -> bool:
+  return bool(payload.check_results) or ROLL_RESULT_PATTERN.match(payload.user_input.strip()) is not None
+
+
+def _session_lock(session: Optional[KPSession]):
+  # Turns of one session run one at a time; stateless requests need no lock
+  return session.lock if session is not None else nullcontext()
 
-    new_scene = result.get("current_scene", payload.current_scene)
+
+def _ensure_logger(turn: Dict[str, Any], session: Optional[KPSession], request_id: str) -> None:
+  """
+  Bind this request to its own logger: the session's, or one for the request
+  alone when stateless (players share character names, so nothing else tells
+  stateless clients apart)
+  """
+  bind_session(session.session_id if session is not None else f"request:{request_id}")
+  if not get_logger():
+    init_logger(turn["character"].get("name", "Investigator"))
+
+
+def _release_logger(session: Optional[KPSession]) -> None:
+  """Close a stateless request's logger once its turn is logged"""
+  if session is None:
+    stop_logger()
+
+
+def _start_request(request: Request) -> RequestTimings:
+  """Adopt the caller's X-Request-ID (e.g. from the Next.js proxy) or mint one, and start timing phases"""
+  request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+  bind_request(request_id)
+  return start_request_timings(request_id)
+
+
+def _timing_headers(timings: RequestTimings) -> Dict[str, str]:
+  return {"X-Request-ID": timings.request_id, "Server-Timing": timings.server_timing()}
+
+
+def _to_kp_result(result: Dict[str, Any], turn: Dict[str, Any], session: Optional[KPSession]) -> KPResult:
+  new_scene = result.get("current_scene", turn["current_scene"])
+  with phase("log"):
     log_message("assistant", result["response"], new_scene)
 
-    return KPResult(
-      response=result["response"],
-      current_scene=new_scene,
-      character=result.get("character"),
+  if session is not None:
+    session.record_turn(turn["user_input"], result)
+    _speculate(turn, session)
+
+  timings = current_timings()
+  return KPResult(
+    response=result["response"],
+    current_scene=new_scene,
+    character=result.get("character"),
+    session_id=session.session_id if session is not None else None,
+    request_id=timings.request_id if timings is not None else None,
+    pending_checks=result.get("pending_checks", []),
+    pending_check=result.get("pending_check"),
+    usage=result.get("usage") or {},
+    prompt_components=result.get("prompt_components") or {},
+    compressed_history=result.get("compressed_history") if session is None else None,
+  )
+
+
+def _speculate(turn: Dict[str, Any], session: KPSession) -> None:
+  """
+  Start narrating the outcomes of the session's pending check before the roll
+  arrives (opt-in). Each check is speculated on once: talking instead of rolling
+  drops its continuations (see _held_speculation) without paying for new ones.
+  """
+  held = session.speculation
+  pending = session.pending_checks
+  if held is not None and len(pending) == 1 and held.request_id == pending[0].get("request_id"):
+    return
+  session.discard_speculation()
+  if session.speculate_checks and pending:
+    session.speculation = speculate_check_outcomes(
+      session.character,
+      session.chat_history(),
+      turn["api_key"],
+      session.current_scene,
+      session.pending_checks,
+      prompt_mode=turn["prompt_mode"],
     )
+
+
+def _sse(event: str, data: Any) -> str:
+  return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/sessions", response_model=SessionState)
+async def api_create_session(payload: SessionCreateRequest):
+  session = session_store.create(
+    character=payload.character,
+    current_scene=payload.current_scene,
+    chat_history=payload.chat_history,
+    auto_roll=_auto_roll(payload.auto_roll, payload.auto_roll_skills, payload.rng_seed),
+    prompt_mode=payload.prompt_mode,
+    speculate_checks=SPECULATE_CHECKS if payload.speculate_checks is None else payload.speculate_checks,
+    prefetch_narration=PREFETCH_NARRATION if payload.prefetch_narration is None else payload.prefetch_narration,
+  )
+  return SessionState(**session.to_dict())
+
+
+@app.get("/api/sessions/{session_id}", response_model=SessionState)
+async def api_get_session(session_id: str):
+  session = session_store.get(session_id)
+  if session is None:
+    raise HTTPException(status_code=404, detail="Session not found")
+  return SessionState(**session.to_dict())
+
+
+@app.post("/api/sessions/{session_id}/tracing")
+async def api_session_tracing(session_id: str, payload: TracingRequest):
+  """Turn structured tracing on or off for one session (records go to its log)"""
+  if session_store.get(session_id) is None:
+    raise HTTPException(status_code=404, detail="Session not found")
+  level = payload.level.strip().upper()
+  if level == "OFF":
+    disable_session_tracing(session_id)
+  else:
+    try:
+      enable_session_tracing(session_id, level)
+    except KeyError:
+      raise HTTPException(status_code=422, detail=f"Unknown trace level: {payload.level}")
+  return {"session_id": session_id, "level": level}
+
+
+@app.post("/api/sessions/{session_id}/auto-roll", response_model=SessionState)
+async def api_session_auto_roll(session_id: str, payload: AutoRollRequest):
+  """Switch server-side rolling for one session (a new seed starts a new RNG stream)"""
+  session = session_store.get(session_id)
+  if session is None:
+    raise HTTPException(status_code=404, detail="Session not found")
+  async with session.lock:
+    session.auto_roll = _auto_roll(payload.enabled, payload.skills, payload.seed)
+  return SessionState(**session.to_dict())
+
+
+@app.delete("/api/sessions/{session_id}")
+async def api_delete_session(session_id: str):
+  if not session_store.delete(session_id):
+    raise HTTPException(status_code=404, detail="Session not found")
+  return {"status": "deleted"}
+
+
+@app.post("/api/kp/response", response_model=KPResult)
+async def api_kp_response(payload: KPRequest, request: Request, response: Response):
+  """
+  One Keeper turn. The response carries X-Request-ID (also written to the
+  session log) and a Server-Timing breakdown of the turn's phases.
+  """
+  timings = _start_request(request)
+  try:
+    session = _get_session(payload)
+    async with _session_lock(session):
+      turn = _turn_args(payload, session)
+      _ensure_logger(turn, session, timings.request_id)
+      try:
+        with phase("log"):
+          log_message("user", turn["user_input"], turn["current_scene"])
+
+        result = await aget_kp_response(**turn)
+
+        kp_result = _to_kp_result(result, turn, session)
+      finally:
+        _release_logger(session)
+    response.headers.update(_timing_headers(timings))
+    return kp_result
+  except HTTPException as exc:
+    exc.headers = {**(exc.headers or {}), **_timing_headers(timings)}
+    raise
   except Exception as exc:
-    raise HTTPException(status_code=500, detail=str(exc)) from exc
+    raise HTTPException(status_code=500, detail=str(exc), headers=_timing_headers(timings)) from exc
+
+
+@app.post("/api/kp/stream")
+async def api_kp_stream(payload: KPRequest, request: Request):
+  """
+  Server-Sent Events variant of /api/kp/response.
+
+  Emits `token` events with narration chunks, `dice_request` / `san_request` /
+  `scene_change` events for tool calls, then a `timing` event (headers are
+  sent before the turn runs, so the phase breakdown travels in the body) and
+  finally a `result` event carrying the same KPResult body as
+  /api/kp/response (or an `error` event).
+  """
+  request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+  try:
+    session = _get_session(payload)
+  except HTTPException as exc:
+    exc.headers = {**(exc.headers or {}), "X-Request-ID": request_id}
+    raise
+
+  async def event_stream():
+    # Bound here: the body is produced after the endpoint has returned
+    bind_request(request_id)
+    timings = start_request_timings(request_id)
+    try:
+      async with _session_lock(session):
+        turn = _turn_args(payload, session)
+        _ensure_logger(turn, session, request_id)
+        try:
+          with phase("log"):
+            log_message("user", turn["user_input"], turn["current_scene"])
+
+          async for event in astream_kp_response(**turn):
+            if event["event"] == "result":
+              kp_result = _to_kp_result(event["data"], turn, session)
+              yield _sse("timing", {"request_id": request_id, "server_timing": timings.server_timing()})
+              yield _sse("result", kp_result.model_dump())
+            else:
+              yield _sse(event["event"], event["data"])
+        finally:
+          _release_logger(session)
+    except Exception as exc:
+      yield _sse("error", {"detail": str(exc), "request_id": request_id})
+
+  return StreamingResponse(
+    event_stream(),
+    media_type="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Request-ID": request_id},
+  )
 
 
 @app.get("/api/logs/download")
-async def api_download_log(character: str):
+async def api_download_log(character: str, session_id: Optional[str] = None):
   try:
-    logger = get_logger()
+    logger = get_logger(session_id) if session_id else find_logger(character)
 
     log_file = None
     if logger and logger.log_file:
+      logger.flush()
       log_file = logger.log_file
     else:
       log_dir = os.path.join(os.getcwd(), "logs")
@@ -114,6 +481,12 @@ async def api_download_log(character: str):
     raise HTTPException(status_code=500, detail=str(exc)) from exc
 
 
+@app.get("/api/metrics")
+async def api_metrics():
+  """Prometheus text-format metrics for this process (scrape locally, no collector needed)"""
+  return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/api/health")
 async def api_health():
   return {"status": "ok"}
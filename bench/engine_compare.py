@@ -0,0 +1,153 @@
+"""
+Keeper engines compared on real turns: tool calling (change_scene / roll_dice
+followed by a re-invoke) vs. one structured JSON response per turn.
+Run: python -m bench.engine_compare [--rounds 5] [--json report.json]
+
+Plays the same scripted turns with each engine (KP_ENGINE=tools and
+KP_ENGINE=structured) against the OpenAI API, so it needs OPENAI_API_KEY (or
+--api-key) and spends tokens. Each round is a short session: talk to an NPC,
+ask for a check and roll it, then move to another scene. Reports per turn
+kind the wall-clock time, LLM calls and prompt / completion tokens, and how
+often the Keeper did what the turn asked for (changed scene, asked for a roll).
+With KP_LLM_BACKEND=fake (any key) it runs offline as a dry run of the harness.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.kp_agent import ENGINE_MODES, aget_kp_response, configure_engine  # noqa: E402
+from agents.llm import LLM_CALL_SECONDS, aclose_http_clients  # noqa: E402
+from bench.prompt_report import percentile  # noqa: E402
+
+CHARACTER = {
+  "name": "Benchmark Investigator",
+  "background_story": "A journalist from Boston chasing a story about missing travelers.",
+  "str": 55, "int": 70, "pow": 60, "spot": 65, "listen": 50, "stealth": 40, "charm": 45, "luck": 55, "san": 60,
+}
+
+# (turn kind, player input, what the Keeper should do: "stay" / "check" / a scene ID)
+SESSION = [
+  ("talk", "I ask May what the festival is about.", "stay"),
+  ("check", "I search the bedroom carefully for anything hidden under the floorboards.", "check"),
+  ("roll", None, "stay"),  # The roll for the check, when the Keeper asked for one
+  ("scene_change", "I leave the house and walk up the hill to the ruined church.", "ruined_church"),
+]
+START_SCENE = "leddbetter_house"
+
+
+def _llm_calls() -> int:
+  return sum(LLM_CALL_SECONDS.count(call=call) for call in ("first", "reinvoke"))
+
+
+async def play_round(api_key: str) -> List[Dict[str, Any]]:
+  """One scripted session; a sample per turn"""
+  history: List[Dict[str, str]] = []
+  scene = START_SCENE
+  pending: List[Dict[str, Any]] = []
+  samples = []
+  for kind, text, expected in SESSION:
+    check_results = None
+    if kind == "roll":
+      if not pending:
+        continue
+      text = ""
+      check_results = [{"request_id": check["request_id"], "roll": 30} for check in pending]
+    calls = _llm_calls()
+    start = time.perf_counter()
+    result = await aget_kp_response(
+      text, CHARACTER, history, api_key, scene, pending_checks=pending, check_results=check_results
+    )
+    elapsed = time.perf_counter() - start
+    usage = result.get("usage") or {}
+    pending = result.get("pending_checks") or []
+    if expected == "stay":
+      did_it = result["current_scene"] == scene and not pending
+    elif expected == "check":
+      did_it = bool(pending)
+    else:
+      did_it = result["current_scene"] == expected
+    samples.append({
+      "kind": kind,
+      "seconds": elapsed,
+      "llm_calls": _llm_calls() - calls,
+      "prompt_tokens": usage.get("prompt_tokens", 0),
+      "completion_tokens": usage.get("completion_tokens", 0),
+      "expected": did_it,
+    })
+    history += [{"role": "user", "content": text}, {"role": "assistant", "content": result["response"]}]
+    scene = result["current_scene"]
+  return samples
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+  seconds = [sample["seconds"] for sample in samples]
+  return {
+    "turns": len(samples),
+    "mean_s": statistics.mean(seconds),
+    "p50_s": statistics.median(seconds),
+    "p95_s": percentile(seconds, 0.95),
+    "llm_calls": statistics.mean(sample["llm_calls"] for sample in samples),
+    "prompt_tokens": statistics.mean(sample["prompt_tokens"] for sample in samples),
+    "completion_tokens": statistics.mean(sample["completion_tokens"] for sample in samples),
+    "expected": sum(sample["expected"] for sample in samples) / len(samples),
+  }
+
+
+async def run(engines: List[str], rounds: int, api_key: str) -> Dict[str, Dict[str, Any]]:
+  report: Dict[str, Dict[str, Any]] = {}
+  try:
+    for engine in engines:
+      configure_engine(engine)
+      samples = []
+      for _ in range(rounds):
+        samples.extend(await play_round(api_key))
+      by_kind = defaultdict(list)
+      for sample in samples:
+        by_kind[sample["kind"]].append(sample)
+      report[engine] = {"all": summarize(samples), **{kind: summarize(found) for kind, found in by_kind.items()}}
+  finally:
+    await aclose_http_clients()
+  return report
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--rounds", type=int, default=5)
+  parser.add_argument("--engines", default=",".join(ENGINE_MODES), help="Comma-separated engines to compare")
+  parser.add_argument("--api-key", help="OpenAI API key (default: OPENAI_API_KEY)")
+  parser.add_argument("--json", help="Write the report to this file")
+  args = parser.parse_args()
+
+  api_key: Optional[str] = args.api_key or os.getenv("OPENAI_API_KEY")
+  if not api_key:
+    sys.exit("Set OPENAI_API_KEY or pass --api-key: this benchmark calls the API")
+  engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+
+  report = asyncio.run(run(engines, args.rounds, api_key))
+
+  print(f"{args.rounds} round(s) of {len(SESSION)} scripted turns per engine")
+  print(f"\n{'engine':<11} {'turn':<13} {'n':>3} {'mean s':>7} {'p50 s':>7} {'p95 s':>7} {'calls':>6} {'prompt':>7} {'compl.':>7} {'as asked':>9}")
+  for engine, kinds in report.items():
+    for kind, row in kinds.items():
+      print(
+        f"{engine:<11} {kind:<13} {row['turns']:>3} {row['mean_s']:>7.2f} {row['p50_s']:>7.2f} {row['p95_s']:>7.2f} "
+        f"{row['llm_calls']:>6.2f} {row['prompt_tokens']:>7.0f} {row['completion_tokens']:>7.0f} {row['expected']:>9.0%}"
+      )
+
+  if args.json:
+    with open(args.json, "w", encoding="utf-8") as handle:
+      json.dump({"rounds": args.rounds, "engines": report}, handle, indent=2)
+    print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+  main()
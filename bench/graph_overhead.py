@@ -0,0 +1,72 @@
+"""
+Per-turn setup overhead: rebuilding graph + LLM clients vs. cached graph + client pool.
+Run: python -m bench.graph_overhead [--turns 200]
+
+Runs fully offline: it only constructs clients, it never calls the API. The
+saving on real turns is larger still, because pooled clients also reuse
+keep-alive connections instead of paying a new TCP + TLS handshake.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_openai import ChatOpenAI  # noqa: E402
+
+from agents import llm as llm_pool  # noqa: E402
+from agents.kp_agent import build_kp_graph, change_scene, get_kp_graph, roll_dice, san_check  # noqa: E402
+
+API_KEY = "sk-benchmark-not-a-real-key"
+
+
+def uncached_turn() -> None:
+  """What every turn used to do: compile the graph and build two fresh clients"""
+  build_kp_graph()
+  ChatOpenAI(model="gpt-4o-mini", temperature=0.7, api_key=API_KEY).bind_tools([roll_dice, san_check, change_scene])
+  ChatOpenAI(model="gpt-4o-mini", temperature=0.3, api_key=API_KEY)
+
+
+def cached_turn() -> None:
+  """What a turn does now: singleton graph and pooled clients"""
+  get_kp_graph()
+  llm_pool.get_chat_model(API_KEY, temperature=0.7, tools=[roll_dice, san_check, change_scene])
+  llm_pool.get_chat_model(API_KEY, temperature=0.3)
+
+
+def measure(fn: Callable[[], None], turns: int) -> List[float]:
+  fn()  # Warm-up (imports, first compile, pool fill)
+  samples = []
+  for _ in range(turns):
+    start = time.perf_counter()
+    fn()
+    samples.append((time.perf_counter() - start) * 1000)
+  return samples
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--turns", type=int, default=200)
+  args = parser.parse_args()
+
+  results = {
+    "uncached": measure(uncached_turn, args.turns),
+    "cached": measure(cached_turn, args.turns),
+  }
+
+  print(f"{'mode':<10} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10}")
+  for mode, samples in results.items():
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{mode:<10} {statistics.mean(samples):>10.3f} {statistics.median(samples):>10.3f} {p95:>10.3f}")
+
+  saved = statistics.mean(results["uncached"]) - statistics.mean(results["cached"])
+  print(f"\nSaved per turn: {saved:.3f} ms (excluding connection setup)")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,131 @@
+"""
+Scene-intent classifier against recorded sessions: precision and recall of its
+high-confidence scene changes.
+Run: python -m bench.intent_eval [logs ...] [--errors] [--json report.json]
+
+Replays every player message of the given session logs or directories
+(default: logs/) through agents.intent.classify_scene_intent in the scene the
+Keeper was in, and compares its high-confidence target with the scene of the
+Keeper's reply (the change_scene the LLM made). Roll results are skipped, as
+at runtime; a reply in a scene that is not reachable (a restarted session) is
+not counted.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.intent import classify_scene_intent, intent_outcome  # noqa: E402
+from agents.scenes import get_available_transitions  # noqa: E402
+from bench.prompt_report import log_files  # noqa: E402
+
+_ENTRY = re.compile(
+  r"^## (👤 Player|🎭 Keeper)(?: \*\(Scene: (\w+)\)\*)?(?: \*\(Request: [^)]*\)\*)?\n\n(.*?)(?=\n---\n|\Z)",
+  re.MULTILINE | re.DOTALL,
+)
+_ROLL_RESULT = re.compile(r"^(?:DiceResult|SANResult):", re.IGNORECASE)
+
+# (scene the player was in, player message, scene the Keeper replied in or None)
+Sample = Tuple[str, str, Optional[str]]
+
+
+def read_samples(path: str) -> Tuple[List[Sample], int]:
+  """Labelled player messages of one log, and the number left out"""
+  with open(path, encoding="utf-8") as handle:
+    entries = [(kind, scene, text.strip()) for kind, scene, text in _ENTRY.findall(handle.read())]
+  samples = []
+  skipped = 0
+  scene = "arrival_village"
+  for index, (kind, entry_scene, text) in enumerate(entries):
+    if kind.endswith("Keeper"):
+      scene = entry_scene or scene
+      continue
+    reply = next((entry for entry in entries[index + 1:] if entry[0].endswith("Keeper")), None)
+    if reply is None or _ROLL_RESULT.match(text):
+      continue
+    reply_scene = reply[1] or scene
+    if reply_scene == scene:
+      samples.append((scene, text, None))
+    elif reply_scene in get_available_transitions(scene):
+      samples.append((scene, text, reply_scene))
+    else:
+      skipped += 1
+  return samples, skipped
+
+
+def evaluate(samples: Iterable[Sample]) -> Tuple[Dict[str, dict], List[dict]]:
+  """Per target and overall: tp / fp / fn, precision and recall; plus the misclassified samples"""
+  counts: Dict[str, Counter] = defaultdict(Counter)
+  errors = []
+  for scene, text, actual in samples:
+    intent = classify_scene_intent(scene, text)
+    predicted = intent.target if intent.confidence == "high" else None
+    outcome = intent_outcome(intent, actual)
+    for key in {"all", predicted or actual or "none"}:
+      counts[key][outcome] += 1
+    if outcome in ("fp", "fn"):
+      errors.append({"scene": scene, "text": text, "predicted": predicted, "actual": actual, "intent": intent._asdict()})
+
+  report = {}
+  for key, count in counts.items():
+    tp, fp, fn = count["tp"], count["fp"], count["fn"]
+    report[key] = {
+      **{outcome: count[outcome] for outcome in ("tp", "fp", "fn", "tn")},
+      "precision": tp / (tp + fp) if tp + fp else None,
+      "recall": tp / (tp + fn) if tp + fn else None,
+    }
+  return report, errors
+
+
+def _ratio(value: Optional[float]) -> str:
+  return f"{value:.1%}" if value is not None else "-"
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("paths", nargs="*", default=["logs"])
+  parser.add_argument("--errors", action="store_true", help="List false positives and misses")
+  parser.add_argument("--json", help="Write the report to this file")
+  args = parser.parse_args()
+
+  files = log_files(args.paths)
+  samples: List[Sample] = []
+  skipped = 0
+  for path in files:
+    found, left_out = read_samples(path)
+    samples.extend(found)
+    skipped += left_out
+  if not samples:
+    sys.exit(f"No player messages found in {len(files)} log file(s)")
+
+  report, errors = evaluate(samples)
+  changes = sum(1 for _, _, actual in samples if actual is not None)
+  print(f"{len(samples)} player messages ({changes} scene changes) from {len(files)} log file(s), {skipped} left out")
+  print(f"\n{'target':<18} {'tp':>4} {'fp':>4} {'fn':>4} {'tn':>5} {'precision':>10} {'recall':>8}")
+  for key in ["all"] + sorted(key for key in report if key != "all"):
+    row = report[key]
+    print(
+      f"{key:<18} {row['tp']:>4} {row['fp']:>4} {row['fn']:>4} {row['tn']:>5} "
+      f"{_ratio(row['precision']):>10} {_ratio(row['recall']):>8}"
+    )
+
+  if args.errors:
+    for error in errors:
+      kind = "FP" if error["predicted"] else "FN"
+      print(f"\n[{kind}] {error['scene']} -> {error['actual'] or '(stay)'}: {error['text'][:120]!r}")
+      print(f"     intent: {error['intent']}")
+
+  if args.json:
+    with open(args.json, "w", encoding="utf-8") as handle:
+      json.dump({"samples": len(samples), "skipped": skipped, "targets": report, "errors": errors}, handle, indent=2, ensure_ascii=False)
+    print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,526 @@
+"""
+Load test: N simulated players against api_server.app with the fake LLM backend.
+Run: python -m bench.load [--players 20] [--turns 30] [--mode inprocess|uvicorn] [--json result.json]
+
+Every player creates a session and plays a scripted arc (accept May's offer
+and move in, search the bedroom and roll, walk to the church and face the
+altar's SAN check, visit the village hall), then keeps talking and checking
+until --turns, long enough for background history compression. Rolls are
+answered the way the web client does ("DiceResult: 73:Spot Hidden:normal:65",
+"SANResult: 40:60:2"), or as check_results with --check-results.
+
+The LLM is agents.fake_llm (configure its latency, speed and error rate with
+the options below), so the numbers measure the server: throughput, turn
+latency per kind, event-loop lag, RSS per session and session log volume.
+In-process runs share the event loop with the players; --mode uvicorn serves
+over a local socket from its own thread and loop, and also reports the time
+to the first streamed token with --stream. Session logs go to a temporary
+directory (--log-dir to keep them). --json writes the result; --baseline
+prints the change against an earlier result.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from agents import kp_agent  # noqa: E402
+from agents.fake_llm import latency_sampler  # noqa: E402
+from agents.kp_agent import ENGINE_MODES, configure_engine  # noqa: E402
+from agents.llm import LLM_CALL_SECONDS, configure_backend  # noqa: E402
+from agents.memory import COMPRESSION_JOBS  # noqa: E402
+from bench.prompt_report import percentile  # noqa: E402
+from utils.logging import LOG_BYTES, LOG_WRITE_SECONDS, flush_loggers  # noqa: E402
+
+API_KEY = "sk-load-test-not-a-real-key"
+LAG_PROBE_SECONDS = 0.05
+LLM_CALLS = ("first", "reinvoke", "summary", "speculative", "prefetch")
+LOG_DIR = "logs"  # Session logs, relative to the working directory (see utils.logging.ChatLogger)
+COMPRESSION_RESULTS = ("scheduled", "deduplicated", "skipped_load", "applied", "stale", "failed")
+
+CHARACTER = {
+  "name": "Load Investigator",
+  "background_story": "A folklorist from Arkham collecting harvest customs.",
+  "str": 50, "int": 75, "pow": 60, "spot": 65, "listen": 55, "stealth": 40, "charm": 50, "luck": 50, "san": 60,
+}
+
+# (kind, player input): "scene" turns should move the investigator, "check" / "san"
+# turns should make the Keeper ask for a roll, which the player answers next turn
+ARC = [
+  ("talk", "Hello there. I'm looking for somewhere to stay during the festival."),
+  ("scene", "I accept May's offer and go to her house with her."),
+  ("talk", "I ask May how long she has lived in Emberhead."),
+  ("check", "I search the bedroom carefully for anything hidden under the floorboards."),
+  ("scene", "I leave the house and walk up the hill to the ruined church."),
+  ("san", "I step closer and look at the blood on the altar."),
+  ("scene", "I head back down to the village hall to check the town records."),
+]
+FILLER = [
+  ("talk", "I ask the clerk what the festival is about and who organizes it."),
+  ("talk", "I ask about the travelers who went missing last autumn."),
+  ("check", "I listen at the door to the back room."),
+  ("talk", "I ask whether anyone remembers the fire at the old church."),
+  ("check", "I examine the ledger for names that appear every year."),
+  ("talk", "I thank them and ask what I should see before the festival begins."),
+]
+
+
+def _peak_rss() -> int:
+  scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, KiB elsewhere
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _read_rss() -> int:
+  """Resident set size of this process in bytes (peak RSS where /proc is missing)"""
+  try:
+    with open("/proc/self/statm") as handle:
+      return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError):
+    return _peak_rss()
+
+
+def _dir_bytes(path: str) -> int:
+  return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _server_counters() -> Dict[str, Any]:
+  return {
+    "llm_calls": {call: LLM_CALL_SECONDS.count(call=call) for call in LLM_CALLS},
+    "compression_jobs": {result: int(COMPRESSION_JOBS.value(result=result)) for result in COMPRESSION_RESULTS},
+    "log_chars": int(LOG_BYTES.value()),
+    "log_writes": LOG_WRITE_SECONDS.count(),
+  }
+
+
+def _counter_delta(after: Dict[str, Any], before: Dict[str, Any]) -> Dict[str, Any]:
+  return {
+    key: _counter_delta(value, before[key]) if isinstance(value, dict) else value - before[key]
+    for key, value in after.items()
+  }
+
+
+class LagProbe:
+  """Event-loop lag: how late a periodic sleep wakes up on the loop it runs in"""
+
+  def __init__(self):
+    self.samples: List[float] = []
+    self._task: Optional[asyncio.Task] = None
+
+  def start(self) -> None:
+    self._task = asyncio.ensure_future(self._run())
+
+  async def _run(self) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+      start = loop.time()
+      await asyncio.sleep(LAG_PROBE_SECONDS)
+      self.samples.append(max(0.0, loop.time() - start - LAG_PROBE_SECONDS))
+
+  def stop(self) -> None:
+    if self._task is not None:
+      self._task.cancel()
+
+
+def _roll_reply(check: Dict[str, Any], roll: int) -> str:
+  """The web client's message for a rolled check"""
+  if check["kind"] == "san":
+    return f"SANResult: {roll}:{check['target']}:{check['san_loss']}"
+  return f"DiceResult: {roll}:{check['skill']}:{check['difficulty']}:{check['target']}"
+
+
+class Player:
+  """One simulated player: a session and a script, played turn by turn"""
+
+  def __init__(self, index: int, args: argparse.Namespace):
+    self.index = index
+    self.args = args
+    self.rng = random.Random(args.seed * 100003 + index)
+    self.think = latency_sampler(args.think)
+    self.session_id: Optional[str] = None
+    self.samples: List[Dict[str, Any]] = []
+    self.errors: List[str] = []
+
+  def script(self) -> List[Tuple[str, str]]:
+    filler = FILLER[self.index % len(FILLER):] + FILLER[:self.index % len(FILLER)]
+    return ARC + [filler[turn % len(filler)] for turn in range(max(0, self.args.turns - len(ARC)))]
+
+  async def play(self, client: httpx.AsyncClient) -> None:
+    response = await client.post("/api/sessions", json={
+      "character": {**CHARACTER, "name": f"{CHARACTER['name']} {self.index}"},
+      "current_scene": "arrival_village",
+    })
+    response.raise_for_status()
+    self.session_id = response.json()["session_id"]
+
+    pending: List[Dict[str, Any]] = []
+    turns = 0
+    for kind, text in self.script():
+      if turns >= self.args.turns:
+        break
+      if pending:
+        # Answer the Keeper's roll request before going on with the script
+        body = self._roll_body(pending)
+        pending = await self._turn(client, "roll", body)
+        turns += 1
+        if turns >= self.args.turns:
+          break
+      pending = await self._turn(client, kind, {"user_input": text})
+      turns += 1
+
+  def _roll_body(self, pending: List[Dict[str, Any]]) -> Dict[str, Any]:
+    rolls = [(check, self.rng.randint(1, 100)) for check in pending]
+    if self.args.check_results:
+      return {"user_input": "", "check_results": [{"request_id": check["request_id"], "roll": roll} for check, roll in rolls]}
+    # Like the web client: one message per turn, for the first pending check
+    check, roll = rolls[0]
+    return {"user_input": _roll_reply(check, roll)}
+
+  async def _turn(self, client: httpx.AsyncClient, kind: str, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    await asyncio.sleep(self.think(self.rng))
+    payload = {"api_key": API_KEY, "session_id": self.session_id, **body}
+    start = time.perf_counter()
+    first_token: Optional[float] = None
+    try:
+      if self.args.stream:
+        result, first_token = await self._stream(client, payload, start)
+      else:
+        response = await client.post("/api/kp/response", json=payload)
+        response.raise_for_status()
+        result = response.json()
+    except (httpx.HTTPError, RuntimeError) as exc:
+      self.errors.append(f"{kind}: {exc}")
+      self.samples.append({"kind": kind, "seconds": time.perf_counter() - start, "ok": False})
+      return []
+    self.samples.append({
+      "kind": kind,
+      "seconds": time.perf_counter() - start,
+      "first_token": first_token,
+      "ok": True,
+      "scene": result["current_scene"],
+      "asked": bool(result.get("pending_checks")),
+    })
+    return result.get("pending_checks") or []
+
+  async def _stream(
+    self, client: httpx.AsyncClient, payload: Dict[str, Any], start: float
+  ) -> Tuple[Dict[str, Any], Optional[float]]:
+    first_token = None
+    event = None
+    async with client.stream("POST", "/api/kp/stream", json=payload) as response:
+      response.raise_for_status()
+      async for line in response.aiter_lines():
+        if line.startswith("event: "):
+          event = line[len("event: "):]
+          if event == "token" and first_token is None:
+            first_token = time.perf_counter() - start
+        elif line.startswith("data: ") and event in ("result", "error"):
+          data = json.loads(line[len("data: "):])
+          if event == "error":
+            raise RuntimeError(data.get("detail", "stream error"))
+          return data, first_token
+    raise RuntimeError("stream ended without a result")
+
+
+async def _play_all(
+  client: httpx.AsyncClient, players: List[Player], args: argparse.Namespace, probe: LagProbe
+) -> Dict[str, Any]:
+  """Warm up with one short session, then play every player; RSS and counters around the run"""
+  warmup = Player(len(players), argparse.Namespace(**{**vars(args), "turns": len(ARC), "think": "fixed:0"}))
+  await warmup.play(client)
+  await client.delete(f"/api/sessions/{warmup.session_id}")
+  flush_loggers()
+  before = {"rss": _read_rss(), "counters": _server_counters(), "log_bytes": _dir_bytes(LOG_DIR)}
+
+  async def start(player: Player) -> None:
+    await asyncio.sleep(args.ramp * player.index / max(1, len(players)))
+    try:
+      await player.play(client)
+    except httpx.HTTPError as exc:
+      player.errors.append(f"session: {exc}")
+
+  probe.samples.clear()
+  start_time = time.perf_counter()
+  await asyncio.gather(*(start(player) for player in players))
+  elapsed = time.perf_counter() - start_time
+  lag = list(probe.samples)
+  rss_after = _read_rss()  # Sessions still open
+  for player in players:
+    if player.session_id:
+      await client.delete(f"/api/sessions/{player.session_id}")
+  return {"elapsed": elapsed, "lag": lag, "before": before, "rss_after": rss_after}
+
+
+async def _run_inprocess(app, players: List[Player], args: argparse.Namespace) -> Dict[str, Any]:
+  probe = LagProbe()
+  async with app.router.lifespan_context(app):
+    # The ASGI transport buffers response bodies, so streamed turns report no first-token time here
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=args.timeout) as client:
+      probe.start()
+      try:
+        run = await _play_all(client, players, args, probe)
+      finally:
+        probe.stop()
+  for sample in (sample for player in players for sample in player.samples):
+    sample["first_token"] = None
+  return run
+
+
+def _run_uvicorn(app, players: List[Player], args: argparse.Namespace) -> Dict[str, Any]:
+  import uvicorn
+
+  server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="on"))
+  probe = LagProbe()
+
+  async def serve() -> None:
+    probe.start()  # On the server's own loop: the lag of request handling alone
+    try:
+      await server.serve()
+    finally:
+      probe.stop()
+
+  thread = threading.Thread(target=lambda: asyncio.run(serve()), name="load-uvicorn", daemon=True)
+  thread.start()
+  deadline = time.monotonic() + 30
+  while not server.started:
+    if not thread.is_alive() or time.monotonic() > deadline:
+      sys.exit(f"uvicorn did not start on port {args.port}")
+    time.sleep(0.05)
+
+  async def drive() -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=len(players) + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout, limits=limits) as client:
+      return await _play_all(client, players, args, probe)
+
+  try:
+    return asyncio.run(drive())
+  finally:
+    server.should_exit = True
+    thread.join(timeout=30)
+
+
+def _latency(samples: List[float]) -> Dict[str, Optional[float]]:
+  if not samples:
+    return {"n": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+  return {
+    "n": len(samples),
+    "mean": statistics.mean(samples),
+    "p50": percentile(samples, 0.50),
+    "p95": percentile(samples, 0.95),
+    "p99": percentile(samples, 0.99),
+    "max": max(samples),
+  }
+
+
+def summarize(players: List[Player], run: Dict[str, Any]) -> Dict[str, Any]:
+  """The result of a run; server counters and log bytes are read after shutdown (logs drained)"""
+  elapsed = run["elapsed"]
+  before = run["before"]
+  log_bytes = _dir_bytes(LOG_DIR) - before["log_bytes"]
+  samples = [sample for player in players for sample in player.samples]
+  ok = [sample for sample in samples if sample["ok"]]
+  by_kind = defaultdict(list)
+  for sample in ok:
+    by_kind[sample["kind"]].append(sample["seconds"])
+  first_tokens = [sample["first_token"] for sample in ok if sample.get("first_token") is not None]
+  sessions = sum(1 for player in players if player.session_id)
+  return {
+    "players": len(players),
+    "sessions": sessions,
+    "turns": len(samples),
+    "errors": len(samples) - len(ok) + sum(1 for player in players if not player.session_id),
+    "elapsed_s": elapsed,
+    "throughput_turns_per_s": len(ok) / elapsed if elapsed else 0.0,
+    "latency_s": _latency([sample["seconds"] for sample in ok]),
+    "latency_by_kind_s": {kind: _latency(found) for kind, found in sorted(by_kind.items())},
+    "first_token_s": _latency(first_tokens),
+    # Script turns that did what they were written for: moved scene / got a roll request
+    "checks_asked": sum(1 for sample in ok if sample["kind"] in ("check", "san") and sample["asked"]),
+    "checks_scripted": sum(1 for sample in ok if sample["kind"] in ("check", "san")),
+    "final_scenes": dict(sorted(_count(
+      player.samples[-1]["scene"] for player in players if player.samples and player.samples[-1]["ok"]
+    ).items())),
+    "event_loop_lag_s": _latency(run["lag"]),
+    "rss_bytes": {"before": before["rss"], "after": run["rss_after"], "peak": _peak_rss()},
+    "rss_per_session_bytes": (run["rss_after"] - before["rss"]) / sessions if sessions else None,
+    "log_bytes": log_bytes,
+    "log_bytes_per_turn": log_bytes / len(ok) if ok else None,
+    "server": _counter_delta(_server_counters(), before["counters"]),
+    "error_samples": [error for player in players for error in player.errors][:20],
+  }
+
+
+def _count(values) -> Dict[str, int]:
+  counts: Dict[str, int] = defaultdict(int)
+  for value in values:
+    counts[value] += 1
+  return counts
+
+
+# (label, path into the result) compared against --baseline; lower is better except throughput
+HEADLINE = [
+  ("throughput turns/s", ("throughput_turns_per_s",)),
+  ("turn p50 s", ("latency_s", "p50")),
+  ("turn p95 s", ("latency_s", "p95")),
+  ("turn p99 s", ("latency_s", "p99")),
+  ("loop lag p99 s", ("event_loop_lag_s", "p99")),
+  ("RSS / session KiB", ("rss_per_session_bytes",)),
+  ("log bytes / turn", ("log_bytes_per_turn",)),
+  ("errors", ("errors",)),
+]
+
+
+def _lookup(result: Dict[str, Any], path: Tuple[str, ...]) -> Optional[float]:
+  value: Any = result
+  for key in path:
+    value = value.get(key) if isinstance(value, dict) else None
+  if value is not None and path == ("rss_per_session_bytes",):
+    return value / 1024
+  return value
+
+
+def _fmt(value: Optional[float]) -> str:
+  return "-" if value is None else f"{value:.3f}" if abs(value) < 100 else f"{value:.0f}"
+
+
+def print_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+  config = result["config"]
+  print(
+    f"{result['players']} players x {config['turns']} turns ({config['mode']}, {config['engine']} engine"
+    f"{', streamed' if config['stream'] else ''}): {result['turns']} turns in {result['elapsed_s']:.1f} s, "
+    f"{result['errors']} error(s)"
+  )
+  print(f"\n{'turn':<8} {'n':>5} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8}")
+  rows = [("all", result["latency_s"])] + list(result["latency_by_kind_s"].items())
+  if result["first_token_s"]["n"]:
+    rows.append(("1st tok", result["first_token_s"]))
+  rows.append(("loop lag", result["event_loop_lag_s"]))
+  for kind, row in rows:
+    print(f"{kind:<8} {row['n']:>5} " + " ".join(f"{_fmt(row[key]):>8}" for key in ("mean", "p50", "p95", "p99", "max")))
+
+  server = result["server"]
+  print(f"\nRolls asked on {result['checks_asked']}/{result['checks_scripted']} check turns; final scenes {result['final_scenes']}")
+  print(f"LLM calls {server['llm_calls']}")
+  print(f"Compression jobs {server['compression_jobs']}")
+  print(
+    f"RSS {result['rss_bytes']['before'] / 2**20:.1f} -> {result['rss_bytes']['after'] / 2**20:.1f} MiB "
+    f"(peak {result['rss_bytes']['peak'] / 2**20:.1f}); logs {result['log_bytes'] / 1024:.1f} KiB "
+    f"in {server['log_writes']} writes"
+  )
+  for error in result["error_samples"][:5]:
+    print(f"  error: {error}")
+
+  if baseline is not None:
+    print(f"\n{'vs. baseline':<20} {'before':>10} {'after':>10} {'change':>8}")
+    for label, path in HEADLINE:
+      old, new = _lookup(baseline, path), _lookup(result, path)
+      change = f"{(new - old) / old:+.1%}" if old and new is not None else "-"
+      print(f"{label:<20} {_fmt(old):>10} {_fmt(new):>10} {change:>8}")
+
+
+def _git_commit() -> Optional[str]:
+  try:
+    return subprocess.run(
+      ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+      cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--players", type=int, default=20, help="Concurrent simulated players (one session each)")
+  parser.add_argument("--turns", type=int, default=30, help="Turns per player, rolls included")
+  parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+  parser.add_argument("--port", type=int, default=8765, help="uvicorn mode")
+  parser.add_argument("--stream", action="store_true", help="Play turns over /api/kp/stream instead of /api/kp/response")
+  parser.add_argument("--check-results", action="store_true", help="Send rolls as check_results instead of DiceResult messages")
+  parser.add_argument("--engine", choices=ENGINE_MODES, default=None, help="Keeper engine (default: KP_ENGINE)")
+  parser.add_argument("--think", default="uniform:100:500", help="Player pause before each turn (a latency distribution)")
+  parser.add_argument("--ramp", type=float, default=2.0, help="Seconds over which players join")
+  parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+  parser.add_argument("--latency", default="lognormal:400:0.5", help="Fake LLM time to first token, e.g. fixed:200")
+  parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Fake LLM completion speed (0: instant)")
+  parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake LLM calls that fail")
+  # Long enough replies that a full history passes the compression budget within a session
+  parser.add_argument("--narration-tokens", type=int, default=150, help="Length of the fake Keeper's narration")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--log-dir", help="Keep session logs under this directory (default: a temporary one)")
+  parser.add_argument("--json", help="Write the result to this file")
+  parser.add_argument("--baseline", help="Compare with the result file of an earlier run")
+  args = parser.parse_args()
+
+  latency_sampler(args.think)  # Fail early on a bad distribution
+  json_path = os.path.abspath(args.json) if args.json else None
+  baseline = None
+  if args.baseline:
+    with open(args.baseline, encoding="utf-8") as handle:
+      baseline = json.load(handle)
+
+  configure_backend(
+    "fake",
+    latency=args.latency,
+    tokens_per_second=args.tokens_per_second,
+    error_rate=args.error_rate,
+    narration_tokens=args.narration_tokens,
+    seed=args.seed,
+  )
+  if args.engine:
+    configure_engine(args.engine)
+
+  # Session logs go to ./logs: run from the log directory so the repository's logs/ stays clean
+  log_root = os.path.abspath(args.log_dir) if args.log_dir else tempfile.mkdtemp(prefix="kp-load-")
+  os.makedirs(log_root, exist_ok=True)
+  cwd = os.getcwd()
+  os.chdir(log_root)
+  try:
+    from api_server import app
+
+    players = [Player(index, args) for index in range(args.players)]
+    if args.mode == "uvicorn":
+      run = _run_uvicorn(app, players, args)
+    else:
+      run = asyncio.run(_run_inprocess(app, players, args))
+    result = summarize(players, run)
+  finally:
+    os.chdir(cwd)
+    if not args.log_dir:
+      shutil.rmtree(log_root, ignore_errors=True)
+
+  result = {
+    "config": {
+      **{key: value for key, value in vars(args).items() if key not in ("json", "baseline", "log_dir")},
+      "engine": kp_agent.ENGINE_MODE,
+      "commit": _git_commit(),
+      "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("KP_")},
+    },
+    **result,
+  }
+  print_result(result, baseline)
+
+  if json_path:
+    with open(json_path, "w", encoding="utf-8") as handle:
+      json.dump(result, handle, indent=2)
+    print(f"\nResult written to {json_path}")
+  if args.log_dir:
+    print(f"Session logs in {os.path.join(log_root, LOG_DIR)}")
+
+
+if __name__ == "__main__":
+  main()
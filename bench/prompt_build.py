@@ -0,0 +1,129 @@
+"""
+Per-turn system prompt assembly: rendering every fragment vs. cached fragments,
+and the size of full vs. slim prompts.
+Run: python -m bench.prompt_build [--turns 2000]
+
+Replays a session that walks through every scene (with a change_scene, so two
+prompt builds, every 10th turn), loses SAN every 25th turn and talks to one of
+the scene's NPCs every other turn. "uncached" drops all rendered fragments
+before each build, which is what every turn used to do; "cached" reuses the
+per-scene head and the memoized character tail; "slim" is the cached build in
+slim prompt mode. Runs fully offline.
+"""
+
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.kp_agent import PROMPT_MODES, _build_system_message, clear_prompt_cache  # noqa: E402
+from agents.scenes import SCENES  # noqa: E402
+
+CHARACTER = {
+  "name": "Benchmark Investigator",
+  "background_story": "A journalist from Boston chasing a story about missing travelers.",
+  "str": 55, "int": 70, "pow": 60, "spot": 65, "listen": 50, "stealth": 40, "charm": 45, "luck": 55, "san": 60,
+}
+
+
+Turn = Tuple[List[str], dict, List[BaseMessage]]
+
+
+def session(turns: int) -> Iterator[Turn]:
+  """(scenes built this turn, character, recent messages) for each turn of the replayed session"""
+  scenes = list(SCENES)
+  character = dict(CHARACTER)
+  messages: List[BaseMessage] = []
+  index = 0
+  for turn in range(1, turns + 1):
+    if turn % 25 == 0:
+      character = {**character, "san": max(0, character["san"] - 1)}
+    npcs = SCENES[scenes[index]].get("npcs", [])
+    if turn % 2 and npcs:
+      player = f"I ask {npcs[turn // 2 % len(npcs)]['name'].split('/')[0]} about the festival."
+    else:
+      player = "I look around carefully."
+    messages = (messages + [HumanMessage(content=player)])[-6:]
+    built = [scenes[index]]
+    if turn % 10 == 0:
+      index = (index + 1) % len(scenes)
+      built.append(scenes[index])  # Rebuilt after a successful change_scene
+    yield built, character, messages
+    messages = messages + [AIMessage(content="The Keeper narrates what happens.")]
+
+
+def uncached_turn(built: List[str], character: dict, messages: List[BaseMessage]) -> Dict[str, int]:
+  for scene in built:
+    clear_prompt_cache()
+    _, components = _build_system_message(character, scene, "full", messages)
+  return components
+
+
+def cached_turn(built: List[str], character: dict, messages: List[BaseMessage]) -> Dict[str, int]:
+  for scene in built:
+    _, components = _build_system_message(character, scene, "full", messages)
+  return components
+
+
+def slim_turn(built: List[str], character: dict, messages: List[BaseMessage]) -> Dict[str, int]:
+  for scene in built:
+    _, components = _build_system_message(character, scene, "slim", messages)
+  return components
+
+
+def measure(fn: Callable[..., Dict[str, int]], turns: int) -> Tuple[List[float], List[Dict[str, int]]]:
+  """Build time (us) and system prompt tokens per component of each turn"""
+  clear_prompt_cache()
+  samples = []
+  sizes = []
+  gc.disable()  # As timeit does: collector pauses would swamp microsecond timings
+  try:
+    for built, character, messages in session(turns):
+      start = time.perf_counter()
+      components = fn(built, character, messages)
+      samples.append((time.perf_counter() - start) * 1_000_000)
+      sizes.append(components)
+  finally:
+    gc.enable()
+  return samples, sizes
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--turns", type=int, default=2000)
+  args = parser.parse_args()
+
+  measure(cached_turn, 100)  # Warm-up (imports, metrics registry)
+  results = {
+    "uncached": measure(uncached_turn, args.turns),
+    "cached": measure(cached_turn, args.turns),
+    "slim": measure(slim_turn, args.turns),
+  }
+
+  print(f"{'mode':<10} {'mean us':>10} {'p50 us':>10} {'p95 us':>10} {'tokens':>10}")
+  for mode, (samples, sizes) in results.items():
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    tokens = statistics.mean(sum(size.values()) for size in sizes)
+    print(f"{mode:<10} {statistics.mean(samples):>10.1f} {statistics.median(samples):>10.1f} {p95:>10.1f} {tokens:>10.0f}")
+
+  saved = statistics.mean(results["uncached"][0]) - statistics.mean(results["cached"][0])
+  print(f"\nSaved per turn: {saved:.1f} us ({len(SCENES)} scenes, change_scene every 10 turns)")
+
+  print(f"\n{'component':<16}" + "".join(f"{mode:>10}" for mode in PROMPT_MODES))
+  per_mode = {mode: results["cached" if mode == "full" else mode][1] for mode in PROMPT_MODES}
+  names = list(dict.fromkeys(name for sizes in per_mode.values() for size in sizes for name in size))
+  for name in names:
+    row = "".join(f"{statistics.mean(size.get(name, 0) for size in per_mode[mode]):>10.0f}" for mode in PROMPT_MODES)
+    print(f"{name:<16}{row}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,122 @@
+"""
+Prompt size report: where the Keeper's input tokens go, aggregated over session logs.
+Run: python -m bench.prompt_report [logs ...] [--by call|mode|scene] [--json report.json]
+
+Reads the "Prompt Profile" entries that sessions write to their markdown logs
+when KP_PROMPT_PROFILE=1 (one per Keeper LLM call, counted with the local
+tokenizer, see agents.profiler) from the given log files or directories
+(default: logs/).
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.profiler import PROFILE_PARTS  # noqa: E402
+
+_PROFILE_ENTRY = re.compile(r"^### 📏 Prompt Profile: [^\n]*\n\n```json\n(.*?)\n```", re.MULTILINE | re.DOTALL)
+
+
+def log_files(paths: Iterable[str]) -> List[str]:
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      files.extend(sorted(glob.glob(os.path.join(path, "*.md"))))
+    else:
+      files.append(path)
+  return files
+
+
+def read_profiles(path: str) -> List[dict]:
+  with open(path, encoding="utf-8") as handle:
+    text = handle.read()
+  profiles = []
+  for match in _PROFILE_ENTRY.finditer(text):
+    try:
+      profiles.append(json.loads(match.group(1)))
+    except json.JSONDecodeError:
+      continue  # Entry cut off by a crash mid-write
+  return profiles
+
+
+def percentile(samples: List[int], q: float) -> float:
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def summarize(profiles: List[dict]) -> Dict[str, dict]:
+  """Per part: mean / p50 / p95 tokens per call and share of all prompt tokens"""
+  grand_total = sum(profile["total"] for profile in profiles) or 1
+  summary = {}
+  for part in PROFILE_PARTS + ("total",):
+    samples = [profile["parts"].get(part, 0) if part != "total" else profile["total"] for profile in profiles]
+    summary[part] = {
+      "mean": statistics.mean(samples),
+      "p50": statistics.median(samples),
+      "p95": percentile(samples, 0.95),
+      "share": sum(samples) / grand_total,
+    }
+  reported = [profile["reported_prompt_tokens"] for profile in profiles if profile.get("reported_prompt_tokens")]
+  if reported:
+    summary["total"]["reported_mean"] = statistics.mean(reported)
+  return summary
+
+
+def print_table(title: str, profiles: List[dict]) -> None:
+  summary = summarize(profiles)
+  print(f"\n{title} ({len(profiles)} calls)")
+  print(f"{'part':<16} {'mean':>8} {'p50':>8} {'p95':>8} {'share':>8}")
+  for part, row in summary.items():
+    print(f"{part:<16} {row['mean']:>8.0f} {row['p50']:>8.0f} {row['p95']:>8.0f} {row['share']:>7.1%}")
+  if "reported_mean" in summary["total"]:
+    print(f"{'(provider)':<16} {summary['total']['reported_mean']:>8.0f}")
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("paths", nargs="*", default=["logs"])
+  parser.add_argument("--by", choices=["call", "mode", "scene"], help="Also break the report down by this field")
+  parser.add_argument("--json", help="Write the aggregated report to this file")
+  args = parser.parse_args()
+
+  files = log_files(args.paths)
+  sessions = {path: read_profiles(path) for path in files}
+  profiles = [profile for found in sessions.values() for profile in found]
+  if not profiles:
+    sys.exit(f"No prompt profiles found in {len(files)} log file(s); run the server with KP_PROMPT_PROFILE=1")
+
+  profiled_sessions = sum(1 for found in sessions.values() if found)
+  print(f"{len(profiles)} Keeper LLM calls from {profiled_sessions} session(s)")
+  print_table("All calls", profiles)
+
+  groups: Dict[str, List[dict]] = defaultdict(list)
+  if args.by:
+    for profile in profiles:
+      groups[str(profile.get(args.by))].append(profile)
+    for value, grouped in sorted(groups.items()):
+      print_table(f"{args.by} = {value}", grouped)
+
+  if args.json:
+    report = {
+      "sessions": profiled_sessions,
+      "calls": len(profiles),
+      "parts": summarize(profiles),
+    }
+    if args.by:
+      report["by"] = args.by
+      report["groups"] = {value: summarize(grouped) for value, grouped in groups.items()}
+    with open(args.json, "w", encoding="utf-8") as handle:
+      json.dump(report, handle, indent=2)
+    print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+  main()
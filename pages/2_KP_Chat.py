@@ -10,7 +10,7 @@ initialize_session_state()
 character = st.session_state.get("character")
 if character and not st.session_state.get("_logger_initialized", False):
 	character_name = character.get("name", "Unknown")
-	init_logger(character_name, enable_print_capture=True)
+	init_logger(character_name, enable_tracing=True)
 	st.session_state["_logger_initialized"] = True
 	st.session_state["_log_file"] = get_logger().log_file if get_logger() else None
 
@@ -115,12 +115,14 @@ with st.sidebar:
 		st.session_state["messages"] = []
 		# Reset scene to arrival
 		st.session_state["current_scene"] = "arrival_village"
+		# Drop checks the old conversation was waiting on
+		st.session_state["pending_checks"] = []
 		# Restart logger
 		character = st.session_state.get("character")
 		if character:
 			stop_logger()
 			character_name = character.get("name", "Unknown")
-			init_logger(character_name, enable_print_capture=True)
+			init_logger(character_name, enable_tracing=True)
 			st.session_state["_log_file"] = get_logger().log_file if get_logger() else None
 		st.success("Conversation restarted!")
 		st.rerun()
@@ -205,10 +207,12 @@ if user_text:
 					character=character,
 					chat_history=st.session_state["messages"][:-1],  # Exclude current message
 					api_key=api_key,
-					current_scene=current_scene
+					current_scene=current_scene,
+					pending_checks=st.session_state.get("pending_checks")
 				)
 				
 				kp_reply = result["response"]
+				st.session_state["pending_checks"] = result.get("pending_checks")
 				new_scene = result.get("current_scene", current_scene)
 				updated_character = result.get("character", character)
 				
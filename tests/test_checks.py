@@ -0,0 +1,40 @@
+"""Check markers in the Keeper's response (legacy clients read the rolls from them)"""
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agents.kp_agent import _build_kp_result, _checks_from_markers, _dice_check
+
+
+def _listen_check():
+	return _dice_check("call_2", "Listen", "normal", 50, "[DICE_REQUEST:Listen:normal:50]")
+
+
+def _result(**state):
+	return {
+		"messages": [HumanMessage(content="DiceResult: 30"), AIMessage(content="You find a note. Something creaks upstairs.")],
+		"current_scene": "leddbetter_house",
+		"pending_checks": [],
+		"check_requested": False,
+		**state,
+	}
+
+
+def test_requested_check_is_returned_as_marker():
+	result = _build_kp_result(
+		_result(check_requested=True, pending_checks=[_listen_check()]), {"name": "A"}, "leddbetter_house", [], []
+	)
+	assert result["response"] == "[DICE_REQUEST:Listen:normal:50]"
+
+
+def test_resolve_then_request_returns_result_narration_and_marker():
+	result = _build_kp_result(
+		_result(pending_dice_result="Spot Hidden: 30 (Success)", check_requested=True, pending_checks=[_listen_check()]),
+		{"name": "A"}, "leddbetter_house", [], [],
+	)
+	assert result["response"].startswith("Spot Hidden: 30 (Success)\n---\n\nYou find a note.")
+	assert [check["skill"] for check in _checks_from_markers(result["response"])] == ["Listen"]
+	assert result["pending_checks"] == [_listen_check()]
+
+
+def test_resolved_check_without_new_request_has_no_marker():
+	result = _build_kp_result(_result(pending_dice_result="Spot Hidden: 30 (Success)"), {"name": "A"}, "leddbetter_house", [], [])
+	assert "[DICE_REQUEST" not in result["response"]
@@ -0,0 +1,51 @@
+"""classify_scene_intent: movement cues against negative cues"""
+import pytest
+
+from agents.intent import classify_scene_intent, intent_outcome
+
+
+@pytest.mark.parametrize("scene, text, target", [
+	("leddbetter_house", "I go to the ruined church", "ruined_church"),
+	("leddbetter_house", "I head to the village hall.", "village_hall"),
+	("village_hall", "I walk back to May's house", "leddbetter_house"),
+	("leddbetter_house", "我去市政厅", "village_hall"),
+])
+def test_movement_cue_to_place_name_is_high_confidence(scene, text, target):
+	intent = classify_scene_intent(scene, text)
+	assert (intent.target, intent.confidence) == (target, "high")
+
+
+@pytest.mark.parametrize("scene, text", [
+	("leddbetter_house", "I walk down the hall to my bedroom"),
+	("leddbetter_house", "I go to the office upstairs"),
+	("village_hall", "May I go with you"),
+	("village_hall", "I go outside and head home"),
+	("leddbetter_house", "I follow the priest"),
+	("leddbetter_house", "I go to the church"),
+])
+def test_generic_word_or_npc_is_not_high_confidence(scene, text):
+	intent = classify_scene_intent(scene, text)
+	assert intent.confidence != "high"
+	assert intent_outcome(intent, None) == "tn"
+
+
+@pytest.mark.parametrize("text", [
+	"I look at the church from afar",
+	"Should I go to the church?",
+	"I dream about the church",
+	"I ask May about the church",
+	"我远远望向教堂",
+])
+def test_negative_cue_is_low_confidence(text):
+	intent = classify_scene_intent("leddbetter_house", text)
+	assert intent.confidence == "low"
+	assert intent_outcome(intent, None) == "tn"
+
+
+def test_several_scenes_is_low_confidence():
+	intent = classify_scene_intent("leddbetter_house", "I go to the village hall and then the church")
+	assert intent.confidence == "low"
+
+
+def test_unreachable_scene_is_no_intent():
+	assert classify_scene_intent("arrival_village", "I go to the ruined church").confidence == "none"
@@ -0,0 +1,103 @@
+"""History compression: the token-budgeted split, and BackgroundCompressor applying finished jobs and dropping stale ones"""
+import asyncio
+
+from agents import memory
+from agents.memory import SUMMARY_PREFIX, BackgroundCompressor, acompress_chat_history, compressible, fold_into_summary
+
+
+def _history(n):
+	return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(n)]
+
+
+async def _summarize(history):
+	return [{"role": "assistant", "content": "summary"}] + history[-2:]
+
+
+async def _finished(compressor, key, history):
+	assert compressor.schedule(key, history, _summarize)
+	await asyncio.sleep(0)
+	return compressor
+
+
+def test_take_result_applies_compressed_snapshot_and_newer_messages():
+	async def run():
+		history = _history(8)
+		compressor = await _finished(BackgroundCompressor(), "s", history)
+		newer = history + [{"role": "user", "content": "new"}]
+		return compressor.take_result("s", newer)
+
+	result = asyncio.run(run())
+	assert [msg["content"] for msg in result] == ["summary", "message 6", "message 7", "new"]
+
+
+def test_take_result_drops_stale_snapshot():
+	async def run():
+		compressor = await _finished(BackgroundCompressor(), "s", _history(8))
+		# History replaced meanwhile (client reset): the snapshot is no longer its prefix
+		replaced = [{"role": "user", "content": "fresh start"}]
+		return compressor.take_result("s", replaced), compressor.take_result("s", replaced)
+
+	assert asyncio.run(run()) == (None, None)
+
+
+def test_take_result_drops_unchanged_history():
+	async def keep(history):
+		return list(history)
+
+	async def run():
+		compressor = BackgroundCompressor()
+		history = _history(4)
+		compressor.schedule("s", history, keep)
+		await asyncio.sleep(0)
+		return compressor.take_result("s", history)
+
+	assert asyncio.run(run()) is None
+
+
+def test_schedule_deduplicates_per_key():
+	async def run():
+		compressor = BackgroundCompressor()
+		first = compressor.schedule("s", _history(8), _summarize)
+		second = compressor.schedule("s", _history(8), _summarize)
+		other = compressor.schedule("t", _history(8), _summarize)
+		compressor.discard("s")
+		compressor.discard("t")
+		return first, second, other
+
+	assert asyncio.run(run()) == (True, False, True)
+
+
+class _FakeSummarizer:
+	def __init__(self):
+		self.prompts = []
+
+	async def ainvoke(self, prompt):
+		self.prompts.append(prompt)
+		return type("Reply", (), {"content": "- The investigator arrived.", "response_metadata": {}, "usage_metadata": None})()
+
+
+def _oversized_summary_history():
+	# Messages folded in verbatim (sessions over their cap) leave a summary bigger than the budget
+	summary = fold_into_summary(None, _history(40))
+	return [{"role": "assistant", "content": summary}] + _history(2)
+
+
+def test_oversized_summary_is_compressible_without_aged_out_messages():
+	history = _oversized_summary_history()
+	assert compressible(history, "sk", min_messages_before_compress=6, keep_recent_messages=6, token_budget=200)
+	assert not compressible(_history(2), "sk", min_messages_before_compress=6, keep_recent_messages=6, token_budget=200)
+
+
+def test_oversized_summary_is_summarized_again(monkeypatch):
+	summarizer = _FakeSummarizer()
+	monkeypatch.setattr(memory, "_build_summary_llm", lambda api_key: summarizer)
+	history = _oversized_summary_history()
+
+	compressed = asyncio.run(acompress_chat_history(
+		history, {"name": "A"}, "arrival_village", "sk",
+		min_messages_before_compress=6, keep_recent_messages=6, token_budget=200,
+	))
+	assert compressed[0]["content"] == f"{SUMMARY_PREFIX}\n\n- The investigator arrived."
+	assert compressed[1:] == history[1:]
+	assert "message 39" in summarizer.prompts[0]
+	assert not compressible(compressed, "sk", min_messages_before_compress=6, keep_recent_messages=6, token_budget=200)
@@ -0,0 +1,19 @@
+"""select_rules: scene pinning, requires and transition-only rules"""
+from agents.rules import RULES, select_rules
+
+
+def test_scene_pinned_rule_without_a_match():
+	assert "ritual" in RULES["san_check"]["scenes"]
+	assert select_rules("", "ritual") == ("san_check",)
+	assert "san_check" not in select_rules("", "arrival_village")
+
+
+def test_requires_come_along():
+	selected = select_rules("I accept her offer and stay the night at her house", "leddbetter_house")
+	assert "change_scene_triggers" in selected
+	assert "change_scene_rules" in selected
+	assert list(selected) == [rule_id for rule_id in RULES if rule_id in selected]  # Prompt order
+
+
+def test_transition_rules_skipped_without_transitions():
+	assert select_rules("I accept her offer and stay the night at her house", "ending") == ()
@@ -0,0 +1,34 @@
+"""SessionStore LRU eviction and KPSession history trimming"""
+from agents.sessions import KPSession, SessionStore
+
+
+def test_create_evicts_least_recently_used():
+	evicted = []
+	store = SessionStore(max_sessions=2, on_evict=evicted.append)
+	first = store.create({"name": "A"})
+	second = store.create({"name": "B"})
+	assert store.get(first.session_id) is first  # Now more recent than second
+
+	third = store.create({"name": "C"})
+	assert evicted == [second]
+	assert len(store) == 2
+	assert store.get(second.session_id) is None
+	assert store.get(first.session_id) is first
+	assert store.get(third.session_id) is third
+
+
+def test_delete_calls_on_evict():
+	evicted = []
+	store = SessionStore(on_evict=evicted.append)
+	session = store.create({"name": "A"})
+	assert store.delete(session.session_id)
+	assert not store.delete(session.session_id)
+	assert evicted == [session]
+
+
+def test_trim_folds_overflow_into_summary():
+	history = [{"role": "user", "content": f"message {i}"} for i in range(6)]
+	session = KPSession({"name": "A"}, history=history, max_history_messages=4)
+	assert [msg["content"] for msg in session.history] == ["message 2", "message 3", "message 4", "message 5"]
+	assert "message 0" in session.summary and "message 1" in session.summary
+	assert session.chat_history()[0]["content"] == session.summary
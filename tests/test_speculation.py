@@ -0,0 +1,38 @@
+"""CheckSpeculation: taking the continuation of the rolled check"""
+import asyncio
+
+from agents.speculation import CheckSpeculation
+
+
+async def _reply(text):
+	return text
+
+
+def _speculation(conversation):
+	loop = asyncio.get_running_loop()
+	tasks = {tier: loop.create_task(_reply(tier)) for tier in ("success", "failure")}
+	return CheckSpeculation("call_1", tasks, conversation=conversation)
+
+
+def test_take_continuation_of_rolled_tier():
+	async def run():
+		speculation = _speculation((4, "I search the drawer"))
+		return await speculation.take("call_1", "failure", (4, "I search the drawer")), speculation.tiers()
+
+	assert asyncio.run(run()) == ("failure", ())
+
+
+def test_take_drops_continuation_of_stale_history():
+	async def run():
+		speculation = _speculation((4, "I search the drawer"))
+		return await speculation.take("call_1", "success", (6, "I ask May about the festival"))
+
+	assert asyncio.run(run()) is None
+
+
+def test_take_misses_other_check():
+	async def run():
+		speculation = _speculation((4, "I search the drawer"))
+		return await speculation.take("call_2", "success", (4, "I search the drawer"))
+
+	assert asyncio.run(run()) is None
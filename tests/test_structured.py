@@ -0,0 +1,67 @@
+"""parse_keeper_output on malformed responses"""
+import json
+
+from agents.structured import output_format_tokens, parse_keeper_output
+
+CHARACTER = {"name": "A", "spot": 65, "san": 60}
+
+
+def _parse(data, scene="leddbetter_house"):
+	return parse_keeper_output(json.dumps(data), scene, CHARACTER)
+
+
+def test_malformed_json_is_plain_narration():
+	output, problems = parse_keeper_output('{"narration": "The door creaks', "leddbetter_house", CHARACTER)
+	assert output == {"narration": '{"narration": "The door creaks', "checks": [], "scene_change": None}
+	assert problems == ["invalid_json"]
+
+
+def test_json_that_is_not_an_object_is_plain_narration():
+	output, problems = parse_keeper_output("[1, 2]", "leddbetter_house")
+	assert output["narration"] == "[1, 2]" and output["checks"] == []
+	assert problems == ["invalid_json"]
+
+
+def test_skill_value_from_character_sheet():
+	output, problems = _parse({"narration": "", "checks": [
+		{"kind": "dice", "skill_name": "Spot Hidden", "difficulty": "hard", "skill_value": None, "san_loss": None},
+	], "scene_change": None})
+	assert problems == []
+	assert output["checks"][0]["skill_value"] == 65
+
+
+def test_checks_without_trustworthy_values_are_dropped():
+	output, problems = _parse({"narration": "x", "checks": [
+		{"kind": "dice", "skill_name": "Library Use", "skill_value": None},
+		{"kind": "dice", "skill_name": "", "skill_value": 40},
+		{"kind": "san", "san_loss": None},
+		{"kind": "attack"},
+		{"kind": "san", "san_loss": 2},
+	], "scene_change": None})
+	assert problems == ["invalid_check"] * 4
+	assert [check["kind"] for check in output["checks"]] == ["san"]
+	assert output["narration"] == "x"
+
+
+def test_unavailable_scene_change_is_dropped():
+	output, problems = _parse({"narration": "x", "checks": [], "scene_change": "ending"})
+	assert output["scene_change"] is None
+	assert problems == ["invalid_scene"]
+
+
+def test_profile_labels_the_engine_of_the_node(monkeypatch):
+	from agents import kp_agent
+	from agents.profiler import configure_prompt_profiling
+
+	profiles = []
+	monkeypatch.setattr(kp_agent, "ENGINE_MODE", "tools")
+	monkeypatch.setattr(kp_agent, "log_prompt_profile", profiles.append)
+	configure_prompt_profiling(True)
+	try:
+		turn = {"engine": "structured", "current_scene": "leddbetter_house", "prompt_mode": "full", "prompt_components": {"rules": 10}}
+		kp_agent._profile_call(turn, "first", [], {})
+	finally:
+		configure_prompt_profiling(False)
+	assert profiles[0]["engine"] == "structured"
+	# The output format instead of the tool schemas the tools engine would send
+	assert profiles[0]["parts"]["tool_schemas"] == output_format_tokens()
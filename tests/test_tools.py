@@ -0,0 +1,11 @@
+"""Tool calls of the Keeper's re-invoke, which a turn does not run"""
+from langchain_core.messages import AIMessage
+
+from agents.kp_agent import TOOL_CALLS_DROPPED, _drop_reinvoke_tool_calls
+
+
+def test_reinvoke_tool_calls_are_counted_not_run():
+	before = TOOL_CALLS_DROPPED.value(tool="change_scene")
+	response = AIMessage(content="You step inside.", tool_calls=[{"name": "change_scene", "args": {"target_scene": "ritual"}, "id": "call_3"}])
+	_drop_reinvoke_tool_calls(response, {"current_scene": "village_hall"})
+	assert TOOL_CALLS_DROPPED.value(tool="change_scene") == before + 1
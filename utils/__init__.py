@@ -1,6 +1,10 @@
 """Utils package for CoC Solo module"""
 import streamlit as st
-from .logging import init_logger, get_logger, log_message, stop_logger, log_system, log_tool_call
+from .logging import (
+	init_logger, get_logger, log_message, stop_logger, log_system, log_tool_call,
+	bind_session, configure_logging, flush_loggers, shutdown_loggers,
+)
+from .tracing import get_tracer, configure_tracing, enable_session_tracing, disable_session_tracing
 
 
 def initialize_session_state() -> None:
@@ -49,5 +53,13 @@ __all__ = [
 	'stop_logger',
 	'log_system',
 	'log_tool_call',
+	'bind_session',
+	'configure_logging',
+	'flush_loggers',
+	'shutdown_loggers',
+	'get_tracer',
+	'configure_tracing',
+	'enable_session_tracing',
+	'disable_session_tracing',
 ]
 
@@ -1,177 +1,388 @@
 """Markdown logging utility for chat sessions"""
+import atexit
+import contextvars
+import json
 import os
-import sys
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, TextIO
 import streamlit as st
 
+from .metrics import counter, histogram
+
+
+# Key used when no session is bound (Streamlit UI, scripts)
+DEFAULT_SESSION = "default"
+
+# Session whose logger receives log_* calls and trace records in the current context
+_current_session: contextvars.ContextVar[str] = contextvars.ContextVar("kp_log_session", default=DEFAULT_SESSION)
+
+# ID of the API request being handled in the current context (shown in log entries)
+_current_request: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("kp_log_request", default=None)
+
 
 class ChatLogger:
-	"""Log chat messages and system prints to markdown file"""
-	
+	"""Log chat messages, tool calls and trace records to markdown file"""
+
 	def __init__(self, log_dir: str = "logs"):
 		self.log_dir = log_dir
 		self.log_file: Optional[str] = None
-		self.original_print = print
-		self.original_stdout = sys.stdout
-		self.log_buffer: list = []
+		self.log_buffer: deque = deque()  # Entries waiting for the background flusher
 		self.enabled = True
-		
+		self._handle: Optional[TextIO] = None
+		self._written = 0  # File size after the last complete write
+		self._write_failures = 0  # Failed attempts at writing the queued entries
+		self._flush_lock = threading.Lock()
+
 		# Create logs directory if it doesn't exist
 		os.makedirs(log_dir, exist_ok=True)
-	
+
 	def start_session(self, character_name: str = "Unknown") -> str:
 		"""Start a new logging session and return log file path"""
 		timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 		safe_name = "".join(c for c in character_name if c.isalnum() or c in (' ', '-', '_')).strip()[:30]
-		filename = f"{timestamp}_{safe_name}.md"
-		self.log_file = os.path.join(self.log_dir, filename)
-		
-		# Write header
-		with open(self.log_file, 'w', encoding='utf-8') as f:
-			f.write(f"# Chat Session Log\n\n")
-			f.write(f"**Character:** {character_name}\n")
-			f.write(f"**Started:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-			f.write("---\n\n")
-		
+		# Keep one handle open for the whole session; header is written immediately.
+		# Sessions started in the same second get numbered files instead of sharing one
+		suffix = 1
+		while True:
+			filename = f"{timestamp}_{safe_name}.md" if suffix == 1 else f"{timestamp}_{safe_name}_{suffix}.md"
+			self.log_file = os.path.join(self.log_dir, filename)
+			try:
+				self._handle = open(self.log_file, 'x', encoding='utf-8')
+				break
+			except FileExistsError:
+				suffix += 1
+		self._handle.write(f"# Chat Session Log\n\n")
+		self._handle.write(f"**Character:** {character_name}\n")
+		self._handle.write(f"**Started:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+		self._handle.write("---\n\n")
+		self._handle.flush()
+		self._written = self._handle.tell()
+
 		return self.log_file
-	
-	def log_message(self, role: str, content: str, scene: Optional[str] = None):
-		"""Log a chat message"""
+
+	def _enqueue(self, text: str):
+		"""Queue text for the background flusher (the only cost on the request path)"""
 		if not self.log_file:
 			return
-		
-		try:
-			with open(self.log_file, 'a', encoding='utf-8') as f:
-				# Different formatting for player vs keeper
-				if role == "user":
-					f.write(f"## 👤 Player\n\n")
-					f.write(f"{content}\n\n")
-				elif role == "assistant":
-					f.write(f"## 🎭 Keeper")
-					if scene:
-						f.write(f" *(Scene: {scene})*")
-					f.write(f"\n\n{content}\n\n")
-				
-				f.write("---\n\n")
-		except Exception as e:
-			# Silently fail if logging fails
-			pass
-	
-	def log_system(self, message: str):
-		"""Log system/debug message"""
-		if not self.log_file:
+		self.log_buffer.append(text)
+		if len(self.log_buffer) >= _flusher.flush_size:
+			_flusher.wake()
+
+	def flush(self):
+		"""Write all queued entries to the log file"""
+		with self._flush_lock:
+			self._write_queued()
+
+	def _write_queued(self):
+		# Caller holds _flush_lock
+		chunks: List[str] = []
+		while self.log_buffer:
+			chunks.append(self.log_buffer.popleft())
+		if not chunks or not self.log_file:
 			return
-		
+		data = "".join(chunks)
 		try:
-			with open(self.log_file, 'a', encoding='utf-8') as f:
-				f.write(f"### 🔧 System\n\n")
-				f.write(f"```\n{message}\n```\n\n")
+			if self._handle is None:
+				self._reopen()
+			with LOG_WRITE_SECONDS.time():
+				self._handle.write(data)
+				self._handle.flush()
+			self._written = self._handle.tell()
+			self._write_failures = 0
+			LOG_BYTES.inc(len(data))
 		except Exception:
-			pass
-	
-	def log_tool_call(self, tool_name: str, args: dict, result: Optional[str] = None):
-		"""Log tool call information"""
-		if not self.log_file:
-			return
-		
+			# Never fail the turn: retry with a fresh handle on the next flush, then give up on the entries
+			LOG_WRITE_ERRORS.inc()
+			self._drop_handle()
+			self._write_failures += 1
+			if self._write_failures < LOG_WRITE_RETRIES:
+				self.log_buffer.appendleft(data)
+			else:
+				LOG_DROPPED.inc(len(data))
+				self._write_failures = 0
+
+	def _reopen(self):
+		# Cut off what a failed write left behind, so the retry does not duplicate it
+		handle = open(self.log_file, 'a', encoding='utf-8')
 		try:
-			with open(self.log_file, 'a', encoding='utf-8') as f:
-				f.write(f"### 🛠️ Tool: {tool_name}\n\n")
-				f.write(f"**Arguments:**\n```json\n{args}\n```\n\n")
-				if result:
-					f.write(f"**Result:**\n```\n{result[:200]}...\n```\n\n")
-				f.write("---\n\n")
+			if handle.tell() > self._written:
+				handle.truncate(self._written)
 		except Exception:
-			pass
-	
-	def log_print(self, *args, **kwargs):
-		"""Intercept print calls and log them"""
-		# Call original print first
-		self.original_print(*args, **kwargs)
-		
-		# Also log to file
-		if self.log_file and self.enabled:
+			handle.close()
+			raise
+		self._handle = handle
+
+	def _drop_handle(self):
+		handle, self._handle = self._handle, None
+		if handle is not None:
 			try:
-				message = ' '.join(str(arg) for arg in args)
-				with open(self.log_file, 'a', encoding='utf-8') as f:
-					f.write(f"### 🔧 System Output\n\n")
-					f.write(f"```\n{message}\n```\n\n")
+				handle.close()
 			except Exception:
 				pass
-	
+
+	def log_message(self, role: str, content: str, scene: Optional[str] = None):
+		"""Log a chat message"""
+		request_id = _current_request.get()
+		request_note = f" *(Request: {request_id})*" if request_id else ""
+		
+		# Different formatting for player vs keeper
+		if role == "user":
+			text = f"## 👤 Player{request_note}\n\n{content}\n\n"
+		elif role == "assistant":
+			text = f"## 🎭 Keeper"
+			if scene:
+				text += f" *(Scene: {scene})*"
+			text += f"{request_note}\n\n{content}\n\n"
+		else:
+			text = ""
+
+		self._enqueue(text + "---\n\n")
+
+	def log_system(self, message: str):
+		"""Log system/debug message"""
+		self._enqueue(f"### 🔧 System\n\n```\n{message}\n```\n\n")
+
+	def log_tool_call(self, tool_name: str, args: dict, result: Optional[str] = None):
+		"""Log tool call information"""
+		text = f"### 🛠️ Tool: {tool_name}\n\n"
+		text += f"**Arguments:**\n```json\n{args}\n```\n\n"
+		if result:
+			text += f"**Result:**\n```\n{result[:200]}...\n```\n\n"
+		self._enqueue(text + "---\n\n")
+
+	def log_trace(self, record: dict):
+		"""Log a structured trace record (see utils.tracing)"""
+		if self.enabled:
+			line = json.dumps(record, ensure_ascii=False, default=str)
+			self._enqueue(f"### 🔧 Trace: {record.get('event', '')}\n\n```json\n{line}\n```\n\n")
+
+	def log_prompt_profile(self, profile: dict):
+		"""Log the token breakdown of one LLM call (see agents.profiler)"""
+		line = json.dumps(profile, ensure_ascii=False, default=str)
+		self._enqueue(f"### 📏 Prompt Profile: {profile.get('call', '')}\n\n```json\n{line}\n```\n\n")
+
 	def close(self):
 		"""Close the logging session"""
 		if self.log_file:
-			try:
-				with open(self.log_file, 'a', encoding='utf-8') as f:
-					f.write(f"\n\n**Session ended:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-			except Exception:
-				pass
-			self.log_file = None
+			self._enqueue(f"\n\n**Session ended:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+			# Same lock as the background flusher, which may be writing to this handle
+			with self._flush_lock:
+				self._write_queued()
+				self._drop_handle()
+				self.log_file = None
+				self.log_buffer.clear()
 
 
-# Global logger instance
-_logger: Optional[ChatLogger] = None
-_original_print = None
+LOG_WRITE_SECONDS = histogram("kp_log_write_seconds", "Time to write one batch of queued log entries")
+LOG_BYTES = counter("kp_log_bytes_total", "Characters written to session logs")
+LOG_WRITE_ERRORS = counter("kp_log_write_errors_total", "Failed log writes (the entries are retried with a reopened file)")
+LOG_DROPPED = counter("kp_log_dropped_total", "Characters of log entries dropped after KP_LOG_WRITE_RETRIES failed writes")
+# Attempts at writing queued entries before they are dropped
+LOG_WRITE_RETRIES = int(os.getenv("KP_LOG_WRITE_RETRIES", "3"))
 
 
-def get_logger() -> Optional[ChatLogger]:
-	"""Get the global logger instance"""
-	return _logger
+class _LogFlusher:
+	"""Background thread that drains every registered ChatLogger to disk"""
 
+	def __init__(self, flush_interval: float, flush_size: int):
+		self.flush_interval = flush_interval  # Seconds between periodic flushes
+		self.flush_size = flush_size  # Queued entries in one logger that trigger an early flush
+		self._wake = threading.Event()
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+		self._lock = threading.Lock()
+
+	def start(self):
+		with self._lock:
+			if self._thread and self._thread.is_alive():
+				return
+			self._stop.clear()
+			self._thread = threading.Thread(target=self._run, name="chat-log-flusher", daemon=True)
+			self._thread.start()
+
+	def wake(self):
+		self._wake.set()
+
+	def _run(self):
+		while not self._stop.is_set():
+			self._wake.wait(self.flush_interval)
+			self._wake.clear()
+			flush_loggers()
+
+	def stop(self):
+		"""Stop the thread after draining every queue"""
+		with self._lock:
+			thread = self._thread
+			self._thread = None
+		self._stop.set()
+		self._wake.set()
+		if thread:
+			thread.join(timeout=5)
+		flush_loggers()
+
+
+# Registry of loggers keyed by session
+_loggers: "OrderedDict[str, ChatLogger]" = OrderedDict()
+_registry_lock = threading.Lock()
+# Defaults to the API's session cap: closing the logger of a live session would split its log
+_max_loggers = int(os.getenv("KP_LOG_MAX_OPEN", os.getenv("KP_MAX_SESSIONS", "1000")))
+_flusher = _LogFlusher(
+	flush_interval=float(os.getenv("KP_LOG_FLUSH_INTERVAL", "0.5")),
+	flush_size=int(os.getenv("KP_LOG_FLUSH_SIZE", "64")),
+)
+
+
+def configure_logging(
+	flush_interval: Optional[float] = None,
+	flush_size: Optional[int] = None,
+	max_loggers: Optional[int] = None,
+):
+	"""Tune the background flusher and the number of loggers kept open"""
+	global _max_loggers
+	if flush_interval is not None:
+		_flusher.flush_interval = flush_interval
+	if flush_size is not None:
+		_flusher.flush_size = flush_size
+	if max_loggers is not None:
+		_max_loggers = max_loggers
+
+
+def bind_session(session_id: str) -> contextvars.Token:
+	"""Route log_* calls and trace records in the current context to this session's logger"""
+	return _current_session.set(session_id)
+
+
+def current_session() -> str:
+	"""Session bound to the current context (DEFAULT_SESSION when none)"""
+	return _current_session.get()
+
+
+def bind_request(request_id: Optional[str]) -> contextvars.Token:
+	"""Tag log entries and trace records in the current context with an API request ID"""
+	return _current_request.set(request_id)
+
+
+def _resolve(session_id: Optional[str]) -> str:
+	return session_id if session_id is not None else _current_session.get()
+
+
+def get_logger(session_id: Optional[str] = None) -> Optional[ChatLogger]:
+	"""Get the logger of a session (defaults to the session bound to this context) and mark it as recently used"""
+	key = _resolve(session_id)
+	with _registry_lock:
+		logger = _loggers.get(key)
+		if logger is not None:
+			_loggers.move_to_end(key)
+		return logger
+
+
+def find_logger(character_name: str) -> Optional[ChatLogger]:
+	"""Most recently used open logger whose file name matches the character"""
+	with _registry_lock:
+		loggers = list(_loggers.values())
+	for logger in reversed(loggers):
+		if logger.log_file and character_name.lower() in os.path.basename(logger.log_file).lower():
+			return logger
+	return None
+
+
+def init_logger(
+	character_name: str = "Unknown",
+	enable_tracing: bool = False,
+	session_id: Optional[str] = None,
+) -> ChatLogger:
+	"""
+	Initialize the logger for a session.
+
+	With enable_tracing, debug trace records of this session (see utils.tracing)
+	are written to its log as well.
+	"""
+	key = _resolve(session_id)
+	logger = ChatLogger()
+	logger.start_session(character_name)
+
+	with _registry_lock:
+		previous = _loggers.pop(key, None)
+		_loggers[key] = logger
+		evicted = []
+		while len(_loggers) > _max_loggers:
+			evicted.append(_loggers.popitem(last=False))
+	if previous:
+		previous.close()
+	for old_key, old in evicted:
+		old.close()
+		_disable_tracing(old_key)
+
+	_flusher.start()
+
+	if enable_tracing:
+		from .tracing import enable_session_tracing
+		enable_session_tracing(key)
+
+	return logger
+
+
+def _disable_tracing(session_key: str):
+	from .tracing import disable_session_tracing
+	disable_session_tracing(session_key)
+
+
+def flush_loggers():
+	"""Flush every registered logger"""
+	with _registry_lock:
+		loggers = list(_loggers.values())
+	for logger in loggers:
+		logger.flush()
+
+
+def stop_logger(session_id: Optional[str] = None):
+	"""Stop a session's logging"""
+	key = _resolve(session_id)
+	with _registry_lock:
+		logger = _loggers.pop(key, None)
+	if logger:
+		logger.close()
+	_disable_tracing(key)
+
+
+def shutdown_loggers():
+	"""Drain all queues, close every logger and stop the flusher"""
+	_flusher.stop()
+	with _registry_lock:
+		loggers = list(_loggers.values())
+		_loggers.clear()
+	for logger in loggers:
+		logger.close()
 
-def init_logger(character_name: str = "Unknown", enable_print_capture: bool = True) -> ChatLogger:
-	"""Initialize global logger and optionally capture print output"""
-	global _logger, _original_print
-	
-	_logger = ChatLogger()
-	log_file = _logger.start_session(character_name)
-	
-	# Replace print function to also log to file
-	if enable_print_capture:
-		try:
-			import builtins
-			_original_print = builtins.print
-			
-			def logged_print(*args, **kwargs):
-				_original_print(*args, **kwargs)
-				if _logger:
-					_logger.log_print(*args, **kwargs)
-			
-			builtins.print = logged_print
-		except Exception:
-			# If we can't replace print, just continue without print capture
-			pass
-	
-	return _logger
 
+atexit.register(shutdown_loggers)
 
-def stop_logger():
-	"""Stop logging and restore original print"""
-	global _logger, _original_print
-	if _logger:
-		_logger.close()
-		_logger = None
-	if _original_print:
-		__builtins__['print'] = _original_print
-		_original_print = None
 
+def log_message(role: str, content: str, scene: Optional[str] = None, session_id: Optional[str] = None):
+	"""Log a message using the session's logger"""
+	logger = get_logger(session_id)
+	if logger:
+		logger.log_message(role, content, scene)
 
-def log_message(role: str, content: str, scene: Optional[str] = None):
-	"""Log a message using global logger"""
-	if _logger:
-		_logger.log_message(role, content, scene)
 
+def log_system(message: str, session_id: Optional[str] = None):
+	"""Log system message using the session's logger"""
+	logger = get_logger(session_id)
+	if logger:
+		logger.log_system(message)
 
-def log_system(message: str):
-	"""Log system message using global logger"""
-	if _logger:
-		_logger.log_system(message)
 
+def log_tool_call(tool_name: str, args: dict, result: Optional[str] = None, session_id: Optional[str] = None):
+	"""Log tool call using the session's logger"""
+	logger = get_logger(session_id)
+	if logger:
+		logger.log_tool_call(tool_name, args, result)
 
-def log_tool_call(tool_name: str, args: dict, result: Optional[str] = None):
-	"""Log tool call using global logger"""
-	if _logger:
-		_logger.log_tool_call(tool_name, args, result)
 
+def log_prompt_profile(profile: dict, session_id: Optional[str] = None):
+	"""Log a prompt size profile using the session's logger"""
+	logger = get_logger(session_id)
+	if logger:
+		logger.log_prompt_profile(profile)
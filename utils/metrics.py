@@ -0,0 +1,198 @@
+"""In-process Prometheus-style metrics (counters and histograms, text exposition format)"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Latency buckets in seconds, from cheap local work up to slow LLM completions
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+	0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0,
+)
+
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+	parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+	if extra:
+		parts.append(extra)
+	return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+	if value == math.inf:
+		return "+Inf"
+	if float(value).is_integer():
+		return str(int(value))
+	return repr(float(value))
+
+
+class _Metric:
+	type_name = ""
+
+	def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self._lock = threading.Lock()
+
+	def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+		if set(labels) != set(self.labelnames):
+			raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+		return tuple(str(labels[name]) for name in self.labelnames)
+
+	def render(self) -> List[str]:
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+		lines.extend(self._samples())
+		return lines
+
+	def _samples(self) -> List[str]:
+		raise NotImplementedError
+
+
+class Counter(_Metric):
+	"""Monotonically increasing value"""
+
+	type_name = "counter"
+
+	def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+		super().__init__(name, documentation, labelnames)
+		self._values: Dict[Tuple[str, ...], float] = {}
+
+	def inc(self, amount: float = 1.0, **labels: str) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0.0) + amount
+
+	def value(self, **labels: str) -> float:
+		return self._values.get(self._key(labels), 0.0)
+
+	def _samples(self) -> List[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		if not items and not self.labelnames:
+			items = [((), 0.0)]
+		return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+	"""Distribution of observed values in cumulative buckets"""
+
+	type_name = "histogram"
+
+	def __init__(
+		self,
+		name: str,
+		documentation: str,
+		labelnames: Sequence[str] = (),
+		buckets: Sequence[float] = DEFAULT_BUCKETS,
+	):
+		super().__init__(name, documentation, labelnames)
+		self.buckets = tuple(sorted(buckets))
+		# Per label set: [bucket counts..., +Inf count], sum
+		self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+	def observe(self, value: float, **labels: str) -> None:
+		key = self._key(labels)
+		index = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			series = self._series.get(key)
+			if series is None:
+				series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+			series[0][index] += 1
+			series[1][0] += value
+
+	@contextmanager
+	def time(self, **labels: str) -> Iterator[None]:
+		"""Observe the wall-clock duration of the with-block in seconds"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - start, **labels)
+
+	def count(self, **labels: str) -> int:
+		series = self._series.get(self._key(labels))
+		return sum(series[0]) if series else 0
+
+	def _samples(self) -> List[str]:
+		with self._lock:
+			items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+		lines = []
+		for key, (counts, total) in items:
+			cumulative = 0
+			for bound, count in zip(self.buckets + (math.inf,), counts):
+				cumulative += count
+				le = f'le="{_format_value(bound)}"'
+				lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+			lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+			lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+		return lines
+
+
+class MetricsRegistry:
+	"""Named metrics rendered together by /api/metrics"""
+
+	def __init__(self):
+		self._metrics: Dict[str, _Metric] = {}
+		self._lock = threading.Lock()
+
+	def _get_or_create(self, cls, name: str, *args, **kwargs):
+		with self._lock:
+			metric = self._metrics.get(name)
+			if metric is None:
+				metric = self._metrics[name] = cls(name, *args, **kwargs)
+			elif not isinstance(metric, cls):
+				raise ValueError(f"Metric {name} is already registered as {metric.type_name}")
+			return metric
+
+	def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+		return self._get_or_create(Counter, name, documentation, labelnames)
+
+	def histogram(
+		self,
+		name: str,
+		documentation: str,
+		labelnames: Sequence[str] = (),
+		buckets: Optional[Sequence[float]] = None,
+	) -> Histogram:
+		return self._get_or_create(Histogram, name, documentation, labelnames, buckets or DEFAULT_BUCKETS)
+
+	def render(self) -> str:
+		"""Prometheus text exposition format (version 0.0.4)"""
+		with self._lock:
+			metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+		lines: List[str] = []
+		for metric in metrics:
+			lines.extend(metric.render())
+		return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Content type expected by Prometheus scrapers
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+	"""Get or create a counter in the default registry"""
+	return REGISTRY.counter(name, documentation, labelnames)
+
+
+def histogram(
+	name: str,
+	documentation: str,
+	labelnames: Sequence[str] = (),
+	buckets: Optional[Sequence[float]] = None,
+) -> Histogram:
+	"""Get or create a histogram in the default registry"""
+	return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+def render_metrics() -> str:
+	return REGISTRY.render()
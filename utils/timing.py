@@ -0,0 +1,64 @@
+"""Per-request phase timings, rendered as a Server-Timing header"""
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class RequestTimings:
+	"""Accumulates phase durations for one request (repeated phases are summed)"""
+
+	def __init__(self, request_id: str):
+		self.request_id = request_id
+		self.started = time.perf_counter()
+		self._phases: Dict[str, List[float]] = {}  # name -> [total seconds, count]
+
+	def record(self, phase: str, seconds: float) -> None:
+		entry = self._phases.setdefault(phase, [0.0, 0])
+		entry[0] += seconds
+		entry[1] += 1
+
+	def phases(self) -> Dict[str, float]:
+		"""Phase name -> total milliseconds"""
+		return {name: total * 1000 for name, (total, _) in self._phases.items()}
+
+	def server_timing(self) -> str:
+		"""Server-Timing header value, ending with the total request time so far"""
+		parts = []
+		for name, (total, count) in self._phases.items():
+			part = f"{name};dur={total * 1000:.1f}"
+			if count > 1:
+				part += f';desc="x{count}"'
+			parts.append(part)
+		parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+		return ", ".join(parts)
+
+
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+	"kp_request_timings", default=None
+)
+
+
+def start_request_timings(request_id: str) -> RequestTimings:
+	"""Collect phase timings for the request running in the current context"""
+	timings = RequestTimings(request_id)
+	_current_timings.set(timings)
+	return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+	return _current_timings.get()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+	"""Time a phase of the current request (no-op outside a timed request)"""
+	timings = _current_timings.get()
+	if timings is None:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		timings.record(name, time.perf_counter() - start)
@@ -0,0 +1,61 @@
+"""Local (offline) token counting for prompt budgets and size reports"""
+import math
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+# Chat format overhead per message (role, separators), as in OpenAI's token-counting guide
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Words, numbers, and single punctuation marks, roughly how BPE pre-tokenizes text
+_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+_encoding = None
+_encoding_failed = False
+
+
+def _tiktoken_encoding():
+	"""
+	tiktoken encoding when KP_TOKENIZER=tiktoken (its BPE files must already be in
+	the tiktoken cache; counting never goes to the network otherwise)
+	"""
+	global _encoding, _encoding_failed
+	if _encoding is not None or _encoding_failed:
+		return _encoding
+	if os.getenv("KP_TOKENIZER", "approx").lower() != "tiktoken":
+		_encoding_failed = True
+		return None
+	try:
+		import tiktoken
+		_encoding = tiktoken.get_encoding(os.getenv("KP_TIKTOKEN_ENCODING", "o200k_base"))
+	except Exception:
+		_encoding_failed = True
+	return _encoding
+
+
+def _approx_tokens(text: str) -> int:
+	# Common words are one BPE token; longer words split about every 4 characters,
+	# numbers about every 3 digits
+	return sum(
+		max(1, math.ceil((len(piece) - 2) / 4)) if piece.isalpha() else math.ceil(len(piece) / 3)
+		for piece in _PIECES.findall(text)
+	)
+
+
+def count_tokens(text: Optional[str]) -> int:
+	"""Token count of a text (exact with tiktoken, otherwise a close local estimate)"""
+	if not text:
+		return 0
+	encoding = _tiktoken_encoding()
+	if encoding is not None:
+		return len(encoding.encode(text))
+	return _approx_tokens(text)
+
+
+def count_message_tokens(messages: Iterable[Dict[str, str]]) -> int:
+	"""Token count of chat messages ({"role", "content"} dicts) including per-message overhead"""
+	return sum(MESSAGE_OVERHEAD_TOKENS + count_tokens(msg.get("content", "")) for msg in messages)
+
+
+def tokenizer_name() -> str:
+	return "tiktoken" if _tiktoken_encoding() is not None else "approx"
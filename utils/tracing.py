@@ -0,0 +1,211 @@
+"""Leveled, structured, sampled and rate-limited tracing for the KP pipeline"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .logging import _current_request, _current_session, get_logger
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+_LEVEL_NAMES = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR, "OFF": OFF}
+_NAMES_BY_LEVEL = {value: name for name, value in _LEVEL_NAMES.items()}
+
+TraceRecord = Dict[str, Any]
+TraceSink = Callable[[TraceRecord], None]
+
+
+def parse_level(level: Any) -> int:
+	"""Accept a level name ("debug", "INFO", ...) or number"""
+	if isinstance(level, int):
+		return level
+	return _LEVEL_NAMES[str(level).strip().upper()]
+
+
+def _parse_modules(spec: str) -> Dict[str, int]:
+	"""Parse "kp_agent=DEBUG,memory=INFO" into per-module levels"""
+	modules = {}
+	for part in spec.split(","):
+		if "=" in part:
+			name, level = part.split("=", 1)
+			modules[name.strip()] = parse_level(level)
+	return modules
+
+
+class _RateLimiter:
+	"""Token bucket per (module, event): at most `rate` records per second"""
+
+	def __init__(self, rate: float):
+		self.rate = rate
+		self._buckets: Dict[tuple, tuple] = {}
+		self._lock = threading.Lock()
+
+	def allow(self, key: tuple) -> bool:
+		if self.rate <= 0:
+			return True
+		now = time.monotonic()
+		with self._lock:
+			tokens, last = self._buckets.get(key, (self.rate, now))
+			tokens = min(self.rate, tokens + (now - last) * self.rate)
+			if tokens < 1:
+				self._buckets[key] = (tokens, now)
+				return False
+			self._buckets[key] = (tokens - 1, now)
+			return True
+
+
+class Tracer:
+	"""
+	Per-module tracer. Level checks are a couple of comparisons, so disabled
+	trace calls cost next to nothing on the hot path.
+	"""
+
+	def __init__(self, module: str):
+		self.module = module
+		self.level = _module_level(module)
+
+	def enabled(self, level: int = DEBUG) -> bool:
+		"""True if a record at this level would be emitted in the current context"""
+		if level >= self.level:
+			return True
+		return bool(_session_levels) and level >= _session_levels.get(_current_session.get(), OFF)
+
+	def _emit(self, level: int, event: str, fields: Dict[str, Any]) -> None:
+		session = _current_session.get()
+		if level < self.level:
+			# Only reachable through a per-session debug override; never sampled away
+			if not _session_levels or level < _session_levels.get(session, OFF):
+				return
+		elif _config["sample_rate"] < 1.0 and random.random() >= _config["sample_rate"]:
+			return
+		if not _rate_limiter.allow((self.module, event)):
+			return
+
+		record: TraceRecord = {
+			"ts": round(time.time(), 3),
+			"level": _NAMES_BY_LEVEL.get(level, str(level)),
+			"module": self.module,
+			"event": event,
+			"session": session,
+			"request_id": _current_request.get(),
+			"fields": fields,
+		}
+		for sink in list(_sinks):
+			try:
+				sink(record)
+			except Exception:
+				# Tracing must never break a turn
+				pass
+
+	def debug(self, event: str, **fields: Any) -> None:
+		if DEBUG >= self.level or _session_levels:
+			self._emit(DEBUG, event, fields)
+
+	def info(self, event: str, **fields: Any) -> None:
+		if INFO >= self.level or _session_levels:
+			self._emit(INFO, event, fields)
+
+	def warning(self, event: str, **fields: Any) -> None:
+		if WARNING >= self.level or _session_levels:
+			self._emit(WARNING, event, fields)
+
+	def error(self, event: str, **fields: Any) -> None:
+		if ERROR >= self.level or _session_levels:
+			self._emit(ERROR, event, fields)
+
+
+# ==================== CONFIGURATION ====================
+
+_config: Dict[str, Any] = {
+	"level": parse_level(os.getenv("KP_TRACE_LEVEL", "WARNING")),
+	"modules": _parse_modules(os.getenv("KP_TRACE_MODULES", "")),
+	"sample_rate": float(os.getenv("KP_TRACE_SAMPLE", "1.0")),
+}
+_rate_limiter = _RateLimiter(float(os.getenv("KP_TRACE_RATE", "50")))
+_tracers: Dict[str, Tracer] = {}
+_session_levels: Dict[str, int] = {}  # Per-session overrides for debugging
+_sinks: List[TraceSink] = []
+
+
+def _module_level(module: str) -> int:
+	return _config["modules"].get(module, _config["level"])
+
+
+def get_tracer(module: str) -> Tracer:
+	"""Get (or create) the tracer for a module"""
+	tracer = _tracers.get(module)
+	if tracer is None:
+		tracer = _tracers[module] = Tracer(module)
+	return tracer
+
+
+def configure_tracing(
+	level: Optional[Any] = None,
+	modules: Optional[Dict[str, Any]] = None,
+	sample_rate: Optional[float] = None,
+	rate_limit: Optional[float] = None,
+) -> None:
+	"""
+	Configure tracing.
+
+	Args:
+		level: Default level for all modules (records below it are dropped)
+		modules: Per-module levels, e.g. {"kp_agent": "DEBUG"}
+		sample_rate: Fraction of records kept (per-session overrides are not sampled)
+		rate_limit: Max records per second per (module, event); 0 disables the limit
+	"""
+	if level is not None:
+		_config["level"] = parse_level(level)
+	if modules is not None:
+		_config["modules"] = {name: parse_level(value) for name, value in modules.items()}
+	if sample_rate is not None:
+		_config["sample_rate"] = sample_rate
+	if rate_limit is not None:
+		_rate_limiter.rate = rate_limit
+	for tracer in _tracers.values():
+		tracer.level = _module_level(tracer.module)
+
+
+def enable_session_tracing(session_id: str, level: Any = DEBUG) -> None:
+	"""Trace one session at `level` regardless of the module levels"""
+	_session_levels[session_id] = parse_level(level)
+
+
+def disable_session_tracing(session_id: str) -> None:
+	_session_levels.pop(session_id, None)
+
+
+def add_sink(sink: TraceSink) -> None:
+	_sinks.append(sink)
+
+
+def remove_sink(sink: TraceSink) -> None:
+	if sink in _sinks:
+		_sinks.remove(sink)
+
+
+# ==================== SINKS ====================
+
+def session_log_sink(record: TraceRecord) -> None:
+	"""Write records to the markdown log of the session they belong to"""
+	logger = get_logger(record["session"])
+	if logger:
+		logger.log_trace(record)
+
+
+def stderr_sink(record: TraceRecord) -> None:
+	"""Write records to stderr as JSON lines"""
+	sys.stderr.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+add_sink(session_log_sink)
+if os.getenv("KP_TRACE_STDERR", "0") == "1":
+	add_sink(stderr_sink)
@@ -1,10 +1,14 @@
+import { randomUUID } from "crypto";
 import { NextRequest, NextResponse } from "next/server";
 
 export async function POST(request: NextRequest) {
   let currentScene = "arrival_village";
+  // One ID per turn, shared with the Python backend (response headers and session log)
+  const requestId = request.headers.get("x-request-id") || randomUUID().replace(/-/g, "");
+  const proxyStart = performance.now();
   try {
     const body = await request.json();
-    const { user_input, character, chat_history, api_key, current_scene } = body;
+    const { user_input, character, chat_history, api_key, current_scene, session_id, pending_checks, check_results, prompt_mode } = body;
     currentScene = current_scene || "arrival_village";
 
     const pythonBackendUrl = process.env.PYTHON_BACKEND_URL || "http://localhost:8000";
@@ -13,6 +17,7 @@ export async function POST(request: NextRequest) {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
+        "X-Request-ID": requestId,
       },
       body: JSON.stringify({
         user_input,
@@ -20,6 +25,10 @@ export async function POST(request: NextRequest) {
         chat_history,
         api_key,
         current_scene,
+        session_id,
+        pending_checks,
+        check_results,
+        prompt_mode,
       }),
     });
 
@@ -28,7 +37,15 @@ export async function POST(request: NextRequest) {
     }
 
     const data = await response.json();
-    return NextResponse.json(data);
+    // Pass the backend breakdown through and add the time spent in this proxy
+    const backendTiming = response.headers.get("server-timing");
+    const proxyTiming = `proxy;dur=${(performance.now() - proxyStart).toFixed(1)}`;
+    return NextResponse.json(data, {
+      headers: {
+        "X-Request-ID": response.headers.get("x-request-id") || requestId,
+        "Server-Timing": backendTiming ? `${backendTiming}, ${proxyTiming}` : proxyTiming,
+      },
+    });
   } catch (error) {
     console.error("KP response API error:", error);
     return NextResponse.json(
@@ -36,8 +53,9 @@ export async function POST(request: NextRequest) {
         error: error instanceof Error ? error.message : "Unknown error",
         response: "⚠️ Error: Unable to reach KP backend.",
         current_scene: currentScene,
+        request_id: requestId,
       },
-      { status: 500 }
+      { status: 500, headers: { "X-Request-ID": requestId } }
     );
   }
 }
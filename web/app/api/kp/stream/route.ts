@@ -0,0 +1,54 @@
+import { randomUUID } from "crypto";
+import { NextRequest, NextResponse } from "next/server";
+
+export async function POST(request: NextRequest) {
+  const requestId = request.headers.get("x-request-id") || randomUUID().replace(/-/g, "");
+  try {
+    const body = await request.json();
+    const { user_input, character, chat_history, api_key, current_scene, session_id, pending_checks, check_results, prompt_mode } = body;
+
+    const pythonBackendUrl = process.env.PYTHON_BACKEND_URL || "http://localhost:8000";
+
+    const response = await fetch(`${pythonBackendUrl}/api/kp/stream`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-Request-ID": requestId,
+      },
+      body: JSON.stringify({
+        user_input,
+        character,
+        chat_history,
+        api_key,
+        current_scene,
+        session_id,
+        pending_checks,
+        check_results,
+        prompt_mode,
+      }),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Python backend error: ${response.statusText}`);
+    }
+
+    // Pass the SSE stream through unbuffered
+    return new Response(response.body, {
+      headers: {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        Connection: "keep-alive",
+        "X-Request-ID": response.headers.get("x-request-id") || requestId,
+      },
+    });
+  } catch (error) {
+    console.error("KP stream API error:", error);
+    return NextResponse.json(
+      {
+        error: error instanceof Error ? error.message : "Unknown error",
+        request_id: requestId,
+      },
+      { status: 500, headers: { "X-Request-ID": requestId } }
+    );
+  }
+}
@@ -0,0 +1,40 @@
+import { NextRequest, NextResponse } from "next/server";
+
+export async function POST(request: NextRequest) {
+  try {
+    const body = await request.json();
+    const { character, current_scene, chat_history, prompt_mode, speculate_checks, prefetch_narration } = body;
+
+    const pythonBackendUrl = process.env.PYTHON_BACKEND_URL || "http://localhost:8000";
+
+    const response = await fetch(`${pythonBackendUrl}/api/sessions`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        character,
+        current_scene,
+        chat_history,
+        prompt_mode,
+        speculate_checks,
+        prefetch_narration,
+      }),
+    });
+
+    if (!response.ok) {
+      throw new Error(`Python backend error: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+    return NextResponse.json(data);
+  } catch (error) {
+    console.error("Session API error:", error);
+    return NextResponse.json(
+      {
+        error: error instanceof Error ? error.message : "Unknown error",
+      },
+      { status: 500 }
+    );
+  }
+}
@@ -2,11 +2,110 @@ import { Character, Message } from "@/store/useStore";
 
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE || "/api";
 
+export interface PendingCheck {
+  request_id: string;
+  kind: "dice" | "san";
+  skill: string;
+  difficulty: string;
+  target: number;
+  san_loss: number;
+  marker: string;
+}
+
 export interface KPResponse {
   response: string;
   current_scene: string;
   character?: Character;
   compressed_history?: Message[];
+  session_id?: string;
+  request_id?: string;
+  pending_checks?: PendingCheck[];
+  pending_check?: PendingCheck | null;
+  usage?: Record<string, number>;
+  prompt_components?: Record<string, number>;
+}
+
+export type PromptMode = "full" | "slim";
+
+export interface CheckResult {
+  request_id: string;
+  roll: number;
+}
+
+export interface KPSessionState {
+  session_id: string;
+  character: Character;
+  current_scene: string;
+  chat_history: Message[];
+  auto_roll?: { all_checks: boolean; skills: string[]; seed: number; rolls: number } | null;
+  pending_checks?: PendingCheck[];
+  prompt_mode?: PromptMode | null;
+  speculate_checks?: boolean;
+  prefetch_narration?: boolean;
+}
+
+/**
+ * Create a server-side session. Afterwards send only the new input with
+ * getSessionKPResponse; the server keeps history, summary, character and scene.
+ */
+export async function createSession(
+  character: Character,
+  currentScene: string,
+  chatHistory: Message[] = [],
+  promptMode?: PromptMode,
+  speculateChecks?: boolean,
+  prefetchNarration?: boolean
+): Promise<KPSessionState> {
+  const response = await fetch(`${API_BASE}/sessions`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      character,
+      current_scene: currentScene,
+      chat_history: chatHistory,
+      prompt_mode: promptMode,
+      speculate_checks: speculateChecks,
+      prefetch_narration: prefetchNarration,
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`API error: ${response.statusText}`);
+  }
+
+  return response.json();
+}
+
+/**
+ * One turn of a server-side session. Rolls for the previous turn's
+ * pending_checks can be sent together as checkResults (one narration covers them).
+ */
+export async function getSessionKPResponse(
+  sessionId: string,
+  userInput: string,
+  apiKey: string,
+  checkResults: CheckResult[] = []
+): Promise<KPResponse> {
+  const response = await fetch(`${API_BASE}/kp/response`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      session_id: sessionId,
+      user_input: userInput,
+      api_key: apiKey,
+      check_results: checkResults,
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error(`API error: ${response.statusText}`);
+  }
+
+  return response.json();
 }
 
 export async function getKPResponse(
@@ -37,6 +136,86 @@ export async function getKPResponse(
   return response.json();
 }
 
+export interface KPStreamEvent {
+  event: "token" | "dice_request" | "san_request" | "scene_change" | "dice_result" | "san_result" | "timing" | "result" | "error";
+  data: any;
+}
+
+/**
+ * Stream a Keeper turn over Server-Sent Events.
+ * `onEvent` receives narration tokens and tool-call events as they arrive;
+ * the resolved value is the final KPResponse (same shape as getKPResponse).
+ */
+export async function streamKPResponse(
+  userInput: string,
+  character: Character,
+  chatHistory: Message[],
+  apiKey: string,
+  currentScene: string,
+  onEvent: (event: KPStreamEvent) => void
+): Promise<KPResponse> {
+  const response = await fetch(`${API_BASE}/kp/stream`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      user_input: userInput,
+      character,
+      chat_history: chatHistory,
+      api_key: apiKey,
+      current_scene: currentScene,
+    }),
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`API error: ${response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result: KPResponse | null = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+
+      let eventName = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event: ")) eventName = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      if (!data) continue;
+
+      const event: KPStreamEvent = {
+        event: eventName as KPStreamEvent["event"],
+        data: JSON.parse(data),
+      };
+      if (event.event === "error") {
+        throw new Error(`API error: ${event.data.detail}`);
+      }
+      if (event.event === "result") {
+        result = event.data as KPResponse;
+      }
+      onEvent(event);
+    }
+  }
+
+  if (!result) {
+    throw new Error("API error: stream ended without a result");
+  }
+  return result;
+}
+
 export async function downloadLog(characterName: string): Promise<Blob> {
   const response = await fetch(
     `${API_BASE}/logs/download?character=${encodeURIComponent(characterName)}`,